@@ -0,0 +1,193 @@
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+import csv
+import os
+import time
+import traceback
+import pandas as pd
+
+import stats
+from store import ingest_run
+from schema import KEY, RESULTS_COLUMNS, compact
+
+REQUIRED_COLUMNS = ["experiment", "nuclei_dir", "foci_dir"]
+PATH_COLUMNS = ["nuclei_dir", "foci_dir", "output_dir"]
+PROGRESS_FILE = "manifest_progress.csv"
+PROGRESS_COLUMNS = ["experiment", "status", "seconds", "finished", "message"]
+
+
+def read_manifest(path):
+    """
+    Read a batch manifest (.csv or .yaml/.yml) into a DataFrame.
+
+    Required columns: experiment, nuclei_dir, foci_dir.
+    Optional: output_dir (defaults to foci_dir). Every other column is a condition
+    column (e.g. condition, cell_line, treatment) copied into the consolidated results.
+
+    YAML layout: a list of mappings, or {"experiments": [...]}.
+    """
+    path = Path(str(path).strip())
+    if not path.exists():
+        raise FileNotFoundError(f"Manifest {path} is not found!")
+
+    if path.suffix.lower() in (".yaml", ".yml"):
+        try:
+            import yaml
+        except ImportError:
+            raise ImportError("Reading a YAML manifest requires PyYAML (pip install pyyaml).")
+        with open(path) as f:
+            data = yaml.safe_load(f)
+        if isinstance(data, dict):
+            data = data.get("experiments", [])
+        manifest = pd.DataFrame(data)
+    else:
+        manifest = pd.read_csv(path, dtype=str, skipinitialspace=True)
+
+    manifest.columns = manifest.columns.str.strip()
+    missing = [c for c in REQUIRED_COLUMNS if c not in manifest.columns]
+    if missing:
+        raise KeyError(f"Manifest {path.name} misses columns {missing}. Found: {list(manifest.columns)}")
+    if "output_dir" not in manifest.columns:
+        manifest["output_dir"] = manifest["foci_dir"]
+    manifest["output_dir"] = manifest["output_dir"].fillna(manifest["foci_dir"])
+
+    if manifest["experiment"].duplicated().any():
+        dup = manifest.loc[manifest["experiment"].duplicated(), "experiment"].tolist()
+        raise ValueError(f"Experiment names in the manifest must be unique. Duplicated: {dup}")
+
+    # relative paths are resolved against the manifest location
+    for col in PATH_COLUMNS:
+        manifest[col] = [
+            str(p) if Path(str(p).strip()).is_absolute() else str(path.parent / str(p).strip())
+            for p in manifest[col]
+        ]
+
+    return manifest
+
+
+def condition_columns(manifest):
+    return [c for c in manifest.columns if c not in REQUIRED_COLUMNS + ["output_dir"]]
+
+
+def read_progress(output_dir):
+    path = Path(output_dir) / PROGRESS_FILE
+    if not path.exists():
+        return pd.DataFrame(columns=PROGRESS_COLUMNS)
+    return pd.read_csv(path, dtype={"experiment": str})
+
+
+def append_progress(output_dir, row):
+    """
+    Append-only progress journal, used to resume a partially completed manifest.
+    """
+    path = Path(output_dir) / PROGRESS_FILE
+    new_file = not path.exists()
+    with open(path, "a", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=PROGRESS_COLUMNS)
+        if new_file:
+            writer.writeheader()
+        writer.writerow(row)
+
+
+def run_experiment(experiment, nuclei_dir, foci_dir, output_dir, model_path=None):
+    """
+    Worker: run stats.main for one experiment. Returns (experiment, status, seconds, message).
+    Exceptions are reported, not raised, so one bad experiment does not stop the pool.
+    """
+    start = time.perf_counter()
+    try:
+        Path(output_dir).mkdir(parents=True, exist_ok=True)
+        stats.main(nuclei_dir, foci_dir, output_dir, model_path=model_path)
+        return experiment, "done", time.perf_counter() - start, ""
+    except Exception as e:
+        traceback.print_exc()
+        return experiment, "failed", time.perf_counter() - start, f"{type(e).__name__}: {e}"
+
+
+def consolidate(manifest, done):
+    """
+    Concatenate results.csv of finished experiments, with experiment + condition columns in front.
+    """
+    conditions = condition_columns(manifest)
+    dfs = []
+    for _, row in manifest[manifest["experiment"].isin(done)].iterrows():
+        path = Path(row["output_dir"]) / "results.csv"
+        if not path.exists():
+            print(f"WARNING: results.csv of experiment {row['experiment']} is not found: {path}")
+            continue
+        df = compact(pd.read_csv(path), RESULTS_COLUMNS, path.name, downcast=False)
+        df.insert(0, "experiment", row["experiment"])
+        for i, c in enumerate(conditions, start=1):
+            df.insert(i, c, row[c])
+        dfs.append(df)
+
+    if not dfs:
+        return pd.DataFrame(columns=["experiment"] + conditions)
+    # experiment / condition / file keys repeat on every row -> categorical
+    results = pd.concat(dfs, ignore_index=True)
+    return compact(results, {**RESULTS_COLUMNS, **{c: KEY for c in conditions}}, "results_all", downcast=False)
+
+
+def run_manifest(manifest_path, output_dir, workers=None, resume=True, model_path=None, db_path=None):
+    """
+    Run all experiments of a manifest on a shared process pool.
+    With db_path, every finished experiment is ingested into the results database (store.py)
+    together with its condition columns.
+
+    Writes into output_dir:
+      - results_all.csv        consolidated results with condition columns
+      - timing.csv             per-experiment wall time and status
+      - manifest_progress.csv  append-only journal used by resume
+    """
+    manifest = read_manifest(manifest_path)
+    output_dir = Path(str(output_dir).strip())
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    progress = read_progress(output_dir)
+    done = set(progress.loc[progress["status"] == "done", "experiment"]) if resume else set()
+    todo = manifest[~manifest["experiment"].isin(done)]
+
+    print(f"Manifest: {len(manifest)} experiment(s), {len(done & set(manifest['experiment']))} already done, "
+          f"{len(todo)} to run.")
+
+    workers = workers or min(len(todo), os.cpu_count() or 1) or 1
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(run_experiment, row["experiment"], row["nuclei_dir"], row["foci_dir"],
+                        row["output_dir"], model_path)
+            for _, row in todo.iterrows()
+        ]
+        for fut in as_completed(futures):
+            experiment, status, seconds, message = fut.result()
+            append_progress(output_dir, {
+                "experiment": experiment,
+                "status": status,
+                "seconds": round(seconds, 3),
+                "finished": datetime.now().isoformat(timespec="seconds"),
+                "message": message,
+            })
+            if status == "done":
+                done.add(experiment)
+                if db_path:
+                    row = manifest.loc[manifest["experiment"] == experiment].iloc[0]
+                    ingest_run(db_path, row["output_dir"], experiment,
+                               {c: row[c] for c in condition_columns(manifest)}, foci_dir=row["foci_dir"])
+            print(f"Experiment {experiment}: {status} in {seconds:.1f} s. {message}".rstrip())
+
+    # Timing report: last record of every experiment in the manifest
+    progress = read_progress(output_dir)
+    timing = progress.drop_duplicates("experiment", keep="last")
+    timing = timing[timing["experiment"].isin(manifest["experiment"])]
+    timing.to_csv(output_dir / "timing.csv", index=False)
+
+    results = consolidate(manifest, done)
+    results.to_csv(output_dir / "results_all.csv", index=False)
+
+    failed = timing.loc[timing["status"] == "failed", "experiment"].tolist()
+    print(f"Consolidated results of {results['experiment'].nunique()} experiment(s) are saved in "
+          f"the directory: {output_dir}.")
+    if failed:
+        print(f"Failed experiment(s): {failed}. Re-run with resume to retry them.")
+
+    return results
@@ -0,0 +1,69 @@
+"""
+Start-up benchmark of stats.py: wall time of fresh interpreters that
+
+  - only import stats,
+  - import stats and run a pure aggregation (aggregation_foci on a run directory),
+  - import stats plus the imaging/plotting modules the original stats.py imported at module level.
+
+Usage:
+    python bench_import.py [<run_dir with *_extent.csv>] [--repeat 10]
+"""
+from pathlib import Path
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+# exactly the modules the original stats.py imported at module level, so the eager case is
+# the real before/after comparison (tifffile and scikit-learn were never imported eagerly)
+HEAVY = ["matplotlib.pyplot", "matplotlib.patches", "skimage.color", "skimage.draw",
+         "PIL.Image", "PIL.ImageDraw"]
+HERE = Path(__file__).resolve().parent
+
+
+def run(code, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], cwd=HERE, check=True,
+                       stdout=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def loaded_heavy(code):
+    check = code + "; import sys; print(','.join(m for m in %r if m in sys.modules))" % (HEAVY,)
+    out = subprocess.run([sys.executable, "-c", check], cwd=HERE, check=True,
+                         capture_output=True, text=True).stdout.strip().splitlines()
+    return out[-1] if out else ""
+
+
+def main(run_dir=None, repeat=10):
+    cases = {
+        "python (empty)": "pass",
+        "import stats": "import stats",
+        "import stats + eager heavy modules": "import stats; " + "; ".join(f"import {m}" for m in HEAVY),
+    }
+    if run_dir:
+        cases["aggregation run"] = f"import stats; stats.aggregation_foci({str(run_dir)!r})"
+
+    rows = []
+    for name, code in cases.items():
+        seconds = run(code, repeat)
+        rows.append((name, seconds, loaded_heavy(code)))
+        print(f"{name:<38} {seconds * 1000:8.0f} ms   heavy modules: {rows[-1][2] or '-'}")
+
+    lazy = dict((r[0], r[1]) for r in rows)
+    base = lazy["python (empty)"]
+    ratio = (lazy["import stats"] - base) / max(lazy["import stats + eager heavy modules"] - base, 1e-9)
+    print(f"import stats costs {ratio:.0%} of the eager import (interpreter start-up excluded).")
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Start-up time of stats.py in fresh interpreters.")
+    parser.add_argument("run_dir", nargs="?", default=None, help="Run directory with *_extent.csv files")
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+    main(args.run_dir, args.repeat)
@@ -0,0 +1,168 @@
+from pathlib import Path
+import json
+import re
+import numpy as np
+import pandas as pd
+
+# Fallback values, used only when neither the ThunderSTORM protocol nor the image has a calibration
+DEFAULT_PX_SIZE_X = 57.5
+DEFAULT_PX_SIZE_Y = 58.7
+
+INDEX_FILE = "calibration.csv"
+INDEX_COLUMNS = ["Foci_file", "Image_file", "Foci_mtime", "Image_mtime", "Protocol_mtime", "px_size_x", "px_size_y", "source"]
+
+# TIFF tags
+TAG_IMAGE_DESCRIPTION = 270
+TAG_X_RESOLUTION = 282
+TAG_Y_RESOLUTION = 283
+TAG_RESOLUTION_UNIT = 296
+
+UNIT_TO_NM = {
+    "nm": 1.0, "nanometer": 1.0,
+    "micron": 1e3, "microns": 1e3, "um": 1e3, "µm": 1e3, "μm": 1e3, "\\u00b5m": 1e3,
+    "mm": 1e6, "cm": 1e7,
+}
+
+
+def protocol_path(foci_csv):
+    """
+    ThunderSTORM writes the protocol next to the exported table: <name>-protocol.txt
+    """
+    foci_csv = Path(foci_csv)
+    return foci_csv.with_name(foci_csv.stem + "-protocol.txt")
+
+
+def protocol_pixel_size(foci_csv):
+    """
+    Camera pixel size [nm] used by ThunderSTORM to convert the localizations to nm.
+    Returns NaN if there is no protocol file or it has no pixel size.
+    """
+    path = protocol_path(foci_csv)
+    if not path.exists():
+        return np.nan
+
+    text = path.read_text(errors="ignore")
+    try:
+        camera = json.loads(text).get("cameraSettings", {})
+        return float(camera["pixelSize"])
+    except (ValueError, KeyError, AttributeError):
+        # older protocols are not strictly JSON
+        m = re.search(r'"?pixelSize"?\s*[:=]\s*([0-9.eE+-]+)', text)
+        return float(m.group(1)) if m else np.nan
+
+
+def tiff_pixel_size(image_path):
+    """
+    Pixel size [nm] of an image from its TIFF calibration (ImageJ stores
+    pixels per unit in X/YResolution and the unit in the ImageDescription).
+    Returns (NaN, NaN) for uncalibrated images.
+    """
+    from PIL import Image
+
+    try:
+        with Image.open(image_path) as im:
+            tags = dict(getattr(im, "tag_v2", {}) or {})
+    except (OSError, ValueError):
+        return np.nan, np.nan
+
+    x_res = tags.get(TAG_X_RESOLUTION)
+    y_res = tags.get(TAG_Y_RESOLUTION)
+    if not x_res:
+        return np.nan, np.nan
+    y_res = y_res or x_res
+
+    description = str(tags.get(TAG_IMAGE_DESCRIPTION, ""))
+    m = re.search(r"^unit=(.+)$", description, flags=re.MULTILINE)
+    if m:
+        factor = UNIT_TO_NM.get(m.group(1).strip().lower())
+    else:
+        # 2 = inch, 3 = cm (TIFF ResolutionUnit)
+        factor = {3: 1e7, 2: 2.54e7}.get(tags.get(TAG_RESOLUTION_UNIT))
+    if factor is None:
+        return np.nan, np.nan
+
+    return factor / float(x_res), factor / float(y_res)
+
+
+def _mtime(path):
+    path = Path(path) if path is not None else None
+    return path.stat().st_mtime if path is not None and path.exists() else np.nan
+
+
+def _same_mtime(cached, current):
+    # mtimes are ~1.8e9 s: a relative tolerance would accept hours, compare to the millisecond
+    return bool(np.isclose(float(cached), current, rtol=0, atol=1e-3, equal_nan=True))
+
+
+def read_index(dir_foci):
+    path = Path(dir_foci) / INDEX_FILE
+    if not path.exists():
+        return pd.DataFrame(columns=INDEX_COLUMNS)
+    # file names stay strings: an empty Image_file (no image) must not come back as NaN
+    return pd.read_csv(path, dtype={"Foci_file": str, "Image_file": str, "source": str},
+                       keep_default_na=False, na_values={c: [""] for c in INDEX_COLUMNS if c.endswith("_mtime")})
+
+
+def calibrate_pairs(pairs, dir_foci):
+    """
+    Pixel size of every image in the nm coordinate system of its foci table.
+
+    pairs : list of (foci_csv_path, image_path)
+    Returns a DataFrame indexed by foci file name with px_size_x, px_size_y, source.
+
+    Precedence: ThunderSTORM protocol pixel size (the localizations were computed with it),
+    then image TIFF calibration, then DEFAULT_PX_SIZE_X/Y.
+    Results are cached in <dir_foci>/calibration.csv and only re-read when the image,
+    foci table, protocol modification time changes.
+    """
+    index = read_index(dir_foci).set_index("Foci_file", drop=False)
+    rows = []
+    changed = False
+
+    for foci_csv, image in pairs:
+        foci_csv = Path(foci_csv)
+        foci_mtime = _mtime(foci_csv)
+        image_mtime = _mtime(image)
+        protocol_mtime = _mtime(protocol_path(foci_csv))
+
+        if foci_csv.name in index.index:
+            cached = index.loc[foci_csv.name]
+            if (str(cached["Image_file"]) == str(Path(image).name if image else "")
+                    and _same_mtime(cached.get("Foci_mtime", np.nan), foci_mtime)
+                    and _same_mtime(cached["Image_mtime"], image_mtime)
+                    and _same_mtime(cached["Protocol_mtime"], protocol_mtime)):
+                rows.append(cached.to_dict())
+                continue
+
+        changed = True
+        px = protocol_pixel_size(foci_csv)
+        if np.isfinite(px):
+            px_x, px_y, source = px, px, "protocol"
+        else:
+            px_x, px_y = tiff_pixel_size(image) if image else (np.nan, np.nan)
+            source = "image"
+            if not (np.isfinite(px_x) and np.isfinite(px_y)):
+                px_x, px_y, source = DEFAULT_PX_SIZE_X, DEFAULT_PX_SIZE_Y, "default"
+                print(f"WARNING: no calibration for {foci_csv.name}, using default pixel size "
+                      f"{DEFAULT_PX_SIZE_X} x {DEFAULT_PX_SIZE_Y} nm.")
+
+        rows.append({
+            "Foci_file": foci_csv.name,
+            "Image_file": Path(image).name if image else "",
+            "Foci_mtime": foci_mtime,
+            "Image_mtime": image_mtime,
+            "Protocol_mtime": protocol_mtime,
+            "px_size_x": float(px_x),
+            "px_size_y": float(px_y),
+            "source": source,
+        })
+
+    calibration = pd.DataFrame(rows, columns=INDEX_COLUMNS)
+
+    if changed:
+        # keep cached entries of files that were not part of this call
+        rest = index[~index.index.isin(calibration["Foci_file"])].reset_index(drop=True)
+        updated = pd.concat([rest, calibration], ignore_index=True) if not rest.empty else calibration
+        updated.to_csv(Path(dir_foci) / INDEX_FILE, index=False)
+
+    return calibration.set_index("Foci_file")
@@ -0,0 +1,158 @@
+from pathlib import Path
+import pickle
+import numpy as np
+import pandas as pd
+# scikit-learn is imported in fit_clusters only: loading a saved model unpickles it anyway
+
+FEATURES = ["mean_intensity", "sigma [nm]"]
+
+
+def extent_files(dirs):
+    """
+    Collect all *_extent.csv files from one or several run directories.
+    """
+    if isinstance(dirs, (str, Path)):
+        dirs = [dirs]
+
+    files = []
+    for d in dirs:
+        path = Path(str(d).strip())
+        if not path.exists():
+            raise FileNotFoundError(f"Directory {path} is not found!")
+        files.extend(sorted(path.glob("*_extent.csv")))
+
+    if not files:
+        raise FileNotFoundError(f"No _extent.csv files found in: {[str(d) for d in dirs]}")
+    return files
+
+
+def iter_features(files, features=FEATURES, chunksize=100_000):
+    """
+    Stream feature matrices (float64, NaN rows dropped) from foci tables chunk by chunk,
+    so the whole experiment never has to be in memory at once.
+    """
+    for f in files:
+        for chunk in pd.read_csv(f, chunksize=chunksize, skipinitialspace=True):
+            chunk.columns = chunk.columns.str.strip()
+            missing = [c for c in features if c not in chunk.columns]
+            if missing:
+                raise KeyError(f"In foci file {f.name} expected columns {missing}. Found: {list(chunk.columns)}")
+            X = chunk[features].to_numpy(dtype=np.float64)
+            X = X[~np.isnan(X).any(axis=1)]
+            if X.shape[0]:
+                yield X
+
+
+def fit_clusters(dirs,
+                 n_clusters=3,
+                 features=FEATURES,
+                 batch_size=4096,
+                 n_epochs=3,
+                 chunksize=100_000,
+                 random_state=42):
+    """
+    Fit standardization + mini-batch k-means over all foci of an experiment.
+
+    Pass 1 accumulates mean/variance of the features (StandardScaler.partial_fit),
+    the following passes stream standardized chunks into MiniBatchKMeans.partial_fit.
+    Clusters are re-ordered by the first feature so that labels are stable between fits
+    (cluster 0 = lowest mean intensity with the default features).
+    """
+    from sklearn.cluster import MiniBatchKMeans
+    from sklearn.preprocessing import StandardScaler
+
+    files = extent_files(dirs)
+    features = list(features)
+
+    # --- Pass 1: feature standardization ---
+    scaler = StandardScaler()
+    n_foci = 0
+    for X in iter_features(files, features, chunksize):
+        scaler.partial_fit(X)
+        n_foci += X.shape[0]
+    if n_foci < n_clusters:
+        raise ValueError(f"Only {n_foci} foci found, not enough for {n_clusters} clusters.")
+
+    # --- Pass 2..n: streaming k-means ---
+    kmeans = MiniBatchKMeans(n_clusters=n_clusters, batch_size=batch_size,
+                             random_state=random_state, n_init=3)
+    for _ in range(n_epochs):
+        pending = None
+        for X in iter_features(files, features, chunksize):
+            X = scaler.transform(X)
+            # partial_fit needs at least n_clusters samples in a batch
+            pending = X if pending is None else np.vstack([pending, X])
+            if pending.shape[0] < max(n_clusters, batch_size):
+                continue
+            for start in range(0, pending.shape[0], batch_size):
+                batch = pending[start:start + batch_size]
+                if batch.shape[0] >= n_clusters:
+                    kmeans.partial_fit(batch)
+            pending = None
+        if pending is not None and pending.shape[0] >= n_clusters:
+            kmeans.partial_fit(pending)
+
+    # Stable cluster order
+    order = np.argsort(kmeans.cluster_centers_[:, 0])
+    kmeans.cluster_centers_ = kmeans.cluster_centers_[order]
+
+    print(f"Fitted {n_clusters} clusters on {n_foci} foci from {len(files)} files.")
+
+    return {"features": features, "scaler": scaler, "kmeans": kmeans}
+
+
+def cluster_centers(model):
+    """
+    Cluster centers in the original feature units as a DataFrame.
+    """
+    centers = model["scaler"].inverse_transform(model["kmeans"].cluster_centers_)
+    df = pd.DataFrame(centers, columns=model["features"])
+    df.index.name = "Cluster"
+    return df
+
+
+def save_model(model, path):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "wb") as f:
+        pickle.dump(model, f)
+
+
+def load_model(path):
+    path = Path(str(path).strip())
+    if not path.exists():
+        raise FileNotFoundError(f"Cluster model {path} is not found!")
+    with open(path, "rb") as f:
+        model = pickle.load(f)
+    if not {"features", "scaler", "kmeans"} <= set(model):
+        raise ValueError(f"File {path} is not a foci cluster model.")
+    return model
+
+
+def predict_clusters(df, model):
+    """
+    Vectorized cluster assignment for a foci table.
+    Returns an int array aligned with df; foci with missing features get -1.
+    """
+    labels = np.full(len(df), -1, dtype=np.int64)
+    if df.empty:
+        return labels
+    X = df[model["features"]].to_numpy(dtype=np.float64)
+    valid = ~np.isnan(X).any(axis=1)
+    if valid.any():
+        labels[valid] = model["kmeans"].predict(model["scaler"].transform(X[valid]))
+    return labels
+
+
+def cluster_composition(labels, n_clusters):
+    """
+    Number and fraction of foci in each cluster, as a flat dict ready for results.csv.
+    """
+    labels = np.asarray(labels)
+    counts = np.bincount(labels[labels >= 0], minlength=n_clusters)
+    total = counts.sum()
+    row = {}
+    for i, c in enumerate(counts):
+        row[f"Cluster_{i}_number"] = int(c)
+        row[f"Cluster_{i}_fraction"] = float(c / total) if total else np.nan
+    return row
@@ -0,0 +1,274 @@
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+import os
+import numpy as np
+import pandas as pd
+
+COMPARISONS_FILE = "comparisons.csv"
+
+
+def fdr_bh(p):
+    """
+    Benjamini-Hochberg adjusted p-values (q-values) of an array of p-values; NaNs are
+    left out of the family and stay NaN.
+    """
+    p = np.asarray(p, dtype=np.float64)
+    q = np.full(p.shape, np.nan)
+    ok = np.flatnonzero(~np.isnan(p))
+    if not len(ok):
+        return q
+    order = ok[np.argsort(p[ok])]
+    ranked = p[order] * len(ok) / np.arange(1, len(ok) + 1)
+    q[order] = np.minimum(np.minimum.accumulate(ranked[::-1])[::-1], 1.0)
+    return q
+
+
+def group_moments(data, by):
+    """
+    Count, mean and variance (ddof=1) of every column of data in every group of `by`,
+    NaNs ignored. Returns three (groups x features) frames.
+    """
+    g = data.groupby(by, sort=False, observed=True)
+    return g.count(), g.mean(), g.var(ddof=1)
+
+
+def welch(n_a, m_a, v_a, n_b, m_b, v_b):
+    """
+    Welch t statistic, degrees of freedom, two-sided p-value and Cohen's d (pooled SD)
+    of b vs a, elementwise on arrays of group moments.
+    """
+    from scipy.stats import t as t_dist
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        se2_a, se2_b = v_a / n_a, v_b / n_b
+        t = (m_b - m_a) / np.sqrt(se2_a + se2_b)
+        df = (se2_a + se2_b) ** 2 / (se2_a ** 2 / (n_a - 1) + se2_b ** 2 / (n_b - 1))
+        p = 2 * t_dist.sf(np.abs(t), df)
+        pooled = np.sqrt(((n_a - 1) * v_a + (n_b - 1) * v_b) / (n_a + n_b - 2))
+        d = (m_b - m_a) / pooled
+    small = (n_a < 2) | (n_b < 2)
+    for a in (t, df, p, d):
+        a[small] = np.nan
+    return t, df, p, d
+
+
+def mann_whitney(values, codes, n_groups):
+    """
+    Mann-Whitney U of every ordered pair of groups for one feature, from a
+    (distinct values x groups) count table: U[a, b] counts the pairs where the value of
+    group b is larger than the value of group a (ties count 1/2). The tie term of the
+    variance comes from the same table, so all pairs are matrix products.
+
+    values : 1D array of one feature (NaN-free); codes : group index of every value.
+    Returns (U, tie term) as (groups x groups) arrays.
+    """
+    uniq, inverse = np.unique(values, return_inverse=True)
+    M = np.zeros((len(uniq), n_groups))
+    np.add.at(M, (inverse, codes), 1.0)
+    less = np.cumsum(M, axis=0) - M          # values of each group strictly below each distinct value
+    U = ((less + 0.5 * M).T @ M)             # U[a, b] = sum_v M_b(v) * (less_a(v) + M_a(v) / 2)
+    # sum_v (M_a + M_b)^3 - (M_a + M_b), expanded into per-group terms and cross products
+    M2 = M ** 2
+    own = (M2 * M).sum(axis=0) - M.sum(axis=0)
+    ties = own[:, None] + own[None, :] + 3 * (M2.T @ M) + 3 * (M.T @ M2)
+    return U, ties
+
+
+def mann_whitney_p(U, n_a, n_b, ties):
+    """
+    Two-sided asymptotic p-value with tie and continuity correction
+    (scipy.stats.mannwhitneyu, method="asymptotic").
+    """
+    from scipy.stats import norm
+
+    n = n_a + n_b
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mu = n_a * n_b / 2
+        s = np.sqrt(n_a * n_b / 12 * ((n + 1) - ties / (n * (n - 1))))
+        z = (np.abs(U - mu) - 0.5) / s
+        p = np.minimum(2 * norm.sf(z), 1.0)
+    p[(n_a < 1) | (n_b < 1) | ~(s > 0)] = np.nan
+    return p
+
+
+def bootstrap_mean_diff(a, b, n_boot, ci, seed):
+    """
+    Percentile bootstrap CI of mean(b) - mean(a) for every feature (columns of a, b; NaNs ignored).
+    Resamples are drawn as multinomial weights, so one matrix product gives all resampled means.
+    seed : SeedSequence (or int) of this comparison's own RNG stream.
+    """
+    rng = np.random.default_rng(seed)
+
+    def resampled_means(x):
+        n = len(x)
+        if n == 0:
+            return np.full((n_boot, x.shape[1]), np.nan)
+        w = rng.multinomial(n, np.full(n, 1.0 / n), size=n_boot).astype(np.float64)
+        valid = ~np.isnan(x)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return (w @ np.where(valid, x, 0.0)) / (w @ valid)
+
+    diff = resampled_means(b) - resampled_means(a)
+    tail = (1 - ci) / 2 * 100
+    low, high = np.full(diff.shape[1], np.nan), np.full(diff.shape[1], np.nan)
+    for j in range(diff.shape[1]):
+        d = diff[:, j]
+        d = d[~np.isnan(d)]
+        if len(d):
+            low[j], high[j] = np.percentile(d, [tail, 100 - tail])
+    return low, high
+
+
+def _bootstrap_task(args):
+    return bootstrap_mean_diff(*args)
+
+
+def compare(df, condition="condition", features=None, reference=None, all_pairs=False,
+            n_boot=2000, ci=0.95, seed=0, workers=None, alpha=0.05):
+    """
+    Group comparisons of every feature of a results table (e.g. results_all.csv of batch).
+
+    condition : column with the group (condition) of every row
+    features  : numeric columns to compare (default: all numeric columns)
+    reference : group every other group is compared to (default: the first group in the table);
+                all_pairs=True compares every pair of groups instead
+    n_boot    : bootstrap resamples for the CI of the mean difference (0 = no CIs)
+    seed      : root seed; every comparison gets its own RNG stream (SeedSequence.spawn), so the
+                CIs do not depend on the number of workers
+    workers   : processes for the bootstrap (default: CPU count; 1 = in this process)
+
+    Returns one row per (feature, group_a, group_b) with n, means, mean_diff (b - a) and its CI,
+    Welch t-test, Mann-Whitney U, Cohen's d, rank-biserial correlation and
+    Benjamini-Hochberg q-values over the whole table for both tests.
+    """
+    if condition not in df.columns:
+        raise KeyError(f"Condition column '{condition}' is not found.")
+    df = df[df[condition].notna()]
+    if features is None:
+        features = [c for c in df.select_dtypes(include="number").columns if c != condition]
+    missing = [c for c in features if c not in df.columns]
+    if missing:
+        raise KeyError(f"Features {missing} are not found.")
+
+    data = df[features].apply(pd.to_numeric, errors="coerce").astype(np.float64)
+    groups = pd.Index(pd.unique(df[condition]))
+    codes = groups.get_indexer(df[condition])
+    if len(groups) < 2:
+        raise ValueError(f"Need at least two groups in '{condition}', got {list(groups)}.")
+
+    # pairs (a, b) as group indices
+    if all_pairs:
+        ia, ib = np.triu_indices(len(groups), k=1)
+    else:
+        ref = 0 if reference is None else groups.get_loc(reference) if reference in groups else None
+        if ref is None:
+            raise ValueError(f"Reference group '{reference}' is not in '{condition}'.")
+        ib = np.array([i for i in range(len(groups)) if i != ref])
+        ia = np.full(len(ib), ref)
+
+    # Welch t-test and Cohen's d: all pairs and features from the group moments
+    n, mean, var = (x.reindex(groups).to_numpy(dtype=np.float64)
+                    for x in group_moments(data, df[condition]))
+    t, dof, p_t, d = welch(n[ia], mean[ia], var[ia], n[ib], mean[ib], var[ib])
+
+    # Mann-Whitney U and rank-biserial correlation: all pairs of one feature at a time
+    U = np.full(t.shape, np.nan)
+    ties = np.full(t.shape, np.nan)
+    X = data.to_numpy()
+    for j in range(len(features)):
+        ok = ~np.isnan(X[:, j])
+        u, tie = mann_whitney(X[ok, j], codes[ok], len(groups))
+        U[:, j] = u[ia, ib]
+        ties[:, j] = tie[ia, ib]
+    p_mw = mann_whitney_p(U, n[ia], n[ib], ties)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        r_rb = 2 * U / (n[ia] * n[ib]) - 1
+
+    # Bootstrap CIs, one seeded stream per pair
+    low = np.full(t.shape, np.nan)
+    high = np.full(t.shape, np.nan)
+    if n_boot > 0:
+        rows = [X[codes == g] for g in range(len(groups))]
+        streams = np.random.SeedSequence(seed).spawn(len(ia))
+        tasks = [(rows[a], rows[b], n_boot, ci, s) for a, b, s in zip(ia, ib, streams)]
+        workers = workers or min(len(tasks), os.cpu_count() or 1)
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                cis = list(pool.map(_bootstrap_task, tasks, chunksize=max(1, len(tasks) // (4 * workers))))
+        else:
+            cis = [_bootstrap_task(task) for task in tasks]
+        for k, (lo, hi) in enumerate(cis):
+            low[k], high[k] = lo, hi
+
+    P, F = t.shape
+    out = pd.DataFrame({
+        "feature": np.tile(features, P),
+        "group_a": np.repeat(groups[ia].astype(str), F),
+        "group_b": np.repeat(groups[ib].astype(str), F),
+        "n_a": n[ia].ravel().astype(int),
+        "n_b": n[ib].ravel().astype(int),
+        "mean_a": mean[ia].ravel(),
+        "mean_b": mean[ib].ravel(),
+        "mean_diff": (mean[ib] - mean[ia]).ravel(),
+        "ci_low": low.ravel(),
+        "ci_high": high.ravel(),
+        "t": t.ravel(),
+        "df": dof.ravel(),
+        "p_t": p_t.ravel(),
+        "U": U.ravel(),
+        "p_mw": p_mw.ravel(),
+        "cohens_d": d.ravel(),
+        "rank_biserial": r_rb.ravel(),
+    })
+    out["q_t"] = fdr_bh(out["p_t"])
+    out["q_mw"] = fdr_bh(out["p_mw"])
+    out["significant"] = (out["q_t"] < alpha) | (out["q_mw"] < alpha)
+    return out
+
+
+def group_boxplot(df, condition, feature, order=None, ylabel=None, title=None, jitter=0.06,
+                  dot_size=20, figsize=(4.8, 4.2), dpi=200, save_path=None, seed=0):
+    """
+    Box per group with the single values on top; the jitter of all groups is drawn in one
+    scatter call from a seeded generator, so the figure is reproducible.
+    """
+    import matplotlib.pyplot as plt
+
+    order = list(pd.unique(df[condition].dropna())) if order is None else list(order)
+    sub = df[df[condition].isin(order)][[condition, feature]].dropna()
+    pos = pd.Index(order).get_indexer(sub[condition]) + 1
+    values = sub[feature].to_numpy()
+
+    fig, ax = plt.subplots(figsize=figsize, dpi=dpi)
+    ax.boxplot([values[pos == i + 1] for i in range(len(order))], widths=0.55, patch_artist=True,
+               showfliers=False, boxprops=dict(facecolor="lightgray", alpha=0.55))
+    x = pos + np.random.default_rng(seed).normal(scale=jitter, size=len(pos))
+    ax.scatter(x, values, c=pos, cmap="tab10", vmin=1, vmax=10, alpha=0.65, s=dot_size, linewidths=0)
+
+    ax.set_xticks(range(1, len(order) + 1))
+    ax.set_xticklabels([str(o) for o in order], rotation=45, ha="right")
+    ax.set_ylabel(ylabel or feature.replace("_", " "))
+    ax.set_title(title)
+    ax.spines["top"].set_visible(False)
+    ax.spines["right"].set_visible(False)
+    plt.tight_layout()
+
+    if save_path is not None:
+        save_path = Path(save_path)
+        save_path.parent.mkdir(parents=True, exist_ok=True)
+        plt.savefig(save_path, dpi=dpi, bbox_inches="tight")
+        plt.close(fig)
+    return fig
+
+
+def compare_table(path, condition="condition", output=None, **kw):
+    """
+    compare() on a results table file; writes comparisons.csv next to it (or to output).
+    """
+    path = Path(str(path).strip())
+    df = pd.read_csv(path)
+    out = compare(df, condition=condition, **kw)
+    output = Path(output) if output else path.parent / COMPARISONS_FILE
+    out.to_csv(output, index=False)
+    print(f"{len(out)} comparison(s), {int(out['significant'].sum())} significant, are saved: {output}.")
+    return out
@@ -3,8 +3,19 @@ from ij.plugin.frame import RoiManager
 from ij import ImagePlus
 from ij.gui import GenericDialog
 from ij import WindowManager
+from ij import ImageStack
+from java.awt import Rectangle
+from java.lang import System, Throwable, OutOfMemoryError
+from java.io import IOException
 import os
 import re
+import csv
+import math
+import time
+import traceback
+
+CHECKPOINT_FILE = "foci_checkpoint.csv"
+CHECKPOINT_COLUMNS = ["item", "status", "attempt", "error_type", "message", "finished"]
 
 def check_dir(dir):
 	if dir is None:
@@ -92,14 +103,27 @@ def ask_params_for_thunderstorm():
     # ---- Renderer ----
     gd.addChoice("Renderer:", ["No Renderer", "Gaussian rendering"], "No Renderer")
 
+    # ---- Tiling ----
+    gd.addNumericField("Tile size for large ROIs (pixels, 0 = no tiling):", 0, 0)
+    gd.addMessage("Tiles are detected one by one: a threshold formula such as std(Wave.F1)\n"
+                  "is evaluated per tile, enter a number to use the same threshold everywhere.")
+
     # ---- Camera parameters ----
-    gd.addNumericField("Pixel size:", 58.1, 1)
+    gd.addCheckbox("Pixel size from image metadata (if calibrated)", True)
+    gd.addNumericField("Pixel size (nm):", 58.1, 1)
     gd.addNumericField("Photoelectrons per ADU:", 3.6, 1)
     gd.addNumericField("Quantum efficiency (0..1):", 0.8, 1)
     gd.addNumericField("ADU offset:", 0, 1)
     gd.addNumericField("Electrons/pixel:", 1.5, 1)
     gd.addNumericField("EMCCD gain:", 100, 1)
 
+    # ---- QC ----
+    gd.addCheckbox("Save cropped ROI images (PNG; QC overlays: stats.py qc)", False)
+
+    gd.addMessage("Every image is journaled in {} of the output directory.".format(CHECKPOINT_FILE))
+    gd.addCheckbox("Resume: skip images done in a previous run", True)
+    gd.addNumericField("Retries on transient errors (I/O, out of memory):", 1, 0)
+
     gd.showDialog()
     if gd.wasCanceled():
         return None
@@ -124,6 +148,9 @@ def ask_params_for_thunderstorm():
 
     p["renderer"] = gd.getNextChoice()
 
+    p["tile_size"] = int(gd.getNextNumber())
+
+    p["pixel_size_from_image"] = bool(gd.getNextBoolean())
     p["pixel_size"] = float(gd.getNextNumber())
     p["photoelectrons_per_adu"] = float(gd.getNextNumber())
     p["quantum_efficiency"] = float(gd.getNextNumber())
@@ -131,6 +158,10 @@ def ask_params_for_thunderstorm():
     p["readout_noise"] = float(gd.getNextNumber())
     p["em_gain"] = float(gd.getNextNumber())
 
+    p["save_crops"] = bool(gd.getNextBoolean())
+    p["resume"] = bool(gd.getNextBoolean())
+    p["retries"] = max(0, int(gd.getNextNumber()))
+
     return p
 
 def thunderstorm_options(p):
@@ -158,6 +189,46 @@ def thunderstorm_options(p):
     ]
     return " ".join(opts)
 
+def image_pixel_size_nm(imp):
+    """
+    Pixel width [nm] from the image calibration, or None if the image is not calibrated.
+    """
+    cal = imp.getCalibration()
+    if cal is None or not cal.scaled():
+        return None
+    unit = cal.getUnit().lower()
+    factor = {"nm": 1.0, "nanometer": 1.0,
+              "micron": 1000.0, "microns": 1000.0, "um": 1000.0, u"\u00b5m": 1000.0,
+              "mm": 1e6}.get(unit)
+    if factor is None:
+        return None
+    return cal.pixelWidth * factor
+
+def camera_setup(imp, p):
+    """
+    Apply ThunderSTORM camera settings for this image.
+    The pixel size is read from the image calibration when available, so a wrong
+    constant in the dialog cannot silently rescale the nm coordinates.
+    The protocol saved with each export records the value actually used.
+    """
+    pixel_size = None
+    if p.get("pixel_size_from_image", False):
+        pixel_size = image_pixel_size_nm(imp)
+    if pixel_size is None:
+        pixel_size = p["pixel_size"]
+        IJ.log("Pixel size from dialog: {} nm".format(pixel_size))
+    else:
+        IJ.log("Pixel size from image metadata: {:.3f} nm".format(pixel_size))
+
+    opts = (
+        'offset={} isemgain={} photons2adu={} gainem={} pixelsize={} '
+        'quantumefficiency={} readoutnoise={}'
+    ).format(p["base_level"], "true" if p["em_gain"] > 1 else "false",
+             p["photoelectrons_per_adu"], p["em_gain"], pixel_size,
+             p["quantum_efficiency"], p["readout_noise"])
+    IJ.run("Camera setup", opts)
+    return pixel_size
+
 def safe_name(s):
     """Make a string safe for filenames."""
     s = str(s)
@@ -169,83 +240,326 @@ def close_window(title):
     win = WindowManager.getWindow(title)
     if win: win.dispose()
 
-def foci_image(imp, rois, parameters, output_dir):
+def roi_view(imp, roi, title):
     """
-    Process a single image for multiple ROIs.
+    Build a small ImagePlus restricted to the ROI bounding box (all slices),
+    with pixels outside the ROI set to 0. Only the bounding box is allocated,
+    never a full-frame copy, so memory does not grow with the number of ROIs.
+    Returns (view, x0, y0) where (x0, y0) is the view origin in the full image.
+    """
+    bounds = roi.getBounds().intersection(Rectangle(0, 0, imp.getWidth(), imp.getHeight()))
+    if bounds.isEmpty():
+        raise RuntimeError("ROI is outside the image.")
+
+    # ROI shape in view coordinates
+    local_roi = roi.clone()
+    local_roi.setLocation(roi.getXBase() - bounds.x, roi.getYBase() - bounds.y)
+
+    src = imp.getStack()
+    stack = ImageStack(bounds.width, bounds.height)
+    for s in range(1, src.getSize() + 1):
+        ip = src.getProcessor(s)   # virtual stacks load only this plane
+        ip.setRoi(bounds)
+        crop = ip.crop()
+        ip.resetRoi()
+
+        # Convert to 16-bit only if needed (on the crop, not the full frame)
+        if imp.getType() not in (ImagePlus.GRAY8, ImagePlus.GRAY16):
+            crop = crop.convertToShort(True)
+
+        crop.setValue(0)
+        crop.fillOutside(local_roi)
+        stack.addSlice(src.getSliceLabel(s), crop)
+
+    view = ImagePlus(title, stack)
+    view.setDimensions(imp.getNChannels(), imp.getNSlices(), imp.getNFrames())
+    view.setCalibration(imp.getCalibration().copy())
+    return view, bounds.x, bounds.y
+
+def shift_localizations(csv_path, dx_nm, dy_nm):
+    """
+    Move exported localizations from ROI-view coordinates back to full-image coordinates.
+    """
+    if dx_nm == 0 and dy_nm == 0:
+        return
+    with open(csv_path, "rb") as f:
+        rows = list(csv.reader(f))
+    if not rows:
+        return
+
+    header = rows[0]
+    ix = header.index("x [nm]")
+    iy = header.index("y [nm]")
+    for row in rows[1:]:
+        if len(row) <= max(ix, iy):
+            continue
+        row[ix] = repr(float(row[ix]) + dx_nm)
+        row[iy] = repr(float(row[iy]) + dy_nm)
+
+    with open(csv_path, "wb") as f:
+        writer = csv.writer(f)
+        writer.writerows(rows)
+
+def run_thunderstorm(imp, parameters, csv_path):
+    """
+    Run ThunderSTORM on imp and export the results table to csv_path.
+    Stacks / time-lapses are analysed in one run and exported with a frame column (1-based),
+    which stats uses to measure each focus on its own frame.
+    """
+    close_window("ThunderSTORM: results")
+    try:
+        IJ.run(imp, "Run analysis", parameters)
+
+        export_opts = (
+            'filepath=[{}] '
+            'fileformat=[CSV (comma separated)] '
+            'sigma=true intensity=true chi2=false offset=false saveprotocol=true '
+            'x=true y=true bkgstd=false id=true uncertainty=false frame={}'
+        ).format(csv_path.replace("\\", "/"), "true" if imp.getStackSize() > 1 else "false")
+
+        # Select results and export
+        if WindowManager.getWindow("ThunderSTORM: results") is None:
+            raise RuntimeError("ThunderSTORM results window not found (analysis may have failed).")
+
+        IJ.selectWindow("ThunderSTORM: results")
+        IJ.run("Export results", export_opts)
+    finally:
+        close_window("ThunderSTORM: results")
 
-    imp  : ImagePlus
-    rois : list of Roi objects
-    p    : dict-like parameters (optional, used later)
+def thunderstorm_halo(p):
+    """
+    Tile overlap [px] so that filtering and fitting near a seam see the same pixels
+    as in a full-frame run: wavelet support + fit radius + margin.
+    """
+    return int(p["fitradius"]) + int(math.ceil(p["scale"] * (p["order"] + 1))) + 2
+
+def tile_grid(width, height, tile, halo):
+    """
+    List of (core, ext) Rectangles covering the image: cores do not overlap,
+    ext = core grown by halo pixels and clipped to the image.
+    """
+    grid = []
+    for y in range(0, height, tile):
+        for x in range(0, width, tile):
+            core = Rectangle(x, y, min(tile, width - x), min(tile, height - y))
+            x1 = max(0, x - halo)
+            y1 = max(0, y - halo)
+            x2 = min(width, x + core.width + halo)
+            y2 = min(height, y + core.height + halo)
+            grid.append((core, Rectangle(x1, y1, x2 - x1, y2 - y1)))
+    return grid
+
+def foci_tiled(imp, parameters, csv_path, pixel_size, tile, halo):
+    """
+    Run ThunderSTORM tile by tile on a large image and write one merged CSV.
+
+    Every tile is analysed with a halo, so foci near a seam are fitted with their full
+    neighbourhood; a localization is kept only by the tile whose core contains it,
+    which removes the duplicates found in the overlapping halos.
+    ThunderSTORM parallelizes each analysis internally and works through the shared
+    results window, so the tiles themselves run one after another.
+
+    A threshold formula (default std(Wave.F1)) is evaluated by ThunderSTORM on every
+    tile, so each tile gets its own threshold and the result can differ from a
+    full-ROI analysis. Only a numeric threshold gives the same detections as untiled.
+    """
+    try:
+        float(parameters["threshold"])
+    except ValueError:
+        IJ.log("WARNING: threshold '{}' is evaluated per tile; enter a number for a "
+               "threshold identical across tiles.".format(parameters["threshold"]))
+    base = os.path.splitext(csv_path)[0]
+    tile_csv = base + "_tile.csv"
+    header = None
+    merged = []
+    grid = tile_grid(imp.getWidth(), imp.getHeight(), tile, halo)
+
+    for k, (core, ext) in enumerate(grid):
+        stack = imp.getStack().crop(ext.x, ext.y, 0, ext.width, ext.height, imp.getStackSize())
+        tile_imp = ImagePlus("tile_{:03d}_{}".format(k + 1, imp.getTitle()), stack)
+        tile_imp.setDimensions(imp.getNChannels(), imp.getNSlices(), imp.getNFrames())
+        tile_imp.show()
+        try:
+            run_thunderstorm(tile_imp, parameters, tile_csv)
+        finally:
+            tile_imp.changes = False
+            tile_imp.close()
+
+        with open(tile_csv, "rb") as f:
+            rows = list(csv.reader(f))
+        os.remove(tile_csv)
+        if not rows:
+            continue
+        if header is None:
+            header = rows[0]
+            ix = header.index("x [nm]")
+            iy = header.index("y [nm]")
+
+        for row in rows[1:]:
+            if len(row) <= max(ix, iy):
+                continue
+            x_px = ext.x + float(row[ix]) / pixel_size
+            y_px = ext.y + float(row[iy]) / pixel_size
+            if core.x <= x_px < core.x + core.width and core.y <= y_px < core.y + core.height:
+                row[ix] = repr(x_px * pixel_size)
+                row[iy] = repr(y_px * pixel_size)
+                merged.append(row)
+
+    # keep the protocol of the last tile as the protocol of the merged table
+    tile_protocol = base + "_tile-protocol.txt"
+    if os.path.exists(tile_protocol):
+        protocol = base + "-protocol.txt"
+        if os.path.exists(protocol):
+            os.remove(protocol)
+        os.rename(tile_protocol, protocol)
+
+    if header is None:
+        raise RuntimeError("ThunderSTORM produced no results for any tile.")
+
+    # unique ids over the merged table
+    if "id" in header:
+        iid = header.index("id")
+        for n, row in enumerate(merged, start=1):
+            row[iid] = str(n)
+
+    with open(csv_path, "wb") as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(merged)
+    IJ.log("Tiled analysis: {} localization(s) from {} tile(s).".format(len(merged), len(grid)))
+
+def foci_roi(imp, roi, i, roi_name, parameters, output_dir, pixel_size, tile_size=0, halo=0, save_crops=False):
+    """
+    Detect foci in one ROI of an image and export them to <image>_<roi>.csv.
     """
     img_name = imp.getTitle()
     img_base = safe_name(os.path.splitext(img_name)[0])
+    roi_base = safe_name(roi_name)
+    dup = None
+    try:
+        IJ.log("Processing image: {} and ROI: {}".format(img_name, roi_name))
 
-    for i, roi in enumerate(rois):
-        dup = None
-        roi_name = None
-        try:
-            roi_name = roi.getName()
-            if roi_name is None:
-                roi_name = "roi_{:02d}".format(i + 1)
-            roi_base = safe_name(roi_name)
-
-            IJ.log("Processing image: {} and ROI: {}".format(img_name, roi_name))
-
-            # Make sure old results window doesn't interfere
-            close_window("ThunderSTORM: results")
-
-            # Set ROI and clear data outside ROI
-            dup = imp.duplicate()
-            dup.show()
-            dup.setRoi(roi)
-            dup.setTitle("ROI_{:02d}_{}".format(i + 1, img_name))
-            IJ.run(dup, "Clear Outside", "")
-            dup.killRoi()          
-
-            # Convert to 16-bit only if needed. Optional
-            dup_type = dup.getType()
-            if dup_type not in (ImagePlus.GRAY8, ImagePlus.GRAY16):
-                IJ.run(dup, "16-bit", "")
-                dup.changes = False
-
-            IJ.run(dup, "Run analysis", parameters)
-
-            # ---- Export CSV ----
-            csv_path = os.path.abspath(os.path.join(output_dir, "{}_{}.csv".format(img_base, roi_base)))
-            csv_path_ij = csv_path.replace("\\", "/")
-
-            export_opts = (
-                'filepath=[{}] '
-                'fileformat=[CSV (comma separated)] '
-                'sigma=true intensity=true chi2=false offset=false saveprotocol=false '
-                'x=true y=true bkgstd=false id=true uncertainty=false frame=false'
-            ).format(csv_path_ij)
-            
-            # Select results and export
-            if WindowManager.getWindow("ThunderSTORM: results") is None:
-                raise RuntimeError("ThunderSTORM results window not found (analysis may have failed).")
-            
-            IJ.selectWindow("ThunderSTORM: results")
-            IJ.run("Export results", export_opts)
-
-            # Save cropped image
+        # Make sure old results window doesn't interfere
+        close_window("ThunderSTORM: results")
+
+        # Cropped, masked view of the ROI (no full-frame duplicate)
+        dup, x0, y0 = roi_view(imp, roi, "ROI_{:02d}_{}".format(i + 1, img_name))
+        dup.show()
+
+        # ---- Detection + CSV export ----
+        csv_path = os.path.abspath(os.path.join(output_dir, "{}_{}.csv".format(img_base, roi_base)))
+        if tile_size > 0 and max(dup.getWidth(), dup.getHeight()) > tile_size:
+            foci_tiled(dup, parameters, csv_path, pixel_size, tile_size, halo)
+        else:
+            run_thunderstorm(dup, parameters, csv_path)
+        shift_localizations(csv_path, x0 * pixel_size, y0 * pixel_size)
+
+        # Save cropped image
+        if save_crops:
             cropped_path = os.path.join(output_dir, "{}_{}.png".format(img_base, roi_name))
             IJ.save(dup, cropped_path)
 
-        except Exception as e:
-            IJ.log(
-                "Error on ROI {} ({}): {}".format(
-                    i + 1,
-                    roi_name if roi_name is not None else "?",
-                    e
-                )
-            )
+    finally:
+        close_window("ThunderSTORM: results")
+        if dup is not None:
+            dup.changes = False
+            dup.close()
+        #imp.killRoi()
+
+def foci_image(imp, rois, parameters, output_dir, pixel_size, tile_size=0, halo=0, save_crops=False, retries=0,
+               on_retry=None):
+    """
+    Process a single image for multiple ROIs.
 
-        finally:
-            close_window("ThunderSTORM: results")
-            if dup is not None:
-                dup.close()
-            #imp.killRoi()    
+    imp        : ImagePlus
+    rois       : list of Roi objects
+    parameters : ThunderSTORM 'Run analysis' options string
+    pixel_size : camera pixel size [nm], used to put localizations back in full-image coordinates
+    tile_size  : ROIs larger than this (pixels) are analysed in tiles with a halo (0 = never)
+    save_crops : also save the cropped ROI image as PNG (slow on large plates; qc.py renders overlays instead)
+    retries    : extra attempts per ROI on transient errors
+    on_retry   : on_retry(roi_name, attempt, error) before every retry (checkpoint journal)
+
+    Returns the failed ROIs as a list of (ROI name, error).
+    """
+    failures = []
+    for i, roi in enumerate(rois):
+        roi_name = roi.getName()
+        if roi_name is None:
+            roi_name = "roi_{:02d}".format(i + 1)
+
+        attempts, error = with_retries(
+            lambda: foci_roi(imp, roi, i, roi_name, parameters, output_dir, pixel_size,
+                             tile_size, halo, save_crops),
+            retries, "{} / ROI {}".format(imp.getTitle(), roi_name),
+            on_retry=(lambda a, e: on_retry(roi_name, a, e)) if on_retry is not None else None)
+        if error is not None:
+            IJ.log("Error on ROI {} ({}): {}".format(i + 1, roi_name, error))
+            failures.append((roi_name, error))
+    return failures
+
+def read_checkpoint(output_dir):
+    """
+    Items whose last journaled status in the checkpoint is "done" (skipped on resume).
+    """
+    path = os.path.join(output_dir, CHECKPOINT_FILE)
+    last = {}
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            for row in csv.DictReader(f):
+                last[row["item"]] = row["status"]
+    return set(item for item, status in last.items() if status == "done")
+
+def append_checkpoint(output_dir, item, status, attempt, error=None, where=None):
+    """
+    Append-only journal of every attempt: done / retry / failed with the failure reason
+    (where: part of the item that failed, e.g. a ROI).
+    """
+    path = os.path.join(output_dir, CHECKPOINT_FILE)
+    new_file = not os.path.exists(path)
+    with open(path, "ab") as f:
+        writer = csv.writer(f)
+        if new_file:
+            writer.writerow(CHECKPOINT_COLUMNS)
+        writer.writerow([item, status, attempt,
+                         "" if error is None else error_type(error),
+                         "" if error is None else
+                         ((where + ": ") if where else "") + str(error).replace("\n", " "),
+                         time.strftime("%Y-%m-%dT%H:%M:%S")])
+
+def error_type(e):
+    return type(e).__name__ if not isinstance(e, Throwable) else e.getClass().getSimpleName()
+
+def is_transient(e):
+    """
+    I/O errors and running out of memory can pass on a second attempt; errors in the data cannot.
+    """
+    return isinstance(e, (IOError, OSError, IOException, OutOfMemoryError))
+
+def with_retries(fn, retries, label, cleanup=None, on_retry=None):
+    """
+    Call fn(), again up to `retries` times if it fails with a transient error
+    (on_retry(attempt, error), e.g. the checkpoint "retry" row, then cleanup() and a
+    garbage collection run between attempts).
+    Returns (attempts, None) on success, (attempts, last error) otherwise.
+    """
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            fn()
+            return attempt, None
+        except (Exception, Throwable) as e:
+            IJ.log("ERROR in {} (attempt {}): {}".format(label, attempt, e))
+            IJ.log(traceback.format_exc())  # comment out if too verbose
+            if attempt > retries or not is_transient(e):
+                return attempt, e
+            if on_retry is not None:
+                on_retry(attempt, e)
+            if cleanup is not None:
+                cleanup()
+            System.gc()
+            IJ.log("Transient error, retry {}/{}: {}".format(attempt, retries, label))
 
 # --- Main ---
 # Ask user about the directory with data to process
@@ -300,19 +614,24 @@ ts_opts = thunderstorm_options(ts_params)
 output_dir = IJ.getDirectory("Choose a directory to save data")
 check_dir(output_dir)
 
+# Images finished in a previous run (journaled in the checkpoint)
+done_items = read_checkpoint(output_dir) if ts_params["resume"] else set()
+if done_items:
+    IJ.log("Resume: {} image(s) are done in {}.".format(len(done_items), CHECKPOINT_FILE))
+errors = []  # collect all errors here
+n_skipped = 0
+
 # ---- open subsequently in Fiji ----
 rm = RoiManager.getRoiManager()
 
-# Iterate over matched pairs of ROI and images
-for img, roi in pairs:
+def open_pair(img, roi):
+    """
+    Open the image and load its ROIs into the ROI Manager; IOError if the image cannot be read.
+    """
     IJ.log("Open image: " + img)
-
-    # Open the image
     imp = IJ.openImage(os.path.join(input_dir, img))
     if imp is None:
-        IJ.log("SKIP (cannot open image): " + img)
-        continue
-
+        raise IOError("cannot open image " + img)
     imp.show()
 
     # Reset ROI Manager before loading new ROIs
@@ -320,25 +639,64 @@ for img, roi in pairs:
     IJ.log("Open ROI: " + roi)
 
     # Open the ROI zip file (loads all ROIs into the manager)
-    roi_path = os.path.join(input_dir, roi)
-    rm.open(roi_path)
+    rm.open(os.path.join(input_dir, roi))
+    return imp
 
-    try:
-        # Get ROIs AFTER loading them
-        rois = list(rm.getRoisAsArray())
-        foci_image(imp, rois, ts_opts, output_dir)
+# Iterate over matched pairs of ROI and images
+for call_id, (img, roi) in enumerate(pairs, start=1):
+    if img in done_items:
+        IJ.log("Skip {}/{} (done): {}".format(call_id, len(pairs), img))
+        n_skipped += 1
+        continue
 
-    except Exception as e:
-        IJ.log("IMAGE FAILED {}: {}".format(img, e))
+    opened = []
+    attempts, error = with_retries(lambda: opened.append(open_pair(img, roi)), ts_params["retries"], img,
+                                   on_retry=lambda a, e: append_checkpoint(output_dir, img, "retry", a, e))
+    imp = opened[0] if opened else None
+    failures = []
+
+    try:
+        if error is None:
+            # Calibration once per image (recorded in the ThunderSTORM protocol of every export)
+            pixel_size = camera_setup(imp, ts_params)
+
+            # Get ROIs AFTER loading them
+            rois = list(rm.getRoisAsArray())
+            failures = foci_image(imp, rois, ts_opts, output_dir, pixel_size,
+                                  tile_size=ts_params["tile_size"], halo=thunderstorm_halo(ts_params),
+                                  save_crops=ts_params["save_crops"], retries=ts_params["retries"],
+                                  on_retry=lambda roi_name, a, e: append_checkpoint(
+                                      output_dir, img, "retry", a, e, where="ROI " + roi_name))
+            if failures:
+                error = RuntimeError("{} ROI(s) failed: {}".format(
+                    len(failures), "; ".join("{} ({})".format(name, e) for name, e in failures)))
+
+    except (Exception, Throwable) as e:
+        error = e
 
     finally:
         if imp is not None:
+            imp.changes = False
             imp.close()
         rm.reset()
 
+    if error is None:
+        append_checkpoint(output_dir, img, "done", attempts)
+    else:
+        IJ.log("IMAGE FAILED {}: {}".format(img, error))
+        append_checkpoint(output_dir, img, "failed", attempts, error)
+        errors.append({"id": call_id, "title": img, "type": error_type(error), "msg": str(error)})
+
 # Fininsh up and close everything
 cleanup_iteration()
 
+# ---- After the loop: print a summary ----
+IJ.log("===== RUN SUMMARY: {} error(s), {} image(s) skipped as done =====".format(len(errors), n_skipped))
+for k, er in enumerate(errors, start=1):
+    IJ.log("#{k} [{id}] {title} | {type}: {msg}".format(
+        k=k, id=er["id"], title=er["title"], type=er["type"], msg=er["msg"]
+    ))
+
 IJ.log("Analysis is finished!")
 
 
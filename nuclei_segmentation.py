@@ -5,11 +5,39 @@ from ij.measure import Measurements, ResultsTable
 from ij.plugin.filter import ParticleAnalyzer
 from ij.plugin.filter import BackgroundSubtracter
 from ij.process import AutoThresholder
+from jarray import array
+from ij.process import Blitter, ImageProcessor
+from ij.process import ByteProcessor, ColorProcessor
+from ij.plugin import Binner
+from java.lang import System
 from ij.io import RoiEncoder
+from ij.plugin.filter import GaussianBlur
+from ij import ImagePlus
+from java.awt import Rectangle
+from java.lang import Runtime, Throwable, OutOfMemoryError
+from java.io import IOException
+from java.util.concurrent import Executors, Callable
+import math
 import os
 import csv
+import time
 import traceback
 
+# BIOFORMATS_EXTS, find_files, series_count and open_lazy are copied from opener.py, keep in sync
+BIOFORMATS_EXTS = (".nd2", ".czi", ".lif", ".lsm", ".oib", ".vsi")
+SOURCE_OPEN = "Open images"
+SOURCE_FOLDER = "Folder (lazy, one file at a time)"
+THR_PER_IMAGE = "Per image"
+THR_GLOBAL = "Global (plate, cached)"
+GLOBAL_THRESHOLDS_FILE = "global_thresholds.csv"
+THRESHOLDS_FILE = "thresholds.csv"
+BG_ROLLING = "Rolling ball (ImageJ)"
+BG_PARABOLOID = "Sliding paraboloid (ImageJ)"
+BG_DOWNSAMPLED = "Downsampled rolling ball (fast)"
+BG_BENCHMARK_FILE = "background_benchmark.csv"
+CHECKPOINT_FILE = "nuclei_checkpoint.csv"
+CHECKPOINT_COLUMNS = ["item", "status", "attempt", "error_type", "message", "finished"]
+
 def ask_params_for_image(img_title):
     gd = GenericDialog("Nuclei segmentation params")
     gd.addMessage("Set parameters for nuclei segmentation.")
@@ -36,6 +64,23 @@ def ask_params_for_image(img_title):
     gd.addCheckbox("Fill holes", True)
     gd.addCheckbox("Single ROI per image", True)
 
+    gd.addMessage("Tiled mode for stitched whole-well images (blur and background per tile).")
+    gd.addNumericField("Tile size (pixels, 0 = full frame):", 0, 0)
+    gd.addNumericField("Tile threads (0 = all cores):", 0, 0)
+
+    gd.addMessage("Global mode: one threshold from a merged histogram of sampled images, cached per plate.")
+    gd.addChoice("Threshold mode:", [THR_PER_IMAGE, THR_GLOBAL], THR_PER_IMAGE)
+    gd.addNumericField("Images sampled for global threshold (0 = all):", 10, 0)
+    gd.addCheckbox("Log per-image auto threshold (drift monitoring)", True)
+
+    gd.addChoice("Background engine:", [BG_ROLLING, BG_PARABOLOID, BG_DOWNSAMPLED], BG_ROLLING)
+    gd.addCheckbox("Benchmark background engines on the first image (and tiled vs full frame)", False)
+    gd.addNumericField("Benchmark tolerance for nucleus MFI (%):", 1.0, 2)
+
+    gd.addMessage("Every image is journaled in {} of the output directory.".format(CHECKPOINT_FILE))
+    gd.addCheckbox("Resume: skip images done in a previous run", True)
+    gd.addNumericField("Retries on transient errors (I/O, out of memory):", 1, 0)
+
     gd.showDialog()
     if gd.wasCanceled():
         return None
@@ -56,9 +101,110 @@ def ask_params_for_image(img_title):
     params["exclude_edges"] = bool(gd.getNextBoolean())
     params["fill_holes"] = bool(gd.getNextBoolean())
     params["single_roi"] = bool(gd.getNextBoolean())
+    params["tile_size"] = int(gd.getNextNumber())
+    params["tile_threads"] = int(gd.getNextNumber())
+    params["threshold_mode"] = gd.getNextChoice()
+    params["threshold_sample"] = int(gd.getNextNumber())
+    params["log_auto_threshold"] = bool(gd.getNextBoolean())
+    params["bg_engine"] = gd.getNextChoice()
+    params["bg_benchmark"] = bool(gd.getNextBoolean())
+    params["bg_benchmark_tolerance"] = float(gd.getNextNumber())
+    params["resume"] = bool(gd.getNextBoolean())
+    params["retries"] = max(0, int(gd.getNextNumber()))
+
+    if params["tile_size"] > 0 and params["bg_engine"] == BG_DOWNSAMPLED:
+        # shrink bins and the resize back would not line up with the tile grid
+        IJ.error("Tiled mode supports the rolling ball and paraboloid background engines only.")
+        return ask_params_for_image(img_title)
 
     return params
 
+def ask_source():
+    """
+    Ask whether to process the open images or to stream files from a folder.
+    Returns (source, root, pattern, ext) or None if canceled.
+    """
+    gd = GenericDialog("Nuclei segmentation input")
+    gd.addChoice("Images:", [SOURCE_OPEN, SOURCE_FOLDER], SOURCE_OPEN)
+    gd.addMessage("Folder mode opens matching files as virtual stacks, one at a time.")
+    gd.addStringField("Filename contains:", "", 15)
+    gd.addStringField("Extension (e.g. .nd2):", ".nd2", 10)
+    gd.showDialog()
+    if gd.wasCanceled():
+        return None
+
+    source = gd.getNextChoice()
+    pattern = gd.getNextString().strip().lower()
+    ext = gd.getNextString().strip().lower()
+    if ext and not ext.startswith("."):
+        ext = "." + ext
+
+    root = None
+    if source == SOURCE_FOLDER:
+        root = IJ.getDirectory("Choose a root directory with images")
+        if not root:
+            return None
+    return source, root, pattern, ext
+
+# copied from opener.py, keep in sync
+def find_files(root, pattern, ext):
+    """
+    Sorted list of files under root whose name contains pattern and ends with ext.
+    """
+    found = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        for name in filenames:
+            lower = name.lower()
+            if lower.endswith(ext) and (pattern in lower):
+                found.append(os.path.join(dirpath, name))
+    found.sort()
+    return found
+
+# copied from opener.py, keep in sync
+def series_count(path):
+    from loci.formats import ImageReader
+    reader = ImageReader()
+    try:
+        reader.setId(path)
+        return reader.getSeriesCount()
+    finally:
+        reader.close()
+
+# copied from opener.py, keep in sync
+def open_lazy(path):
+    """
+    Yield the images of one file as virtual stacks, one ImagePlus per series.
+    Only the planes touched by the processing are read from disk.
+    """
+    lower = path.lower()
+    if lower.endswith(BIOFORMATS_EXTS):
+        for s in range(1, series_count(path) + 1):
+            before = set(WindowManager.getIDList() or [])
+            IJ.run("Bio-Formats Importer",
+                   "open=[{}] color_mode=Default view=Hyperstack stack_order=XYCZT "
+                   "use_virtual_stack series_{}".format(path, s))
+            after = set(WindowManager.getIDList() or [])
+            for wid in sorted(after - before):
+                imp = WindowManager.getImage(wid)
+                if imp is not None:
+                    yield imp
+    elif lower.endswith((".tif", ".tiff")):
+        imp = IJ.openVirtual(path)
+        if imp is not None:
+            imp.show()
+            yield imp
+    else:
+        imp = IJ.openImage(path)
+        if imp is not None:
+            imp.show()
+            yield imp
+
+def iter_images(files):
+    for path in files:
+        IJ.log("Open (virtual): " + path)
+        for imp in open_lazy(path):
+            yield imp
+
 def get_active_image():
     """
     Returns the currently active ImagePlus in Fiji.
@@ -84,6 +230,7 @@ def _img_name_processing(name):
     except Exception as e:
          raise Exception("ERROR in parsing image name")
     
+# copied in segmentation_sweep.py, keep in sync
 def img_name_processing(name):
     try:
         if "MP" in name and " - " in name:
@@ -133,8 +280,7 @@ def split_channels(imp):
     # Get all currently opened image window IDs
     ids = WindowManager.getIDList()
     if not ids:
-        IJ.error("No windows after Split Channels.")
-        raise SystemExit
+        raise RuntimeError("No windows after Split Channels.")
 
     split_imps = []
     for wid in new_ids:
@@ -147,8 +293,7 @@ def split_channels(imp):
             split_imps.append(wimp)
 
     if len(split_imps) == 0:
-        IJ.error("Could not find split channel images. Make sure your image is multichannel/composite.")
-        raise SystemExit
+        raise ValueError("Could not find split channel images. Make sure your image is multichannel/composite.")
 
     # Sort by channel number: C1, C2, C3...
     def chan_index(t):
@@ -218,20 +363,455 @@ def cleanup_iteration():
         rm.reset()
         rm.close()
 
-def subtract_background(imp, radius, light_background=False, use_paraboloid=False, do_presmooth=True):
+def downsample_factor(radius):
+    # extra shrink of the downsampled engine, chosen so the shrunk ball keeps a radius of ~6 px
+    return max(1, int(float(radius) // 6))
+
+def rolling_ball_downsampled(ip, radius):
+    """
+    Fast approximation of the rolling-ball background (dark background):
+    3x3 pre-smoothing, min-binning by the shrink factor, rolling ball with the
+    shrunk radius, bilinear upsampling, then subtraction. Returns a new processor.
+    The error against ImageJ comes from the coarser background grid and is reported
+    by the background benchmark.
+    """
+    f = downsample_factor(radius)
+    w, h = ip.getWidth(), ip.getHeight()
+
+    smooth = ip.convertToFloat().duplicate()
+    smooth.smooth()
+    small = Binner().shrink(smooth, f, f, Binner.MIN)
+    BackgroundSubtracter().rollingBallBackground(small, float(radius) / f, True, False, False, False, False)
+
+    small.setInterpolationMethod(ImageProcessor.BILINEAR)
+    bg = small.resize(w, h)
+
+    result = ip.duplicate()
+    if ip.getBitDepth() == 8:
+        bg = bg.convertToByte(False)
+    elif ip.getBitDepth() == 16:
+        bg = bg.convertToShort(False)
+    result.copyBits(bg, 0, 0, Blitter.SUBTRACT)  # clamps at 0 for integer images
+    return result
+
+def subtract_background(imp, radius, light_background=False, use_paraboloid=False, do_presmooth=True,
+                        engine=BG_ROLLING):
     radius = float(radius)
     ip = imp.getProcessor()  # ImageProcessor of current slice
+
+    if engine == BG_DOWNSAMPLED and not light_background and downsample_factor(radius) > 1:
+        ip.setPixels(rolling_ball_downsampled(ip, radius).getPixels())
+        imp.updateAndDraw()
+        return
+
     BackgroundSubtracter().rollingBallBackground(
         ip,
         radius,
         False,
         bool(light_background),
-        bool(use_paraboloid),
+        bool(use_paraboloid) or engine == BG_PARABOLOID,
         bool(do_presmooth),
         False
     )
     imp.updateAndDraw()
 
+def benchmark_background(raw_ip, rois, radius, tolerance_pct, repeats=3, tile=0, n_threads=0):
+    """
+    Compare the background engines with ImageJ's rolling ball on one raw plane:
+    time per image and deviation of the per-ROI mean (= Nucleus_MFI) and of single pixels.
+    With tile > 0 the tiled rolling ball and paraboloid are also compared with their
+    full-frame result, they must be equal pixel for pixel.
+    Results are logged and appended to background_benchmark.csv.
+    """
+    def run(engine):
+        imp = ImagePlus("bg_benchmark", raw_ip.duplicate())
+        start = System.nanoTime()
+        subtract_background(imp, radius, engine=engine)
+        elapsed = (System.nanoTime() - start) / 1e6
+        return imp.getProcessor(), elapsed
+
+    def roi_means(ip):
+        means = []
+        for roi in rois:
+            ip.setRoi(roi)
+            means.append(ip.getStatistics().mean)
+        ip.resetRoi()
+        return means
+
+    reference, _ = run(BG_ROLLING)
+    ref_means = roi_means(reference)
+    ref_float = reference.convertToFloat()
+
+    rows = []
+    ref_ms = None
+    for engine in (BG_ROLLING, BG_PARABOLOID, BG_DOWNSAMPLED):
+        times = []
+        for _ in range(repeats):
+            ip, ms = run(engine)
+            times.append(ms)
+        ms = min(times)
+        if engine == BG_ROLLING:
+            ref_ms = ms
+
+        means = roi_means(ip)
+        rel = [abs(m - r) / abs(r) * 100.0 if r else 0.0 for m, r in zip(means, ref_means)]
+        # |engine - ImageJ| per pixel in Java, the maximum from the image statistics
+        diff = ip.convertToFloat().duplicate()
+        diff.copyBits(ref_float, 0, 0, Blitter.DIFFERENCE)
+        max_px = diff.getStatistics().max
+        max_rel = max(rel) if rel else 0.0
+
+        rows.append([engine, radius, round(ms, 2), round(ref_ms / ms, 2) if ms else "",
+                     round(max_rel, 4), max_px, max_rel <= tolerance_pct])
+        IJ.log("Background {}: {:.1f} ms, x{} vs ImageJ, max nucleus MFI diff {:.3f}%, max pixel diff {} -> {}".format(
+            engine, ms, rows[-1][3], max_rel, max_px, "OK" if max_rel <= tolerance_pct else "OUT OF TOLERANCE"))
+
+    if tile > 0:
+        for engine in (BG_ROLLING, BG_PARABOLOID):
+            full, _ = run(engine)
+            imp = ImagePlus("bg_benchmark", raw_ip.duplicate())
+            start = System.nanoTime()
+            subtract_background_tiled(imp, radius, tile, n_threads, use_paraboloid=(engine == BG_PARABOLOID))
+            ms = (System.nanoTime() - start) / 1e6
+            diff = imp.getProcessor().convertToFloat().duplicate()
+            diff.copyBits(full.convertToFloat(), 0, 0, Blitter.DIFFERENCE)
+            max_px = diff.getStatistics().max
+            rows.append([engine + " (tiled {})".format(tile), radius, round(ms, 2), "", "", max_px, max_px == 0])
+            IJ.log("Background {} tiled ({} px) vs full frame: max pixel diff {} -> {}".format(
+                engine, tile, max_px, "OK" if max_px == 0 else "TILES DIFFER"))
+
+    path = os.path.join(output_dir, BG_BENCHMARK_FILE)
+    new_file = not os.path.exists(path)
+    with open(path, "ab") as f:
+        writer = csv.writer(f)
+        if new_file:
+            writer.writerow(["engine", "radius", "ms_per_image", "speedup", "max_nucleus_mfi_diff_pct",
+                             "max_pixel_diff", "within_tolerance"])
+        writer.writerows(rows)
+
+# --- Tiled processing ---
+
+class TileTask(Callable):
+    def __init__(self, fn, args):
+        self.fn = fn
+        self.args = args
+
+    def call(self):
+        return self.fn(*self.args)
+
+def tile_grid(width, height, tile, halo, align=1):
+    """
+    List of (core, ext) Rectangles covering the image: cores do not overlap,
+    ext = core grown by halo pixels and clipped to the image.
+    align : ext origins are snapped down to multiples of it (e.g. the shrink factor of
+            ImageJ's rolling ball, so every tile is binned on the full-frame grid).
+    """
+    grid = []
+    for y in range(0, height, tile):
+        for x in range(0, width, tile):
+            core = Rectangle(x, y, min(tile, width - x), min(tile, height - y))
+            x1 = max(0, x - halo) // align * align
+            y1 = max(0, y - halo) // align * align
+            x2 = min(width, x + core.width + halo)
+            y2 = min(height, y + core.height + halo)
+            grid.append((core, Rectangle(x1, y1, x2 - x1, y2 - y1)))
+    return grid
+
+def _core_of(tile_ip, core, ext):
+    tile_ip.setRoi(Rectangle(core.x - ext.x, core.y - ext.y, core.width, core.height))
+    return tile_ip.crop()
+
+def process_tiles(src_ip, dst_ip, fn, tile, halo, n_threads=0, align=1):
+    """
+    Apply fn(tile_ip) to every tile (with halo) of src_ip in parallel and write the
+    tile cores into dst_ip (must not be src_ip, halos need the original data).
+    Tiles are cut and inserted on the
+    calling thread, at most n_threads tiles are in memory at a time, so the memory
+    stays bounded by the tile size instead of the image size.
+    """
+    if n_threads <= 0:
+        n_threads = Runtime.getRuntime().availableProcessors()
+    grid = tile_grid(src_ip.getWidth(), src_ip.getHeight(), tile, halo, align)
+
+    def work(tile_ip, core, ext):
+        fn(tile_ip)
+        return _core_of(tile_ip, core, ext)
+
+    pool = Executors.newFixedThreadPool(n_threads)
+    try:
+        for start in range(0, len(grid), n_threads):
+            batch = grid[start:start + n_threads]
+            futures = []
+            for core, ext in batch:
+                src_ip.setRoi(ext)
+                futures.append(pool.submit(TileTask(work, (src_ip.crop(), core, ext))))
+            src_ip.resetRoi()
+            for (core, ext), fut in zip(batch, futures):
+                dst_ip.insert(fut.get(), core.x, core.y)
+    finally:
+        pool.shutdown()
+    return dst_ip
+
+def blur_accuracy(ip):
+    # same kernel accuracy as Process > Filters > Gaussian Blur... (copied in segmentation_sweep.py)
+    if isinstance(ip, (ByteProcessor, ColorProcessor)):
+        return 0.002
+    return 0.0002
+
+def gaussian_halo(sigma, accuracy=0.0002):
+    # IJ kernel radius is ceil(sigma * sqrt(-2 ln(accuracy))) + 1 (~3.5 sigma for 8-bit, ~4.1 sigma otherwise)
+    return int(math.ceil(sigma * math.sqrt(-2 * math.log(accuracy)))) + 1 + 2
+
+def ij_shrink_factor(radius):
+    # shrink factor ImageJ's RollingBall picks for a radius (the sliding paraboloid does not shrink)
+    if radius <= 10:
+        return 1
+    if radius <= 30:
+        return 2
+    if radius <= 100:
+        return 4
+    return 8
+
+def rolling_ball_halo(radius, shrink=1):
+    # ball diameter plus margin for the 3x3 pre-smoothing and the interpolation of the
+    # shrunk background (a few shrunk pixels), in whole shrunk pixels
+    halo = int(math.ceil(2 * radius)) + 4 * shrink + 8
+    return int(math.ceil(float(halo) / shrink)) * shrink
+
+def gaussian_blur_tiled(imp, sigma, tile, n_threads=0):
+    """
+    Gaussian blur of the current plane, tile by tile, into a new ImagePlus of the same type.
+    """
+    src = imp.getProcessor()
+    dst = src.createProcessor(src.getWidth(), src.getHeight())
+    accuracy = blur_accuracy(src)
+
+    def blur(ip):
+        GaussianBlur().blurGaussian(ip, sigma, sigma, accuracy)
+
+    process_tiles(src, dst, blur, tile, gaussian_halo(sigma, accuracy), n_threads)
+    out = ImagePlus("DAPI_work", dst)
+    out.setCalibration(imp.getCalibration().copy())
+    return out
+
+def subtract_background_tiled(imp, radius, tile, n_threads=0, light_background=False,
+                              use_paraboloid=False, do_presmooth=True):
+    """
+    Rolling-ball (or paraboloid) background subtraction of the current plane, tile by tile.
+    ImageJ shrinks the image for large balls (ij_shrink_factor) and interpolates the
+    background back: tile origins are snapped to the shrink grid of the full frame and the
+    halo covers the ball, the pre-smoothing and the interpolation, so the tile cores get
+    the full-frame result (checked by the background benchmark in tiled mode).
+    The downsampled engine is not tiled (ask_params_for_image rejects the combination).
+    """
+    radius = float(radius)
+    ip = imp.getProcessor()
+    dst = ip.createProcessor(ip.getWidth(), ip.getHeight())
+    shrink = 1 if use_paraboloid else ij_shrink_factor(radius)
+
+    def rolling_ball(tile_ip):
+        BackgroundSubtracter().rollingBallBackground(
+            tile_ip, radius, False, bool(light_background),
+            bool(use_paraboloid), bool(do_presmooth), False)
+
+    process_tiles(ip, dst, rolling_ball, tile, rolling_ball_halo(radius, shrink), n_threads, align=shrink)
+    ip.setPixels(dst.getPixels())
+    imp.updateAndDraw()
+
+# --- Global threshold ---
+
+# copied in segmentation_sweep.py, keep in sync
+def channel_plane(imp, channel):
+    """
+    Processor of one channel (first slice/frame) read straight from the stack,
+    without splitting the image into windows.
+    """
+    return imp.getStack().getProcessor(imp.getStackIndex(int(channel), 1, 1))
+
+def blurred_histogram(ip, sigma):
+    """
+    Full histogram (256 bins for 8-bit, 65536 for 16-bit) of the blurred plane,
+    i.e. of the same data the per-image threshold is computed on.
+    """
+    work = ip.duplicate()
+    GaussianBlur().blurGaussian(work, sigma, sigma, blur_accuracy(work))
+    return list(work.getHistogram())
+
+def merge_histograms(total, hist):
+    if total is None:
+        return list(hist)
+    return [a + b for a, b in zip(total, hist)]
+
+def threshold_from_histogram(hist, method):
+    """
+    Lower threshold (raw pixel value) for bright nuclei on a dark background,
+    computed like IJ.setAutoThreshold("<method> dark"): 16-bit histograms are
+    re-binned to 256 bins over their min..max range first.
+    """
+    nonzero = [i for i, c in enumerate(hist) if c > 0]
+    if not nonzero:
+        return 0.0
+    if len(hist) == 256:
+        lo, bin_width, h256 = 0, 1.0, list(hist)
+    else:
+        lo, hi = nonzero[0], nonzero[-1]
+        bin_width = (hi - lo + 1) / 256.0
+        h256 = [0] * 256
+        for v in range(lo, hi + 1):
+            if hist[v]:
+                h256[min(255, int((v - lo) / bin_width))] += hist[v]
+    t = AutoThresholder().getThreshold(AutoThresholder.Method.valueOf(method), array(h256, "i"))
+    return lo + (t + 1) * bin_width
+
+def read_global_thresholds(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, "rb") as f:
+        return list(csv.DictReader(f))
+
+def global_threshold(plate, sample_imps, p, cache_dir):
+    """
+    Threshold for the whole plate from the merged histogram of sampled images.
+    Cached in <cache_dir>/global_thresholds.csv per plate, method, DAPI channel and sigma,
+    so re-runs and later batches of the same plate reuse the same cut.
+
+    sample_imps : iterable of ImagePlus (may be lazily opened), or a callable returning it
+    """
+    path = os.path.join(cache_dir, GLOBAL_THRESHOLDS_FILE)
+    key = {"plate": plate, "method": p["thr_method"],
+           "channel": str(p["DAPI_CHANNEL"]), "sigma": str(p["gaussian_blur_sigma"])}
+    for row in read_global_thresholds(path):
+        if all(row.get(k) == v for k, v in key.items()):
+            IJ.log("Global threshold from cache: {} (plate {}, {} images)".format(
+                row["lower"], plate, row["n_images"]))
+            return float(row["lower"])
+
+    if callable(sample_imps):
+        sample_imps = sample_imps()
+    total = None
+    n_images = 0
+    for imp in sample_imps:
+        ip = channel_plane(imp, p["DAPI_CHANNEL"])
+        total = merge_histograms(total, blurred_histogram(ip, p["gaussian_blur_sigma"]))
+        n_images += 1
+    if total is None:
+        raise Exception("No images to compute the global threshold")
+
+    lower = threshold_from_histogram(total, p["thr_method"])
+    new_file = not os.path.exists(path)
+    with open(path, "ab") as f:
+        writer = csv.DictWriter(f, fieldnames=["plate", "method", "channel", "sigma", "lower", "n_images"])
+        if new_file:
+            writer.writeheader()
+        row = dict(key)
+        row["lower"] = lower
+        row["n_images"] = n_images
+        writer.writerow(row)
+    IJ.log("Global threshold computed: {} (plate {}, {} images)".format(lower, plate, n_images))
+    return lower
+
+def sample_evenly(items, k):
+    """
+    k items spread evenly over the list (all items if k <= 0 or k >= len).
+    """
+    if k <= 0 or k >= len(items):
+        return list(items)
+    step = len(items) / float(k)
+    return [items[int(i * step)] for i in range(k)]
+
+def record_threshold(image_title, p, mode, applied, auto):
+    """
+    Append the threshold used for an image (and its own auto threshold) to thresholds.csv,
+    to monitor drift across a plate.
+    """
+    path = os.path.join(output_dir, THRESHOLDS_FILE)
+    new_file = not os.path.exists(path)
+    with open(path, "ab") as f:
+        writer = csv.writer(f)
+        if new_file:
+            writer.writerow(["image", "method", "mode", "applied_lower", "image_auto_lower"])
+        writer.writerow([image_title, p["thr_method"], mode, applied, "" if auto is None else auto])
+
+def read_checkpoint(output_dir):
+    """
+    Items whose last journaled status in the checkpoint is "done" (skipped on resume).
+    """
+    path = os.path.join(output_dir, CHECKPOINT_FILE)
+    last = {}
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            for row in csv.DictReader(f):
+                last[row["item"]] = row["status"]
+    return set(item for item, status in last.items() if status == "done")
+
+def append_checkpoint(output_dir, item, status, attempt, error=None, where=None):
+    """
+    Append-only journal of every attempt: done / retry / failed with the failure reason
+    (where: part of the item that failed, e.g. a ROI).
+    """
+    path = os.path.join(output_dir, CHECKPOINT_FILE)
+    new_file = not os.path.exists(path)
+    with open(path, "ab") as f:
+        writer = csv.writer(f)
+        if new_file:
+            writer.writerow(CHECKPOINT_COLUMNS)
+        writer.writerow([item, status, attempt,
+                         "" if error is None else error_type(error),
+                         "" if error is None else
+                         ((where + ": ") if where else "") + str(error).replace("\n", " "),
+                         time.strftime("%Y-%m-%dT%H:%M:%S")])
+
+def error_type(e):
+    return type(e).__name__ if not isinstance(e, Throwable) else e.getClass().getSimpleName()
+
+def window_ids():
+    ids = WindowManager.getIDList()
+    return set(ids) if ids else set()
+
+def reset_attempt(keep_ids):
+    """
+    Undo a failed attempt before the retry: close the windows it opened (split channels,
+    work images), the ROI Manager and the Results table.
+    """
+    for wid in window_ids() - keep_ids:
+        w = WindowManager.getImage(wid)
+        if w is not None:
+            w.changes = False
+            w.close()
+    cleanup_iteration()
+    close_results_table()
+
+def is_transient(e):
+    """
+    I/O errors and running out of memory can pass on a second attempt; errors in the data cannot.
+    """
+    return isinstance(e, (IOError, OSError, IOException, OutOfMemoryError))
+
+def with_retries(fn, retries, label, cleanup=None, on_retry=None):
+    """
+    Call fn(), again up to `retries` times if it fails with a transient error
+    (on_retry(attempt, error), e.g. the checkpoint "retry" row, then cleanup() and a
+    garbage collection run between attempts).
+    Returns (attempts, None) on success, (attempts, last error) otherwise.
+    """
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            fn()
+            return attempt, None
+        except (Exception, Throwable) as e:
+            IJ.log("ERROR in {} (attempt {}): {}".format(label, attempt, e))
+            IJ.log(traceback.format_exc())  # comment out if too verbose
+            if attempt > retries or not is_transient(e):
+                return attempt, e
+            if on_retry is not None:
+                on_retry(attempt, e)
+            if cleanup is not None:
+                cleanup()
+            System.gc()
+            IJ.log("Transient error, retry {}/{}: {}".format(attempt, retries, label))
+
 def process_image(imp, p):
     '''
     This function process a single image
@@ -254,6 +834,8 @@ def process_image(imp, p):
     exclude_edges = p["exclude_edges"] # bool
     fill_holes = p["fill_holes"] # bool
     single_roi = p["single_roi"] # bool
+    tile_size = p.get("tile_size", 0)
+    tile_threads = p.get("tile_threads", 0)
 
     # Processing image title
     img_title = imp.getTitle()
@@ -272,27 +854,63 @@ def process_image(imp, p):
     meas_imp = pick_channel_by_index(split_imps, MEASURE_CHANNEL)
 
     if dapi_imp is None or meas_imp is None:
-        IJ.error("Missing channels for: " + img_title)
         close_images(split_imps)
-        return
+        # raised, not returned: the image must be journaled as failed, not done
+        raise ValueError("Missing channels for: " + img_title)
+
+    # Lazily opened images: materialize only the two channels we work on
+    for ch_imp in (dapi_imp, meas_imp):
+        if ch_imp.getStack().isVirtual():
+            ch_imp.setStack(ch_imp.getStack().duplicate())
     
+    # Tiled mode only pays off for images larger than one tile
+    tiled = tile_size > 0 and max(imp.getWidth(), imp.getHeight()) > tile_size
+
+    # Raw measurement plane kept only for the one-off background benchmark
+    raw_meas = None
+    if substruct_bg and p.get("bg_benchmark") and not p.get("bg_benchmark_done"):
+        raw_meas = meas_imp.getProcessor().duplicate()
+
     # --- Background substurction in MEASUREMENT channel ---
     if substruct_bg:
-        subtract_background(meas_imp, bg_radius, light_background=False, use_paraboloid=False, do_presmooth=True)
+        if tiled:
+            subtract_background_tiled(meas_imp, bg_radius, tile_size, tile_threads,
+                                      use_paraboloid=(p.get("bg_engine") == BG_PARABOLOID))
+        else:
+            subtract_background(meas_imp, bg_radius, light_background=False, use_paraboloid=False, do_presmooth=True,
+                                engine=p.get("bg_engine", BG_ROLLING))
 
     # --- NUCLEI SEGMENTATION ON DAPI
 
-    # Work on a duplicate so we don’t modify the original DAPI channel image
-    dapi_work = dapi_imp.duplicate()
-    dapi_work.setTitle("DAPI_work")
-    dapi_work.show()
-
     # Preprocessing: helps reduce uneven background and noise
-    IJ.run(dapi_work, "Gaussian Blur...", "sigma={}".format(gaussian_blur_sigma))
+    # (blur -> threshold -> fill holes -> erode/dilate -> particles is mirrored by segmentation_sweep.SweepCache)
+    if tiled:
+        # blurred copy built tile by tile; thresholding and the binary steps below
+        # run on the whole frame, so nuclei crossing tile seams stay in one piece
+        dapi_work = gaussian_blur_tiled(dapi_imp, gaussian_blur_sigma, tile_size, tile_threads)
+        dapi_work.show()
+    else:
+        # Work on a duplicate so we don’t modify the original DAPI channel image
+        dapi_work = dapi_imp.duplicate()
+        dapi_work.setTitle("DAPI_work")
+        dapi_work.show()
+        IJ.run(dapi_work, "Gaussian Blur...", "sigma={}".format(gaussian_blur_sigma))
 
     # Thresholding: create a binary mask from the DAPI channel
     # "{} dark" assumes nuclei are bright on a dark background
-    IJ.setAutoThreshold(dapi_work, "{} dark".format(thr_method))
+    global_lower = p.get("global_threshold")
+    auto_lower = None
+    if global_lower is None:
+        IJ.setAutoThreshold(dapi_work, "{} dark".format(thr_method))
+        auto_lower = dapi_work.getProcessor().getMinThreshold()
+        record_threshold(img_title, p, THR_PER_IMAGE, auto_lower, auto_lower)
+    else:
+        # fixed plate-wide cut, no per-image threshold search
+        if p.get("log_auto_threshold", False):
+            auto_lower = threshold_from_histogram(list(dapi_work.getProcessor().getHistogram()), thr_method)
+        max_value = 255 if dapi_work.getBitDepth() == 8 else 65535
+        IJ.setThreshold(dapi_work, global_lower, max_value)
+        record_threshold(img_title, p, THR_GLOBAL, global_lower, auto_lower)
     IJ.run(dapi_work, "Convert to Mask", "")
 
     # Post-processing: fill holes inside nuclei
@@ -305,7 +923,7 @@ def process_image(imp, p):
             IJ.run("Erode")
     # Make dilation to restore original size after erosion (optional, can be adjusted by user)
     if dilation_steps > 0:
-        for i in range(n):
+        for i in range(dilation_steps):
             IJ.run("Dilate")
 
     # --- ANALYZE PARTICLES -> ROIs IN ROI MANAGER
@@ -372,7 +990,13 @@ def process_image(imp, p):
     IJ.save(mask_particles, mask_path)
 
     # --- Measure on measurement channel ---
-    IJ.run("Set Measurements...", "area mean decimal=3")  # no redirect
+    if raw_meas is not None:
+        benchmark_background(raw_meas, rm.getRoisAsArray(), bg_radius, p["bg_benchmark_tolerance"],
+                             tile=(tile_size if tiled else 0), n_threads=tile_threads)
+        p["bg_benchmark_done"] = True
+
+    # "display" adds a Label column "<image>:<roi name>" -> nucleus id in stats
+    IJ.run("Set Measurements...", "area mean display decimal=3")  # no redirect
     IJ.run("Clear Results", "")
     rm.runCommand(meas_imp, "Measure")
 
@@ -397,33 +1021,52 @@ def process_image(imp, p):
 
 # --- Main ---
 
-# Check if at least one image is opened
-ids = WindowManager.getIDList()
-if not ids:
-    IJ.error("No images open.")
+src = ask_source()
+if src is None:
+    IJ.error("No input selected!")
     raise SystemExit
+source, root, pattern, ext = src
+
+if source == SOURCE_FOLDER:
+    # Lazy mode: files are opened one at a time and closed after processing,
+    # so only one image is in memory at any moment
+    files = find_files(root, pattern, ext)
+    if not files:
+        IJ.error("No files matching '{}' with extension '{}' in: {}".format(pattern, ext, root))
+        raise SystemExit
+    n = "?" # a file can hold several series, the total is known only after opening
+    IJ.log("Found {} file(s) in: {}".format(len(files), root))
+    unique_images = iter_images(files)
+    first_title = os.path.basename(files[0])
+else:
+    # Check if at least one image is opened
+    ids = WindowManager.getIDList()
+    if not ids:
+        IJ.error("No images open.")
+        raise SystemExit
 
-# Opened images checking and filtration
-images = [] # store images in the list
-for wid in ids:
-    imp = WindowManager.getImage(wid)
-    if imp is None:
-        continue
-    title = imp.getTitle()
+    # Opened images checking and filtration
+    images = [] # store images in the list
+    for wid in ids:
+        imp = WindowManager.getImage(wid)
+        if imp is None:
+            continue
+        title = imp.getTitle()
 
-    # Skip typical derived images (adjust if needed)
-    if (title.startswith("C") and "-" in title) or title in ["DAPI_work", "Nuclei_mask_particles_only"]:
-        continue         
-    images.append(imp)
+        # Skip typical derived images (adjust if needed)
+        if (title.startswith("C") and "-" in title) or title in ["DAPI_work", "Nuclei_mask_particles_only"]:
+            continue
+        images.append(imp)
 
-# Check if there are some suitable images after filtration
-if not images:
-    IJ.error("No suitable images found (only derived windows are open)!")
-    raise SystemExit
+    # Check if there are some suitable images after filtration
+    if not images:
+        IJ.error("No suitable images found (only derived windows are open)!")
+        raise SystemExit
 
-# Keep only unique images
-unique_images = list(set(images))
-n = len(unique_images) # total amount of images to process
+    # Keep only unique images
+    unique_images = list(set(images))
+    n = len(unique_images) # total amount of images to process
+    first_title = unique_images[0].getTitle()
 
 # Ask user where to save outputs
 output_dir = IJ.getDirectory("Choose a directory to save data")
@@ -434,32 +1077,69 @@ if output_dir is None:
 errors = []  # collect all errors here
 
 # Ask user about the parameters
-params = ask_params_for_image(imp.getTitle())
+params = ask_params_for_image(first_title)
 if params is None:
     IJ.error("No parameters provided!")
     raise SystemExit
+
+# Plate-wide threshold, computed once (or read from the cache) before the loop
+if params["threshold_mode"] == THR_GLOBAL:
+    if source == SOURCE_FOLDER:
+        plate = os.path.basename(os.path.normpath(root))
+        sample_files = sample_evenly(files, params["threshold_sample"])
+
+        def sample_imps():
+            for path in sample_files:
+                for sample in open_lazy(path):
+                    try:
+                        yield sample
+                    finally:
+                        sample.changes = False
+                        sample.close()
+    else:
+        plate = os.path.basename(os.path.normpath(output_dir))
+        sample_imps = lambda: sample_evenly(unique_images, params["threshold_sample"])
+    params["global_threshold"] = global_threshold(plate, sample_imps, params, output_dir)
     
+# Images finished in a previous run (journaled in the checkpoint)
+done_items = read_checkpoint(output_dir) if params["resume"] else set()
+if done_items:
+    IJ.log("Resume: {} image(s) are done in {}.".format(len(done_items), CHECKPOINT_FILE))
+n_skipped = 0
+
 # ---- Loop: show GUI per image, then process ----
 for call_id, imp in enumerate(unique_images, start=1):
-    # Make Log message
-    msg = "Processing {}/{}: {}".format(call_id, n, imp.getTitle())
-    IJ.log(msg)
-
+    title = imp.getTitle()
     try:
-        process_image(imp, params)
+        if title in done_items:
+            IJ.log("Skip {}/{} (done): {}".format(call_id, n, title))
+            n_skipped += 1
+            continue
 
-    except Exception as e:
-        # log immediately
-        IJ.log("ERROR in {}: {}".format(imp.getTitle(), e))
-        IJ.log(traceback.format_exc())  # comment out if too verbose
-        continue
+        # Make Log message
+        msg = "Processing {}/{}: {}".format(call_id, n, title)
+        IJ.log(msg)
+
+        keep_ids = window_ids()
+        attempts, error = with_retries(lambda: process_image(imp, params), params["retries"], title,
+                                       cleanup=lambda: reset_attempt(keep_ids),
+                                       on_retry=lambda a, e: append_checkpoint(output_dir, title, "retry", a, e))
+        if error is None:
+            append_checkpoint(output_dir, title, "done", attempts)
+        else:
+            append_checkpoint(output_dir, title, "failed", attempts, error)
+            errors.append({"id": call_id, "title": title, "type": error_type(error), "msg": str(error)})
 
     finally:
         # clean-up ROI manager
         cleanup_iteration()
+        # in folder mode the image was opened by us: release it before the next one
+        if source == SOURCE_FOLDER:
+            imp.changes = False
+            imp.close()
 
 # ---- After the loop: print a summary ----
-IJ.log("===== RUN SUMMARY: {} error(s) =====".format(len(errors)))
+IJ.log("===== RUN SUMMARY: {} error(s), {} image(s) skipped as done =====".format(len(errors), n_skipped))
 for k, er in enumerate(errors, start=1):
     IJ.log("#{k} [{id}] {title} | {type}: {msg}".format(
         k=k, id=er["id"], title=er["title"], type=er["type"], msg=er["msg"]
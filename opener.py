@@ -1,8 +1,72 @@
 # Open files from a folder if filename contains "mask" and has a given extension.
-from ij import IJ
+# Lazy mode opens files as virtual stacks (Bio-Formats virtual series for .nd2, .czi, ...),
+# so only the planes that are displayed or processed are read from disk.
+from ij import IJ, WindowManager
 from ij.gui import GenericDialog
 import os
 
+# BIOFORMATS_EXTS, find_files, series_count and open_lazy are copied in nuclei_segmentation.py, keep in sync
+BIOFORMATS_EXTS = (".nd2", ".czi", ".lif", ".lsm", ".oib", ".vsi")
+
+# copied in nuclei_segmentation.py, keep in sync
+def find_files(root, pattern, ext):
+    """
+    Sorted list of files under root whose name contains pattern and ends with ext.
+    """
+    found = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        for name in filenames:
+            lower = name.lower()
+            if lower.endswith(ext) and (pattern in lower):
+                found.append(os.path.join(dirpath, name))
+    found.sort()
+    return found
+
+# copied in nuclei_segmentation.py, keep in sync
+def series_count(path):
+    from loci.formats import ImageReader
+    reader = ImageReader()
+    try:
+        reader.setId(path)
+        return reader.getSeriesCount()
+    finally:
+        reader.close()
+
+# copied in nuclei_segmentation.py, keep in sync
+def open_lazy(path):
+    """
+    Yield the images of one file as virtual stacks, one ImagePlus per series.
+    """
+    lower = path.lower()
+    if lower.endswith(BIOFORMATS_EXTS):
+        for s in range(1, series_count(path) + 1):
+            before = set(WindowManager.getIDList() or [])
+            IJ.run("Bio-Formats Importer",
+                   "open=[{}] color_mode=Default view=Hyperstack stack_order=XYCZT "
+                   "use_virtual_stack series_{}".format(path, s))
+            after = set(WindowManager.getIDList() or [])
+            for wid in sorted(after - before):
+                imp = WindowManager.getImage(wid)
+                if imp is not None:
+                    yield imp
+    elif lower.endswith((".tif", ".tiff")):
+        imp = IJ.openVirtual(path)
+        if imp is not None:
+            yield imp
+    else:
+        # formats without virtual stack support are opened normally
+        imp = IJ.openImage(path)
+        if imp is not None:
+            yield imp
+
+def iter_images(root, pattern, ext):
+    """
+    Yield matching images one at a time as virtual stacks.
+    """
+    for path in find_files(root, pattern, ext):
+        for imp in open_lazy(path):
+            yield imp
+
 # Chose the directory to open files from
 root = IJ.getDirectory("Choose a root directory")
 if not root:
@@ -14,6 +78,7 @@ gd = GenericDialog("Open files by pattern")
 
 gd.addStringField("Filename contains:", "mask", 15)
 gd.addStringField("Extension (e.g. .tif):", ".jpg", 10)
+gd.addCheckbox("Open as virtual stacks (lazy)", False)
 
 gd.showDialog()
 if gd.wasCanceled():
@@ -21,6 +86,7 @@ if gd.wasCanceled():
 
 pattern = gd.getNextString().strip()
 ext = gd.getNextString().strip()
+lazy = gd.getNextBoolean()
 
 # --- Validate input ---
 if pattern == "":
@@ -39,12 +105,14 @@ pattern = pattern.lower()
 ext = ext.lower()
 
 count = 0
-for dirpath, dirnames, filenames in os.walk(root):
-    for name in filenames:
-        lower = name.lower()
-        if lower.endswith(ext.lower()) and (pattern.lower() in lower):
-            path = os.path.join(dirpath, name)
-            IJ.openImage(path).show()
-            count += 1
+if lazy:
+    for imp in iter_images(root, pattern, ext):
+        if not imp.isVisible():
+            imp.show()
+        count += 1
+else:
+    for path in find_files(root, pattern, ext):
+        IJ.openImage(path).show()
+        count += 1
 
 IJ.log("Opened {} file(s) from: {}".format(count, root))
@@ -0,0 +1,79 @@
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+import threading
+
+
+def prefetch(items, load, depth=2, workers=2):
+    """
+    Yield (item, load(item)) in order while the next `depth` items are loaded
+    in background threads. At most depth + 1 loaded items exist at a time,
+    so memory stays bounded however long the input is.
+    """
+    items = iter(items)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="prefetch") as pool:
+        pending = deque()
+
+        def fill():
+            while len(pending) < depth + 1:
+                try:
+                    item = next(items)
+                except StopIteration:
+                    return
+                pending.append((item, pool.submit(load, item)))
+
+        fill()
+        while pending:
+            item, fut = pending.popleft()
+            fill()
+            yield item, fut.result()
+
+
+class AsyncWriter:
+    """
+    Run output tasks (CSV / plot writes) in one background thread, in submission order.
+    submit() blocks when max_pending tasks are queued (backpressure), and close()
+    waits for everything and re-raises the first error.
+
+    One thread on purpose: the order of outputs stays the same as in a sequential run.
+    """
+    def __init__(self, max_pending=2, name="writer"):
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix=name)
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._futures = []
+
+    def submit(self, fn, *args, **kwargs):
+        self._slots.acquire()
+
+        def task():
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self._slots.release()
+
+        fut = self._pool.submit(task)
+        self._futures.append(fut)
+        # surface errors early instead of at close()
+        done = [f for f in self._futures if f.done()]
+        self._futures = [f for f in self._futures if not f.done()]
+        for f in done:
+            f.result()
+        return fut
+
+    def close(self):
+        try:
+            for f in self._futures:
+                f.result()
+        finally:
+            self._pool.shutdown(wait=True)
+            self._futures = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            # still wait for queued writes, but keep the original exception
+            self._pool.shutdown(wait=True)
+            return False
+        self.close()
+        return False
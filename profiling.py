@@ -0,0 +1,313 @@
+from pathlib import Path
+import os
+import sys
+import threading
+import time
+import tracemalloc
+import pandas as pd
+
+ENV_VAR = "LLPS_PROFILE"  # LLPS_PROFILE=1 turns the hooks on for stats.main / batch workers
+TOP_ENV_VAR = "LLPS_PROFILE_ALLOCATIONS"  # top allocation sites per stage (0 = no snapshots)
+STAGES_FILE = "profile_stages.csv"
+ALLOCATIONS_FILE = "profile_allocations.csv"
+SUMMARY_FILE = "profile_summary.txt"
+
+MB = 1024 * 1024
+
+
+def rss_bytes():
+    """
+    Current resident set size of this process (NaN if it cannot be read).
+    Linux: /proc/self/statm; elsewhere psutil if installed, else the peak RSS from getrusage.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024  # bytes on macOS, KiB on Linux
+    except ImportError:
+        return float("nan")
+
+
+class _NullStage:
+    """Shared no-op context manager returned by stage() while profiling is off."""
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage:
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.profiler._enter(self.name)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.profiler._exit()
+        return False
+
+
+class Profiler:
+    """
+    Stage-boundary memory profiler: RSS and tracemalloc are sampled when a stage is
+    entered and left, so the cost is per stage, not per allocation site in our code.
+
+    Stages nest (main/MFI_foci_all/MFI_foci/to_gray) and are aggregated by their path.
+    With top > 0, the first call of every stage path also takes tracemalloc snapshots and
+    keeps the top allocation sites that grew during the stage. Snapshots are slow and are
+    taken outside the timed interval, so they do not count in the stage seconds.
+
+    tracemalloc is process-wide: allocations made by background threads (prefetch, writer)
+    are counted in the stage active on the main thread at that time. Only the main thread
+    resets the peak counter, so the peak of a background stage is the process peak since
+    the last main-thread stage boundary (an upper bound).
+    """
+    def __init__(self, top=0, frames=1):
+        self.top = top
+        self.frames = frames
+        self.records = {}       # stage path -> aggregated numbers
+        self.allocations = []   # rows of the allocation report
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+
+    def stop(self):
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def reset(self):
+        with self._lock:
+            self.records = {}
+            self.allocations = []
+
+    @staticmethod
+    def _snapshot():
+        # the profiler's own bookkeeping is not a site of the pipeline
+        return tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+        ])
+
+    def _stack(self):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _enter(self, name):
+        t0 = time.perf_counter()
+        stack = self._stack()
+        main_thread = threading.current_thread() is threading.main_thread()
+        if stack:
+            path = stack[-1]["path"] + "/" + name
+        elif main_thread:
+            path = name
+        else:
+            # background stages (prefetch, writer) are reported under their thread pool name
+            path = threading.current_thread().name.split("_")[0] + ":" + name
+
+        frame = {
+            "name": name,
+            "path": path,
+            "rss_start": rss_bytes(),
+            "snapshot": None,
+            "overhead": 0.0,  # profiler time spent inside this stage (child boundaries, snapshots)
+        }
+        with self._lock:
+            first_call = path not in self.records
+            if first_call:
+                # created on entry, so the report lists stages in call order (parents first)
+                self.records[path] = {
+                    "stage": path,
+                    "depth": len(stack),
+                    "calls": 0,
+                    "seconds": 0.0,
+                    "rss_start_mb": frame["rss_start"] / MB,
+                    "rss_end_mb": 0.0,
+                    "rss_max_mb": 0.0,
+                    "rss_delta_mb": 0.0,
+                    "alloc_delta_mb": 0.0,
+                    "peak_traced_mb": 0.0,
+                }
+        if first_call and self.top:
+            frame["snapshot"] = self._snapshot()
+
+        current, peak = tracemalloc.get_traced_memory()
+        if stack:
+            # keep the parent's peak so far, the counter is reset for the child below
+            stack[-1]["peak"] = max(stack[-1]["peak"], peak)
+        if main_thread:
+            # a reset from a background thread would wipe the peaks of the main-thread stages
+            tracemalloc.reset_peak()
+        frame["traced_start"] = current
+        frame["peak"] = current
+        if stack:
+            stack[-1]["overhead"] += time.perf_counter() - t0
+        stack.append(frame)
+        frame["start"] = time.perf_counter()  # last: the bookkeeping above is not stage time
+
+    def _exit(self):
+        t0 = time.perf_counter()
+        stack = self._stack()
+        frame = stack.pop()
+        seconds = t0 - frame["start"] - frame["overhead"]
+        current, peak = tracemalloc.get_traced_memory()
+        frame["peak"] = max(frame["peak"], peak)
+        if stack:
+            stack[-1]["peak"] = max(stack[-1]["peak"], frame["peak"])
+        rss_end = rss_bytes()
+
+        sites = []
+        if frame["snapshot"] is not None:
+            diff = self._snapshot().compare_to(frame["snapshot"], "lineno")
+            for stat in diff[:self.top]:
+                if stat.size_diff <= 0:
+                    continue
+                tb = stat.traceback[0]
+                sites.append({
+                    "stage": frame["path"],
+                    "site": f"{tb.filename}:{tb.lineno}",
+                    "size_diff_mb": round(stat.size_diff / MB, 3),
+                    "count_diff": stat.count_diff,
+                })
+
+        with self._lock:
+            rec = self.records[frame["path"]]
+            rec["calls"] += 1
+            rec["seconds"] += seconds
+            rec["rss_end_mb"] = rss_end / MB
+            rec["rss_max_mb"] = max(rec["rss_max_mb"], frame["rss_start"] / MB, rss_end / MB)
+            rec["rss_delta_mb"] += (rss_end - frame["rss_start"]) / MB
+            rec["alloc_delta_mb"] += (current - frame["traced_start"]) / MB
+            rec["peak_traced_mb"] = max(rec["peak_traced_mb"], frame["peak"] / MB)
+            self.allocations.extend(sites)
+        if stack:
+            stack[-1]["overhead"] += frame["overhead"] + time.perf_counter() - t0
+
+    def stages(self):
+        with self._lock:
+            df = pd.DataFrame(list(self.records.values()))
+        if df.empty:
+            return df
+        return df.round(3)
+
+    def summary(self, width=40):
+        """
+        Flame-style text summary: the stage tree in call order with a bar proportional
+        to the peak traced memory of every stage.
+        """
+        df = self.stages()
+        if df.empty:
+            return "No profiled stages.\n"
+        df = df[df["calls"] > 0]
+        # children right below their parent, siblings in call order (threads interleave in records)
+        first_seen = {p: i for i, p in enumerate(df["stage"])}
+        tree_key = lambda p: tuple(first_seen.get("/".join(p.split("/")[:k + 1]), -1)
+                                   for k in range(p.count("/") + 1))
+        df = df.iloc[sorted(range(len(df)), key=lambda i: tree_key(df["stage"].iloc[i]))]
+        top = df["peak_traced_mb"].max() or 1.0
+        lines = [f"{'stage':<48} {'calls':>6} {'time s':>8} {'peak MB':>9} {'RSS max MB':>10}"]
+        for _, r in df.iterrows():
+            label = "  " * int(r["depth"]) + r["stage"].rsplit("/", 1)[-1]
+            bar = "#" * max(1, int(round(width * r["peak_traced_mb"] / top)))
+            lines.append(f"{label:<48} {int(r['calls']):>6} {r['seconds']:>8.2f} "
+                         f"{r['peak_traced_mb']:>9.1f} {r['rss_max_mb']:>10.1f}  {bar}")
+        return "\n".join(lines) + "\n"
+
+    def write_report(self, output_dir):
+        """
+        Write profile_stages.csv, profile_allocations.csv and profile_summary.txt into output_dir.
+        """
+        output_dir = Path(str(output_dir).strip())
+        self.stages().to_csv(output_dir / STAGES_FILE, index=False)
+        with self._lock:
+            allocations = pd.DataFrame(self.allocations,
+                                       columns=["stage", "site", "size_diff_mb", "count_diff"])
+        allocations.to_csv(output_dir / ALLOCATIONS_FILE, index=False)
+        summary = self.summary()
+        (output_dir / SUMMARY_FILE).write_text(summary)
+        print(summary, end="")
+        print(f"Memory profile is saved in the directory: {output_dir}.")
+
+
+_profiler = None
+
+
+def enable(top=None, frames=1):
+    """
+    Turn profiling on for this process (and, through the environment variables, for
+    worker processes started afterwards).
+    top : allocation sites reported per stage; taking the snapshots is slow, so it is off
+          by default (LLPS_PROFILE_ALLOCATIONS, else 0)
+    """
+    global _profiler
+    if top is None:
+        try:
+            top = int(os.environ.get(TOP_ENV_VAR, "0") or 0)
+        except ValueError:
+            top = 0
+    os.environ[ENV_VAR] = "1"
+    os.environ[TOP_ENV_VAR] = str(top)
+    if _profiler is None:
+        _profiler = Profiler(top=top, frames=frames)
+    _profiler.start()
+    return _profiler
+
+
+def disable():
+    global _profiler
+    if _profiler is not None:
+        _profiler.stop()
+    _profiler = None
+    os.environ.pop(ENV_VAR, None)
+    os.environ.pop(TOP_ENV_VAR, None)
+
+
+def enabled():
+    return _profiler is not None
+
+
+def stage(name):
+    """
+    with stage("MFI_foci"): ...
+    A shared no-op object while profiling is off, so the hooks can stay in the code.
+    """
+    if _profiler is None:
+        return _NULL_STAGE
+    return _Stage(_profiler, name)
+
+
+def write_report(output_dir, reset=True):
+    """
+    Write the report of everything profiled so far (no-op while profiling is off).
+    With reset, the next report starts empty (e.g. the next experiment of a batch worker).
+    """
+    if _profiler is None:
+        return
+    _profiler.write_report(output_dir)
+    if reset:
+        _profiler.reset()
+
+
+if os.environ.get(ENV_VAR, "").strip().lower() not in ("", "0", "false", "no", "off"):
+    enable()
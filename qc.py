@@ -0,0 +1,233 @@
+from pathlib import Path
+import html
+import re
+import numpy as np
+import pandas as pd
+
+import stats
+from pipeline import AsyncWriter
+from regions import ring_offsets
+
+QC_DIR = "qc"
+INDEX_FILE = "index.html"
+
+# RGB colors of the overlay
+FOCUS_COLOR = (0, 255, 0)
+OUTLIER_COLOR = (255, 0, 255)
+NUCLEUS_COLOR = (255, 255, 0)
+
+
+def stretch(gray, low=1.0, high=99.5):
+    """
+    Grayscale image -> uint8 with a percentile contrast stretch.
+    """
+    gray = np.asarray(gray, dtype=np.float64)
+    lo, hi = np.percentile(gray, [low, high])
+    if hi <= lo:
+        hi = lo + 1.0
+    return (np.clip((gray - lo) / (hi - lo), 0, 1) * 255).astype(np.uint8)
+
+
+def outlines(mask):
+    """
+    Boundary pixels of a binary mask: foreground pixels with a background 4-neighbour.
+    """
+    mask = np.asarray(mask, dtype=bool)
+    inner = mask.copy()
+    inner[1:, :] &= mask[:-1, :]
+    inner[:-1, :] &= mask[1:, :]
+    inner[:, 1:] &= mask[:, :-1]
+    inner[:, :-1] &= mask[:, 1:]
+    return mask & ~inner
+
+
+def draw_circles(rgb, x, y, radius, colors):
+    """
+    Draw a one-pixel circle just outside the measured disk of every focus, all foci of the
+    same radius in one fancy-indexing assignment (no per-focus drawing calls).
+    colors : (n, 3) uint8 array, one color per focus.
+    """
+    H, W = rgb.shape[:2]
+    x = np.asarray(x, dtype=np.int64)
+    y = np.asarray(y, dtype=np.int64)
+    radius = np.asarray(radius, dtype=np.int64)
+    for r in np.unique(radius):
+        rows = np.flatnonzero(radius == r)
+        dy, dx = ring_offsets(float(r), float(r + 1))
+        yy = (y[rows, None] + dy).ravel()
+        xx = (x[rows, None] + dx).ravel()
+        cc = np.repeat(colors[rows], len(dy), axis=0)
+        inside = (yy >= 0) & (yy < H) & (xx >= 0) & (xx < W)
+        rgb[yy[inside], xx[inside]] = cc[inside]
+    return rgb
+
+
+def render_overlay(image_path, foci, mask_path=None):
+    """
+    RGB overlay of one image: contrast-stretched image, nucleus outlines (from the nuclei
+    mask of nuclei_segmentation) and the foci of an *_extent.csv table (outliers in magenta).
+    Stacks: the first frame with the foci of frame 1.
+    """
+    from PIL import Image
+
+    if stats.n_frames(image_path) > 1:
+        gray = stats.to_gray(stats.open_stack(image_path)[0])
+        if "frame" in foci.columns:
+            foci = foci[foci["frame"] == 1]
+    else:
+        gray = stats.to_gray(Image.open(image_path))
+
+    rgb = np.repeat(stretch(gray)[:, :, None], 3, axis=2)
+
+    if mask_path is not None:
+        with Image.open(mask_path) as im:
+            mask = np.asarray(im.convert("L")) > 127
+        if mask.shape == rgb.shape[:2]:
+            rgb[outlines(mask)] = NUCLEUS_COLOR
+
+    if len(foci):
+        outlier = foci["Outlier"].to_numpy(dtype=bool) if "Outlier" in foci.columns else np.zeros(len(foci), bool)
+        colors = np.where(outlier[:, None], np.array(OUTLIER_COLOR, np.uint8), np.array(FOCUS_COLOR, np.uint8))
+        draw_circles(rgb, foci["x_px"].to_numpy(), foci["y_px"].to_numpy(), foci["sigma_px"].to_numpy(),
+                     colors.astype(np.uint8))
+    return rgb
+
+
+def save_overlay(rgb, key, qc_dir, thumb_size=256):
+    """
+    Save the full-resolution overlay and a downsampled thumbnail (longest side thumb_size).
+    Returns (overlay file name, thumbnail file name).
+    """
+    from PIL import Image
+
+    qc_dir = Path(qc_dir)
+    qc_dir.mkdir(parents=True, exist_ok=True)
+    name = stats.safe_name(key)
+    im = Image.fromarray(rgb)
+    im.save(qc_dir / f"{name}_overlay.png")
+    im.thumbnail((thumb_size, thumb_size), Image.Resampling.BOX)
+    im.save(qc_dir / f"{name}_thumb.png")
+    return f"{name}_overlay.png", f"{name}_thumb.png"
+
+
+def write_index(rows, qc_dir, title="QC"):
+    """
+    Contact sheet: one thumbnail per image, linked to the full overlay, with foci counts.
+    """
+    cells = []
+    for r in rows:
+        caption = (f"{html.escape(r['File_name'])}<br>{r['Foci_number']} foci, "
+                   f"{r['Outliers_number']} outliers")
+        cells.append(f'<figure><a href="{html.escape(r["overlay"])}">'
+                     f'<img src="{html.escape(r["thumbnail"])}" loading="lazy"></a>'
+                     f'<figcaption>{caption}</figcaption></figure>')
+    page = ("<!DOCTYPE html>\n<html><head><meta charset='utf-8'>"
+            f"<title>{html.escape(title)}</title><style>"
+            "body{font-family:sans-serif;margin:1em}"
+            "main{display:grid;grid-template-columns:repeat(auto-fill,minmax(270px,1fr));gap:12px}"
+            "figure{margin:0}img{max-width:100%;image-rendering:pixelated;border:1px solid #ccc}"
+            "figcaption{font-size:12px;word-break:break-all}"
+            f"</style></head><body><h1>{html.escape(title)}</h1>"
+            "<p>green: foci, magenta: outliers, yellow: nuclei</p>"
+            f"<main>{''.join(cells)}</main></body></html>\n")
+    path = Path(qc_dir) / INDEX_FILE
+    path.write_text(page, encoding="utf-8")
+    return path
+
+
+def strip_channel(key):
+    return re.sub(r"^C\d+_", "", key)
+
+
+def run_sources(dir_images):
+    """
+    Images of a run by key and nucleus masks by key without the channel prefix.
+    """
+    images_path = Path(str(dir_images).strip())
+    img_by_key = {stats.key_from_img(p): p for p in images_path.glob("*.tif")}
+    masks = {strip_channel(re.sub(r"_mask$", "", m.stem)): m
+             for ext in ("*_mask.jpg", "*_mask.jpeg", "*_mask.png") for m in images_path.glob(ext)}
+    return img_by_key, masks
+
+
+def render_field(key, foci, img_by_key, masks, qc_dir, thumb_size=256):
+    """
+    Overlay + thumbnail of one image from its foci table (x_px, y_px, sigma_px, Outlier).
+    Returns its contact-sheet row, or None if the image is not found.
+    """
+    image = img_by_key.get(key)
+    if image is None:
+        print(f"WARNING: QC skips {key}, image {key}.tif is not found.")
+        return None
+    rgb = render_overlay(image, foci, masks.get(strip_channel(key)))
+    overlay, thumbnail = save_overlay(rgb, key, qc_dir, thumb_size)
+    return {
+        "File_name": key,
+        "Foci_number": len(foci),
+        "Outliers_number": int(foci["Outlier"].sum()) if "Outlier" in foci.columns else 0,
+        "overlay": overlay,
+        "thumbnail": thumbnail,
+    }
+
+
+def render_run(dir_images, dir_foci, qc_dir=None, thumb_size=256):
+    """
+    QC of a finished run: an overlay + thumbnail per *_extent.csv and a qc/index.html
+    contact sheet. Reads only the outputs on disk.
+    """
+    foci_path = Path(str(dir_foci).strip())
+    qc_dir = Path(qc_dir) if qc_dir else foci_path / QC_DIR
+    img_by_key, masks = run_sources(dir_images)
+
+    rows = []
+    for f in sorted(foci_path.glob("*_extent.csv")):
+        key = stats.key_from_csv(f)[:-len("_extent")]
+        foci = pd.read_csv(f, usecols=lambda c: c in ("x_px", "y_px", "sigma_px", "Outlier", "frame"))
+        row = render_field(key, foci, img_by_key, masks, qc_dir, thumb_size)
+        if row is not None:
+            rows.append(row)
+
+    index = write_index(rows, qc_dir, title=f"QC {foci_path.name}")
+    print(f"QC of {len(rows)} image(s) is saved: {index}.")
+    return rows
+
+
+class QCWorker:
+    """
+    QC rendered while a run computes: submit(key, foci) queues the overlay of one image
+    as soon as its foci table is measured, and a background thread renders it while the
+    next images are processed. close() waits, writes qc/index.html and re-raises a
+    rendering error.
+    """
+    def __init__(self, dir_images, dir_foci, qc_dir=None, thumb_size=256, max_pending=2):
+        foci_path = Path(str(dir_foci).strip())
+        self.qc_dir = Path(qc_dir) if qc_dir else foci_path / QC_DIR
+        self.title = f"QC {foci_path.name}"
+        self.thumb_size = thumb_size
+        self.img_by_key, self.masks = run_sources(dir_images)
+        self.rows = []
+        self._renderer = AsyncWriter(max_pending=max_pending, name="qc")
+
+    def submit(self, key, foci):
+        self._renderer.submit(self._render, key, foci)
+
+    def _render(self, key, foci):
+        row = render_field(key, foci, self.img_by_key, self.masks, self.qc_dir, self.thumb_size)
+        if row is not None:
+            self.rows.append(row)
+
+    def close(self):
+        self._renderer.close()
+        index = write_index(self.rows, self.qc_dir, title=self.title)
+        print(f"QC of {len(self.rows)} image(s) is saved: {index}.")
+        return self.rows
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self._renderer.__exit__(exc_type, exc, tb)
+            return False
+        self.close()
+        return False
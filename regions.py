@@ -0,0 +1,190 @@
+from functools import lru_cache
+import numpy as np
+
+
+@lru_cache(maxsize=256)
+def stencil(ry, rx=None):
+    """
+    Ellipse (disk if rx is None) of radii ry, rx around an integer pixel center, as
+    rectangles of offsets (dy0, dy1, dx0, dx1), inclusive, one per run of rows of the same width.
+
+    Covers the same pixels as skimage.draw.ellipse / disk at an integer center:
+    (dy / ry)**2 + (dx / rx)**2 < 1. Cached per radius (LRU), the geometry is the same
+    for every focus of the same size.
+    """
+    rx = ry if rx is None else rx
+    rects = []
+    for dy in range(-int(np.ceil(ry)), int(np.ceil(ry)) + 1):
+        t = 1.0 - (dy / ry) ** 2
+        if t <= 0:
+            continue
+        # largest |dx| with (dx / rx)**2 < t
+        w = int(np.floor(rx * np.sqrt(t)))
+        while w > 0 and (w / rx) ** 2 >= t:
+            w -= 1
+        while ((w + 1) / rx) ** 2 < t:
+            w += 1
+        if rects and rects[-1][1] == dy - 1 and rects[-1][2] == -w:
+            rects[-1][1] = dy
+        else:
+            rects.append([dy, dy, -w, w])
+    out = np.array(rects, dtype=np.int64).reshape(-1, 4)
+    out.setflags(write=False)
+    return out
+
+
+@lru_cache(maxsize=256)
+def ring_offsets(r_inner, r_outer):
+    """
+    Pixel offsets (dy, dx) of the ring between two disks: inside disk(r_outer), outside disk(r_inner).
+    """
+    dy, dx = np.mgrid[-int(np.ceil(r_outer)):int(np.ceil(r_outer)) + 1,
+                      -int(np.ceil(r_outer)):int(np.ceil(r_outer)) + 1]
+    d2 = dy ** 2 + dx ** 2
+    keep = (d2 < r_outer ** 2) & (d2 >= r_inner ** 2)
+    out = np.stack([dy[keep], dx[keep]]).astype(np.int64)
+    out.setflags(write=False)
+    return out
+
+
+class RegionMeans:
+    """
+    Summed-area table of one image: sums and means over rectangles and cached
+    disk / ellipse / ring stencils in O(number of stencil rectangles) per region,
+    vectorized over all regions. Regions are clipped to the image like skimage.draw.
+
+    image : 2D array (e.g. the grayscale image of MFI_foci); built once per image / frame.
+    """
+    def __init__(self, image):
+        image = np.asarray(image, dtype=np.float64)
+        if image.ndim != 2:
+            raise ValueError(f"Expected a 2D image, got shape {image.shape}.")
+        self.image = image
+        self.shape = image.shape
+        self.sat = _summed_area(image)
+        self._sat_squares = None  # built on first use (ring standard deviations)
+
+    @property
+    def sat_squares(self):
+        if self._sat_squares is None:
+            self._sat_squares = _summed_area(self.image ** 2)
+        return self._sat_squares
+
+    def rect_sums(self, y0, x0, y1, x1, table=None):
+        """
+        Sum and pixel count of rectangles [y0..y1] x [x0..x1] (inclusive, broadcastable arrays),
+        clipped to the image. Empty rectangles give 0, 0.
+        table : summed-area table to read, default self.sat (self.sat_squares for sums of squares).
+        """
+        H, W = self.shape
+        y0 = np.clip(y0, 0, H)
+        x0 = np.clip(x0, 0, W)
+        y1 = np.clip(np.asarray(y1) + 1, 0, H)
+        x1 = np.clip(np.asarray(x1) + 1, 0, W)
+        y1 = np.maximum(y1, y0)
+        x1 = np.maximum(x1, x0)
+        s = self.sat if table is None else table
+        sums = s[y1, x1] - s[y0, x1] - s[y1, x0] + s[y0, x0]
+        return sums, (y1 - y0) * (x1 - x0)
+
+    def rect_means(self, y0, x0, y1, x1):
+        sums, counts = self.rect_sums(y0, x0, y1, x1)
+        return _means(sums, counts)
+
+    def stencil_sums(self, y, x, ry, rx=None, table=None):
+        """
+        Sums and pixel counts of ellipses (disks if rx is None) centered on integer pixels y, x.
+        ry / rx can be scalars or one radius per region.
+        """
+        y = np.asarray(y, dtype=np.int64).ravel()
+        x = np.asarray(x, dtype=np.int64).ravel()
+        ry = np.broadcast_to(np.asarray(ry), y.shape)
+        rx = ry if rx is None else np.broadcast_to(np.asarray(rx), y.shape)
+        sums = np.zeros(len(y), dtype=np.float64)
+        counts = np.zeros(len(y), dtype=np.int64)
+        if not len(y):
+            return sums, counts
+
+        # one vectorized pass per distinct stencil
+        radii = np.stack([ry, rx], axis=1)
+        uniq, inverse = np.unique(radii, axis=0, return_inverse=True)
+        for i, (r_y, r_x) in enumerate(uniq):
+            rows = np.flatnonzero(inverse.ravel() == i)
+            rects = stencil(float(r_y), None if rx is ry else float(r_x))
+            yy, xx = y[rows, None], x[rows, None]
+            s, n = self.rect_sums(yy + rects[:, 0], xx + rects[:, 2], yy + rects[:, 1], xx + rects[:, 3],
+                                  table)
+            sums[rows] = s.sum(axis=1)
+            counts[rows] = n.sum(axis=1)
+        return sums, counts
+
+    def disk_means(self, y, x, radius):
+        """Mean of a disk of `radius` pixels around every (y, x); NaN if it is outside the image."""
+        return _means(*self.stencil_sums(y, x, radius))
+
+    def ellipse_means(self, y, x, ry, rx):
+        return _means(*self.stencil_sums(y, x, ry, rx))
+
+    def ring_means(self, y, x, r_inner, r_outer):
+        """
+        Mean of the ring between two disks (inner disk excluded), e.g. the local
+        background around a focus; NaN if no ring pixel is inside the image.
+        """
+        s_out, n_out = self.stencil_sums(y, x, r_outer)
+        s_in, n_in = self.stencil_sums(y, x, r_inner)
+        return _means(s_out - s_in, n_out - n_in)
+
+    def ring_stats(self, y, x, r_inner, r_outer):
+        """
+        Mean and standard deviation of the ring pixels (from the summed-area tables of
+        the image and of its squares); NaN if no ring pixel is inside the image.
+        """
+        s_out, n_out = self.stencil_sums(y, x, r_outer)
+        s_in, n_in = self.stencil_sums(y, x, r_inner)
+        q_out, _ = self.stencil_sums(y, x, r_outer, table=self.sat_squares)
+        q_in, _ = self.stencil_sums(y, x, r_inner, table=self.sat_squares)
+        n = n_out - n_in
+        mean = _means(s_out - s_in, n)
+        var = _means(q_out - q_in, n) - mean ** 2
+        return mean, np.sqrt(np.maximum(var, 0.0))
+
+    def ring_medians(self, y, x, r_inner, r_outer):
+        """
+        Median and standard deviation of the ring pixels, gathered for all regions of the
+        same radii at once; NaN if no ring pixel is inside the image.
+        """
+        y = np.asarray(y, dtype=np.int64).ravel()
+        x = np.asarray(x, dtype=np.int64).ravel()
+        r_inner = np.broadcast_to(np.asarray(r_inner), y.shape)
+        r_outer = np.broadcast_to(np.asarray(r_outer), y.shape)
+        median = np.full(len(y), np.nan)
+        std = np.full(len(y), np.nan)
+        H, W = self.shape
+
+        radii = np.stack([r_inner, r_outer], axis=1)
+        uniq, inverse = np.unique(radii, axis=0, return_inverse=True) if len(y) else (radii, [])
+        for i, (r_in, r_out) in enumerate(uniq):
+            rows = np.flatnonzero(np.ravel(inverse) == i)
+            dy, dx = ring_offsets(float(r_in), float(r_out))
+            yy = y[rows, None] + dy
+            xx = x[rows, None] + dx
+            inside = (yy >= 0) & (yy < H) & (xx >= 0) & (xx < W)
+            values = np.where(inside, self.image[np.clip(yy, 0, H - 1), np.clip(xx, 0, W - 1)], np.nan)
+            ok = inside.any(axis=1)
+            median[rows[ok]] = np.nanmedian(values[ok], axis=1)
+            std[rows[ok]] = np.nanstd(values[ok], axis=1)
+        return median, std
+
+
+def _summed_area(image):
+    H, W = image.shape
+    sat = np.zeros((H + 1, W + 1), dtype=np.float64)
+    np.cumsum(image, axis=0, out=sat[1:, 1:])
+    np.cumsum(sat[1:, 1:], axis=1, out=sat[1:, 1:])
+    return sat
+
+
+def _means(sums, counts):
+    means = np.full(np.shape(sums), np.nan)
+    np.divide(sums, counts, out=means, where=np.asarray(counts) > 0)
+    return means
@@ -0,0 +1,320 @@
+from abc import ABC, abstractmethod
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime
+import csv
+import os
+import socket
+import time
+import traceback
+import pandas as pd
+
+import stats
+from batch import read_manifest, consolidate
+
+PROGRESS_FILE = "distributed_progress.csv"
+PROGRESS_COLUMNS = ["unit", "stage", "experiment", "attempt", "status", "seconds", "host", "finished", "message"]
+
+
+class Unit:
+    """
+    One piece of work: fn(*args) runs on a worker, after all units in `depends` are done.
+    fn and args must be picklable (module-level functions, paths, small tables).
+    """
+    def __init__(self, unit_id, stage, experiment, fn, args=(), depends=()):
+        self.unit_id = unit_id
+        self.stage = stage
+        self.experiment = experiment
+        self.fn = fn
+        self.args = tuple(args)
+        self.depends = list(depends)
+
+    def __repr__(self):
+        return f"Unit({self.unit_id!r})"
+
+
+class Scheduler(ABC):
+    """
+    Interface of an execution backend.
+      submit(fn, *args)  -> future with .result()
+      wait_first(futures) -> (done, not_done) as soon as at least one future finished
+      close()
+    """
+    name = "scheduler"
+
+    @abstractmethod
+    def submit(self, fn, *args):
+        """Start fn(*args) on a worker, return its future."""
+
+    @abstractmethod
+    def wait_first(self, futures):
+        """Block until at least one of futures is done, return (done, not_done)."""
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+class LocalScheduler(Scheduler):
+    """
+    Stand-in for a cluster: worker processes on this machine, same interface.
+    """
+    name = "local"
+
+    def __init__(self, workers=None):
+        self.workers = workers or os.cpu_count() or 1
+        self._pool = ProcessPoolExecutor(max_workers=self.workers)
+
+    def submit(self, fn, *args):
+        return self._pool.submit(fn, *args)
+
+    def wait_first(self, futures):
+        return wait(futures, return_when=FIRST_COMPLETED)
+
+    def close(self):
+        self._pool.shutdown(wait=True)
+
+
+class DaskScheduler(Scheduler):
+    """
+    Dask distributed cluster (dask-scheduler + dask-worker on the nodes). The nodes need
+    this repository on their PYTHONPATH and the data directories at the same paths.
+    """
+    name = "dask"
+
+    def __init__(self, address):
+        try:
+            from dask.distributed import Client
+        except ImportError:
+            raise ImportError("The dask scheduler requires dask.distributed (pip install \"dask[distributed]\").")
+        self.client = Client(address)
+
+    def submit(self, fn, *args):
+        # pure=False: a retried unit must run again, not return the cached failure
+        return self.client.submit(fn, *args, pure=False)
+
+    def wait_first(self, futures):
+        from dask.distributed import wait as dask_wait
+        done, not_done = dask_wait(list(futures), return_when="FIRST_COMPLETED")
+        return set(done), set(not_done)
+
+    def close(self):
+        self.client.close()
+
+
+def get_scheduler(spec="local", workers=None):
+    """
+    "local" -> LocalScheduler(workers); "tcp://host:8786" or "dask://host:8786" -> DaskScheduler.
+    An object implementing the Scheduler interface is returned as is.
+    """
+    if isinstance(spec, Scheduler):
+        return spec
+    spec = str(spec).strip()
+    if spec == "local":
+        return LocalScheduler(workers)
+    if spec.startswith("dask://"):
+        return DaskScheduler("tcp://" + spec[len("dask://"):])
+    if spec.startswith(("tcp://", "tls://")):
+        return DaskScheduler(spec)
+    raise ValueError(f"Unknown scheduler {spec}. Use 'local' or a dask address (tcp://host:port).")
+
+
+def execute(fn, args):
+    """
+    Worker side of a unit. Failures are returned, not raised, so the driver gets the
+    host and the traceback of the worker. Returns (status, result or message, seconds, host).
+    """
+    start = time.perf_counter()
+    host = socket.gethostname()
+    try:
+        return "done", fn(*args), time.perf_counter() - start, host
+    except Exception as e:
+        traceback.print_exc()
+        return "failed", f"{type(e).__name__}: {e}", time.perf_counter() - start, host
+
+
+def read_progress(output_dir):
+    path = Path(output_dir) / PROGRESS_FILE
+    if not path.exists():
+        return pd.DataFrame(columns=PROGRESS_COLUMNS)
+    return pd.read_csv(path, dtype={"unit": str, "experiment": str})
+
+
+def append_progress(output_dir, row):
+    """
+    Append-only journal of every attempt, used to resume and as the run report.
+    """
+    path = Path(output_dir) / PROGRESS_FILE
+    new_file = not path.exists()
+    with open(path, "a", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=PROGRESS_COLUMNS)
+        if new_file:
+            writer.writeheader()
+        writer.writerow(row)
+
+
+def run_units(units, scheduler, output_dir, retries=2, resume=True):
+    """
+    Dispatch units through the scheduler as soon as their dependencies are done.
+    A failed unit is re-submitted up to `retries` times; units that depend on a unit that
+    failed for good are skipped. Returns {unit_id: status}.
+    """
+    output_dir = Path(output_dir)
+    by_id = {u.unit_id: u for u in units}
+    status = {u.unit_id: "pending" for u in units}
+
+    if resume:
+        progress = read_progress(output_dir)
+        for unit_id in progress.loc[progress["status"] == "done", "unit"]:
+            if unit_id in status:
+                status[unit_id] = "done"
+
+    attempts = {unit_id: 0 for unit_id in by_id}
+    running = {}  # future -> unit_id
+
+    def record(unit, state, seconds, host, message):
+        append_progress(output_dir, {
+            "unit": unit.unit_id,
+            "stage": unit.stage,
+            "experiment": unit.experiment,
+            "attempt": attempts[unit.unit_id],
+            "status": state,
+            "seconds": round(seconds, 3),
+            "host": host,
+            "finished": datetime.now().isoformat(timespec="seconds"),
+            "message": message,
+        })
+
+    def submit_ready():
+        for unit_id, state in status.items():
+            if state != "pending":
+                continue
+            deps = [status[d] for d in by_id[unit_id].depends if d in status]
+            if any(d in ("failed", "skipped") for d in deps):
+                status[unit_id] = "skipped"
+                record(by_id[unit_id], "skipped", 0.0, "", "a dependency failed")
+            elif all(d == "done" for d in deps):
+                attempts[unit_id] += 1
+                status[unit_id] = "running"
+                unit = by_id[unit_id]
+                running[scheduler.submit(execute, unit.fn, unit.args)] = unit_id
+
+    submit_ready()
+    while running:
+        done, _ = scheduler.wait_first(list(running))
+        for fut in done:
+            unit_id = running.pop(fut)
+            unit = by_id[unit_id]
+            try:
+                state, message, seconds, host = fut.result()
+            except Exception as e:
+                # the worker itself was lost (killed process, node down)
+                state, message, seconds, host = "failed", f"{type(e).__name__}: {e}", 0.0, ""
+            if state == "done":
+                message = ""
+
+            if state == "failed" and attempts[unit_id] <= retries:
+                record(unit, "retry", seconds, host, message)
+                print(f"Unit {unit_id} failed on {host or 'a lost worker'}, retry {attempts[unit_id]}/{retries}. {message}")
+                status[unit_id] = "pending"
+            else:
+                record(unit, state, seconds, host, message)
+                status[unit_id] = state
+                if state == "failed":
+                    print(f"Unit {unit_id} failed after {attempts[unit_id]} attempt(s). {message}")
+        submit_ready()
+
+    # units left pending here depend on ids that are not part of this run
+    return status
+
+
+def aggregate_experiment(nuclei_dir, foci_dir, output_dir, model_path=None):
+    """
+    Aggregation unit of one experiment, after all of its MFI units are done.
+    """
+    Path(output_dir).mkdir(parents=True, exist_ok=True)
+    model = stats.load_model(model_path) if model_path else None
+    df_nuclei = stats.aggregate_nuclei_data(dir_nuclei_stat = nuclei_dir)
+    stats.aggregate_results(df_nuclei, foci_dir, output_dir, model)
+    return str(output_dir)
+
+
+def plan(manifest, model_path=None):
+    """
+    Work units of a manifest: one MFI unit per image (field) and one aggregation unit per
+    experiment that depends on them. Files are paired and calibrated on the driver.
+    Returns (units, {experiment: error message} for experiments that could not be planned).
+    """
+    units, errors = [], {}
+    for _, row in manifest.iterrows():
+        experiment = row["experiment"]
+        try:
+            groups, calibration = stats.foci_groups(row["nuclei_dir"], row["foci_dir"])
+        except (FileNotFoundError, KeyError, ValueError) as e:
+            errors[experiment] = f"{type(e).__name__}: {e}"
+            continue
+
+        field_ids = []
+        for key, group in groups.items():
+            unit_id = f"{experiment}/mfi/{key}"
+            rows = calibration.loc[[file.name for file, image in group]]
+            units.append(Unit(unit_id, "mfi", experiment, stats.MFI_field, (key, group, rows)))
+            field_ids.append(unit_id)
+
+        units.append(Unit(f"{experiment}/aggregation", "aggregation", experiment, aggregate_experiment,
+                          (row["nuclei_dir"], row["foci_dir"], row["output_dir"], model_path),
+                          depends=field_ids))
+    return units, errors
+
+
+def run_distributed(manifest_path, output_dir, scheduler="local", workers=None, retries=2,
+                    resume=True, model_path=None):
+    """
+    Run the stats part of a manifest (see batch.read_manifest) as field-level work units.
+
+    Writes into output_dir:
+      - results_all.csv            consolidated results with condition columns
+      - units.csv                  last status, attempts, host and time of every unit
+      - distributed_progress.csv   append-only journal of attempts, used by resume
+    """
+    manifest = read_manifest(manifest_path)
+    output_dir = Path(str(output_dir).strip())
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    units, errors = plan(manifest, model_path)
+    for experiment, message in errors.items():
+        print(f"Experiment {experiment} is not planned: {message}")
+    print(f"Planned {len(units)} unit(s) for {len(manifest) - len(errors)} experiment(s).")
+
+    with get_scheduler(scheduler, workers) as backend:
+        print(f"Scheduler: {backend.name}.")
+        status = run_units(units, backend, output_dir, retries=retries, resume=resume)
+
+    progress = read_progress(output_dir)
+    report = progress.groupby("unit", sort=False).agg(
+        stage=("stage", "last"),
+        experiment=("experiment", "last"),
+        attempts=("attempt", "max"),
+        status=("status", "last"),
+        seconds=("seconds", "sum"),
+        host=("host", "last"),
+        message=("message", "last"),
+    ).reset_index()
+    report = report[report["unit"].isin(status)]
+    report.to_csv(output_dir / "units.csv", index=False)
+
+    done = {u.experiment for u in units if u.stage == "aggregation" and status[u.unit_id] == "done"}
+    results = consolidate(manifest, done)
+    results.to_csv(output_dir / "results_all.csv", index=False)
+
+    failed = sorted(set(manifest["experiment"]) - done)
+    print(f"Consolidated results of {len(done)} experiment(s) are saved in the directory: {output_dir}.")
+    if failed:
+        print(f"Unfinished experiment(s): {failed}. Re-run with resume to retry them.")
+    return results
@@ -0,0 +1,137 @@
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+# Compact dtypes used by every table of the stats pipeline
+FLOAT = "float32"    # measurements: coordinates, intensities, areas
+ID = "uint32"        # ids and counts
+PIXEL = "int32"      # pixel coordinates (can be negative next to the border)
+FLAG = "bool"
+KEY = "category"     # repeated strings: file names, nucleus ids, conditions
+
+# ThunderSTORM foci tables and their *_extent.csv versions
+FOCI_REQUIRED = ["x [nm]", "y [nm]", "sigma [nm]"]
+FOCI_COLUMNS = {
+    "File_name": KEY,
+    "Nucleus_id": KEY,
+    "id": ID,
+    "frame": ID,
+    "x_px": PIXEL,
+    "y_px": PIXEL,
+    "sigma_px": PIXEL,
+    "mean_intensity": FLOAT,
+    "bg_intensity": FLOAT,
+    "corrected_intensity": FLOAT,
+    "snr": FLOAT,
+    "Outlier": FLAG,
+}
+
+# Fiji nuclei measurements (*_roi.csv) and the nuclei table built from them
+NUCLEI_REQUIRED = ["Area", "Mean"]
+NUCLEI_COLUMNS = {
+    "File_name": KEY,
+    "Nucleus_id": KEY,
+    "Area": FLOAT,
+    "Mean": FLOAT,
+    "Nucleus_area": FLOAT,
+    "Nucleus_MFI": FLOAT,
+}
+
+# Per-file / per-nucleus / per-frame summaries (results*.csv)
+RESULTS_COLUMNS = {
+    "experiment": KEY,
+    "File_name": KEY,
+    "Nucleus_id": KEY,
+    "frame": ID,
+    "Foci_number": ID,
+    "Outliers_number": ID,
+}
+
+
+def _cast(s, dtype, name, column):
+    if dtype == KEY:
+        return s.astype(KEY)
+    if dtype == FLAG:
+        if s.dtype == bool:
+            return s
+        values = s.astype(str).str.strip().str.lower()
+        if not values.isin(["true", "false", "1", "0"]).all():
+            raise ValueError(f"In file {name} column '{column}' is not a True/False flag.")
+        return values.isin(["true", "1"])
+    if np.dtype(dtype).kind in "iu":
+        if s.isna().any():
+            raise ValueError(f"In file {name} column '{column}' has missing values, expected {dtype}.")
+        info = np.iinfo(dtype)
+        if len(s) and (s.min() < info.min or s.max() > info.max):
+            raise ValueError(f"In file {name} column '{column}' is out of the {dtype} range.")
+    return s.astype(dtype)
+
+
+def compact(df, columns=None, name="table", downcast=True):
+    """
+    Cast a table to the compact schema in place of the pandas defaults:
+    listed columns get their dtype and, with downcast, other float64 columns become
+    float32 and other non-negative int64 columns uint32. Returns the same DataFrame.
+    """
+    columns = columns or {}
+    for column in df.columns:
+        s = df[column]
+        dtype = columns.get(column)
+        try:
+            if dtype is not None:
+                if str(s.dtype) != dtype:
+                    df[column] = _cast(s, dtype, name, column)
+            elif not downcast:
+                continue
+            elif s.dtype == np.float64:
+                df[column] = s.astype(FLOAT)
+            elif s.dtype == np.int64 and (s.empty or (s.min() >= 0 and s.max() <= np.iinfo(ID).max)):
+                df[column] = s.astype(ID)
+        except (TypeError, ValueError) as e:
+            if isinstance(e, ValueError) and str(e).startswith("In file"):
+                raise
+            raise ValueError(f"In file {name} column '{column}' cannot be read as "
+                             f"{dtype or FLOAT}: {e}") from e
+    return df
+
+
+def align_categories(left, right, columns):
+    """
+    Give the KEY columns of two tables the same categories (union of both), so they can be
+    merged on the categoricals instead of on object strings. Modifies both tables in place.
+    """
+    from pandas.api.types import union_categoricals
+
+    for column in columns:
+        a, b = left[column].astype(KEY), right[column].astype(KEY)
+        dtype = pd.CategoricalDtype(union_categoricals([a, b], ignore_order=True).categories)
+        left[column] = a.astype(dtype)
+        right[column] = b.astype(dtype)
+    return left, right
+
+
+def validate(df, required, name="table"):
+    missing = [c for c in required if c not in df.columns]
+    if missing:
+        raise KeyError(f"In file {name} expected columns {missing}. Found: {list(df.columns)}")
+    return df
+
+
+def read_table(path, columns=None, required=(), **kwargs):
+    """
+    pd.read_csv + stripped headers + required-column check + compact dtypes.
+    Extra keyword arguments go to pd.read_csv (e.g. usecols).
+    """
+    path = Path(path)
+    df = pd.read_csv(path, **kwargs)
+    df.columns = df.columns.str.strip()  # remove hidden spaces in headers
+    validate(df, required, path.name)
+    return compact(df, columns, path.name)
+
+
+def read_foci(path, required=FOCI_REQUIRED, **kwargs):
+    return read_table(path, FOCI_COLUMNS, required, dtype={"Nucleus_id": str}, **kwargs)
+
+
+def read_nuclei(path, **kwargs):
+    return read_table(path, NUCLEI_COLUMNS, NUCLEI_REQUIRED, **kwargs)
@@ -0,0 +1,327 @@
+from ij import IJ, WindowManager, ImagePlus
+from ij.gui import GenericDialog
+from ij.measure import Measurements, ResultsTable
+from ij.plugin.filter import ParticleAnalyzer
+from ij.plugin.filter import GaussianBlur
+from ij.process import ByteProcessor, ColorProcessor
+from java.lang import System
+import os
+import csv
+import traceback
+
+# Parameter sweep for nuclei_segmentation: the same DAPI pipeline (blur -> auto threshold
+# -> mask -> fill holes -> erode/dilate -> analyze particles) evaluated for a grid of
+# parameters, with every intermediate computed once and shared by all grid points:
+#   DAPI plane          per image (read from the stack, no Split Channels windows)
+#   blurred plane       per image and sigma
+#   mask                per image, sigma and threshold method
+#   eroded/dilated mask per image, sigma, method, erosion and dilation steps
+#   particles           analyzed once per mask; area / circularity limits are filters on them
+#
+# Fiji scripts cannot import each other, so img_name_processing, channel_plane and
+# blur_accuracy are copies of the functions of the same name in nuclei_segmentation.py,
+# and SweepCache.blur / mask / morphed / analyzed mirror the steps of its process_image.
+# Keep both files in sync when one of them changes.
+
+METHODS = ["Triangle", "Otsu", "Huang", "Yen", "Li", "Moments", "Default"]
+SWEEP_FILE = "segmentation_sweep.csv"
+SWEEP_SUMMARY_FILE = "segmentation_sweep_summary.csv"
+SWEEP_COLUMNS = ["image", "thr_method", "gaussian_blur_sigma", "erosion_steps", "dilation_steps",
+                 "min_area", "max_area", "min_circularity", "max_circularity", "threshold",
+                 "n_nuclei", "mean_area", "median_area", "total_area", "largest_area"]
+
+def parse_list(text, cast):
+    """
+    "1, 1.5,2" -> [1.0, 1.5, 2.0]; duplicates are dropped, order is kept.
+    """
+    values = []
+    for part in text.replace(";", ",").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        value = cast(part)
+        if value not in values:
+            values.append(value)
+    if not values:
+        raise ValueError("Empty parameter list: '{}'".format(text))
+    return values
+
+def parse_methods(text):
+    methods = parse_list(text, lambda s: s.strip())
+    for m in methods:
+        if m not in METHODS:
+            raise ValueError("Unknown threshold method '{}'. Choose from {}".format(m, METHODS))
+    return methods
+
+def ask_grid():
+    gd = GenericDialog("Nuclei segmentation sweep")
+    gd.addMessage("Comma-separated values; every combination is evaluated.")
+    gd.addNumericField("DAPI channel (1-based):", 1, 0)
+    gd.addStringField("Threshold methods:", "Otsu, Triangle, Li", 30)
+    gd.addStringField("Gaussian Blur Sigma:", "1.0, 1.5, 2.0", 30)
+    gd.addStringField("Erosion steps:", "0, 3", 30)
+    gd.addStringField("Dilation steps:", "0, 3, 5", 30)
+    gd.addStringField("Min nucleus area (pixels^2):", "1000, 3000", 30)
+    gd.addStringField("Max nucleus area (pixels^2) (0 = no max):", "0", 30)
+    gd.addStringField("Min circularity (0..1):", "0.3, 0.5", 30)
+    gd.addStringField("Max circularity (0..1):", "1.0", 30)
+    gd.addCheckbox("Exclude edge particles", True)
+    gd.addCheckbox("Fill holes", True)
+    gd.showDialog()
+    if gd.wasCanceled():
+        return None
+
+    grid = {}
+    grid["DAPI_CHANNEL"] = int(gd.getNextNumber())
+    grid["thr_method"] = parse_methods(gd.getNextString())
+    grid["gaussian_blur_sigma"] = parse_list(gd.getNextString(), float)
+    grid["erosion_steps"] = parse_list(gd.getNextString(), int)
+    grid["dilation_steps"] = parse_list(gd.getNextString(), int)
+    grid["min_area"] = parse_list(gd.getNextString(), float)
+    grid["max_area"] = parse_list(gd.getNextString(), float)
+    grid["min_circularity"] = parse_list(gd.getNextString(), float)
+    grid["max_circularity"] = parse_list(gd.getNextString(), float)
+    grid["exclude_edges"] = bool(gd.getNextBoolean())
+    grid["fill_holes"] = bool(gd.getNextBoolean())
+    return grid
+
+def img_name_processing(name):
+    try:
+        if "MP" in name and " - " in name:
+            if "Deconvolved" in name:
+                name = name.split("-")[0] + "_" + name.split("-")[2]
+                name = name.replace(" ", "", 1).replace(",", "").replace(" ", "_")
+            else:
+                name = name.split("-")[1] # split string
+                name = name.replace(" ", "", 1) # delete fist blank in the string
+                name = name.replace(" ", "_") # repalce other blanks to underscore
+        else:
+            name = os.path.splitext(name)[0] # delete extention
+        return name
+    except Exception as e:
+         raise Exception("ERROR in parsing image name")
+
+def channel_plane(imp, channel):
+    """
+    Processor of one channel (first slice/frame) read straight from the stack,
+    without splitting the image into windows.
+    """
+    return imp.getStack().getProcessor(imp.getStackIndex(int(channel), 1, 1))
+
+def blur_accuracy(ip):
+    # same kernel accuracy as Process > Filters > Gaussian Blur... (copy of nuclei_segmentation.blur_accuracy)
+    if isinstance(ip, (ByteProcessor, ColorProcessor)):
+        return 0.002
+    return 0.0002
+
+class SweepCache(object):
+    """
+    Intermediates of one image, each computed on first use and reused by later grid points.
+    """
+    def __init__(self, dapi_ip, fill_holes, exclude_edges):
+        self.dapi_ip = dapi_ip
+        self.fill_holes = fill_holes
+        self.exclude_edges = exclude_edges
+        self.blurred = {}    # sigma -> ImageProcessor
+        self.masks = {}      # (sigma, method) -> (ImagePlus mask, lower threshold)
+        self.morph = {}      # (sigma, method, erosion, dilation) -> ImagePlus mask
+        self.particles = {}  # (sigma, method, erosion, dilation) -> [(area, circularity)]
+        self.hits = 0
+        self.misses = 0
+
+    def _get(self, store, key, build):
+        if key in store:
+            self.hits += 1
+        else:
+            self.misses += 1
+            store[key] = build()
+        return store[key]
+
+    def blur(self, sigma):
+        def build():
+            # same filter as "Gaussian Blur..." in nuclei_segmentation.process_image
+            ip = self.dapi_ip.duplicate()
+            GaussianBlur().blurGaussian(ip, sigma, sigma, blur_accuracy(ip))
+            return ip
+        return self._get(self.blurred, sigma, build)
+
+    def mask(self, sigma, method):
+        def build():
+            work = ImagePlus("DAPI_sweep", self.blur(sigma).duplicate())
+            IJ.setAutoThreshold(work, "{} dark".format(method))
+            lower = work.getProcessor().getMinThreshold()
+            IJ.run(work, "Convert to Mask", "")
+            if self.fill_holes:
+                IJ.run(work, "Fill Holes", "")
+            return work, lower
+        return self._get(self.masks, (sigma, method), build)
+
+    def morphed(self, sigma, method, erosion, dilation):
+        # nuclei_segmentation.process_image: all erosions first, then the dilations
+        def build():
+            if erosion == 0 and dilation == 0:
+                return self.mask(sigma, method)[0]
+            if dilation > 0:
+                # one more dilation step on the cached mask with one step less
+                work = self.morphed(sigma, method, erosion, dilation - 1).duplicate()
+                IJ.run(work, "Dilate", "")
+            else:
+                work = self.morphed(sigma, method, erosion - 1, 0).duplicate()
+                IJ.run(work, "Erode", "")
+            return work
+        return self._get(self.morph, (sigma, method, erosion, dilation), build)
+
+    def analyzed(self, sigma, method, erosion, dilation):
+        """
+        All particles of a mask with their area and circularity: analyzed once without
+        limits, the size / circularity limits of the grid are applied as filters.
+        """
+        def build():
+            mask = self.morphed(sigma, method, erosion, dilation)
+            rt = ResultsTable()
+            options = ParticleAnalyzer.SHOW_NONE
+            if self.exclude_edges:
+                options |= ParticleAnalyzer.EXCLUDE_EDGE_PARTICLES
+            pa = ParticleAnalyzer(options, Measurements.AREA | Measurements.SHAPE_DESCRIPTORS, rt,
+                                  0.0, float("inf"), 0.0, 1.0)
+            pa.setHideOutputImage(True)
+            if not pa.analyze(mask):
+                raise Exception("Analyze particles failed")
+            return [(rt.getValue("Area", i), rt.getValue("Circ.", i)) for i in range(rt.size())]
+        return self._get(self.particles, (sigma, method, erosion, dilation), build)
+
+    def close(self):
+        for imp, lower in self.masks.values():
+            imp.close()
+        for imp in self.morph.values():
+            imp.close()
+
+def area_stats(areas):
+    if not areas:
+        return 0, "", "", 0.0, ""
+    areas = sorted(areas)
+    n = len(areas)
+    mid = n // 2
+    median = areas[mid] if n % 2 else 0.5 * (areas[mid - 1] + areas[mid])
+    return n, sum(areas) / n, median, sum(areas), areas[-1]
+
+def sweep_image(imp, grid, writer):
+    """
+    Evaluate every grid point on one image. Returns (number of grid points, cache hits, cache misses).
+    """
+    title = img_name_processing(imp.getTitle())
+    cache = SweepCache(channel_plane(imp, grid["DAPI_CHANNEL"]).duplicate(),
+                       grid["fill_holes"], grid["exclude_edges"])
+    n_points = 0
+    try:
+        for sigma in grid["gaussian_blur_sigma"]:
+            for method in grid["thr_method"]:
+                lower = cache.mask(sigma, method)[1]
+                for erosion in grid["erosion_steps"]:
+                    for dilation in grid["dilation_steps"]:
+                        particles = cache.analyzed(sigma, method, erosion, dilation)
+                        for min_area in grid["min_area"]:
+                            for max_area in grid["max_area"]:
+                                for min_circ in grid["min_circularity"]:
+                                    for max_circ in grid["max_circularity"]:
+                                        upper = max_area if max_area > 0 else float("inf")
+                                        areas = [a for a, c in particles
+                                                 if min_area <= a <= upper and min_circ <= c <= max_circ]
+                                        n, mean, median, total, largest = area_stats(areas)
+                                        writer.writerow([title, method, sigma, erosion, dilation,
+                                                         min_area, max_area, min_circ, max_circ, lower,
+                                                         n, mean, median, total, largest])
+                                        n_points += 1
+    finally:
+        cache.close()
+    return n_points, cache.hits, cache.misses
+
+def write_summary(sweep_path, summary_path):
+    """
+    One row per grid point over all images: mean / min / max nucleus count and mean area,
+    to compare parameter sets at a glance.
+    """
+    groups = {}
+    order = []
+    with open(sweep_path, "rb") as f:
+        for row in csv.DictReader(f):
+            key = tuple(row[c] for c in SWEEP_COLUMNS[1:9])
+            if key not in groups:
+                groups[key] = []
+                order.append(key)
+            groups[key].append(row)
+
+    with open(summary_path, "wb") as f:
+        writer = csv.writer(f)
+        writer.writerow(SWEEP_COLUMNS[1:9] + ["n_images", "mean_n_nuclei", "min_n_nuclei",
+                                              "max_n_nuclei", "mean_area"])
+        for key in order:
+            rows = groups[key]
+            counts = [int(r["n_nuclei"]) for r in rows]
+            total_area = sum(float(r["total_area"]) for r in rows)
+            mean_area = total_area / sum(counts) if sum(counts) else ""
+            writer.writerow(list(key) + [len(rows), sum(counts) / float(len(counts)),
+                                         min(counts), max(counts), mean_area])
+
+# --- Main ---
+
+ids = WindowManager.getIDList()
+if not ids:
+    IJ.error("No images open.")
+    raise SystemExit
+
+images = []
+for wid in ids:
+    imp = WindowManager.getImage(wid)
+    if imp is None:
+        continue
+    title = imp.getTitle()
+    # Skip typical derived images (adjust if needed)
+    if (title.startswith("C") and "-" in title) or title in ["DAPI_work", "Nuclei_mask_particles_only"]:
+        continue
+    images.append(imp)
+if not images:
+    IJ.error("No suitable images found (only derived windows are open)!")
+    raise SystemExit
+
+output_dir = IJ.getDirectory("Choose a directory to save the sweep tables")
+if output_dir is None:
+    IJ.error("No output directory selected!")
+    raise SystemExit
+
+try:
+    grid = ask_grid()
+except ValueError as e:
+    IJ.error(str(e))
+    raise SystemExit
+if grid is None:
+    IJ.error("No parameters provided!")
+    raise SystemExit
+
+n_grid = 1
+for k in ("thr_method", "gaussian_blur_sigma", "erosion_steps", "dilation_steps",
+          "min_area", "max_area", "min_circularity", "max_circularity"):
+    n_grid *= len(grid[k])
+IJ.log("Sweep: {} grid point(s) x {} image(s)".format(n_grid, len(images)))
+
+sweep_path = os.path.join(output_dir, SWEEP_FILE)
+errors = []
+start = System.currentTimeMillis()
+with open(sweep_path, "wb") as f:
+    writer = csv.writer(f)
+    writer.writerow(SWEEP_COLUMNS)
+    for call_id, imp in enumerate(images, start=1):
+        IJ.log("Sweep {}/{}: {}".format(call_id, len(images), imp.getTitle()))
+        IJ.showProgress(call_id - 1, len(images))
+        try:
+            n_points, hits, misses = sweep_image(imp, grid, writer)
+            IJ.log("  {} grid point(s), {} intermediate(s) computed, {} reused".format(n_points, misses, hits))
+        except Exception as e:
+            IJ.log("ERROR in {}: {}".format(imp.getTitle(), e))
+            IJ.log(traceback.format_exc())
+            errors.append(imp.getTitle())
+
+write_summary(sweep_path, os.path.join(output_dir, SWEEP_SUMMARY_FILE))
+IJ.showProgress(1.0)
+IJ.log("===== SWEEP DONE in {:.1f} s: {} error(s). Tables: {}, {} =====".format(
+    (System.currentTimeMillis() - start) / 1000.0, len(errors), SWEEP_FILE, SWEEP_SUMMARY_FILE))
@@ -1,14 +1,27 @@
 from pathlib import Path
+import argparse
 import re
+import zipfile
 import pandas as pd
 import numpy as np
-from PIL import Image, ImageDraw
-from skimage.color import rgb2gray
-from skimage.draw import disk
-from matplotlib.patches import Circle
-import matplotlib.pyplot as plt
+# PIL, skimage.color, tifffile and matplotlib are imported in the functions that use them,
+# so aggregation-only runs (and `import stats`) do not pay for loading them
+from calibration import calibrate_pairs, INDEX_FILE as CALIBRATION_INDEX
+from pipeline import prefetch, AsyncWriter
+import profiling
+from profiling import stage
+from regions import RegionMeans
+from schema import FLOAT, PIXEL, KEY, NUCLEI_COLUMNS, align_categories, compact, read_foci, read_nuclei
+from clustering import FEATURES, fit_clusters, save_model, load_model, predict_clusters, cluster_composition, cluster_centers
 #from scipy.stats import spearmanr
 
+# Tables written by stats itself, never foci tables (output_dir is often the ThunderSTORM directory)
+OUTPUT_FILES = {"results.csv", "results_nuclei.csv", "results_frames.csv", CALIBRATION_INDEX,
+                profiling.STAGES_FILE, profiling.ALLOCATIONS_FILE}
+# Side tables of the Fiji scripts (checkpoints, thresholds), never nuclei / foci tables
+SEGMENTATION_FILES = {"nuclei_checkpoint.csv", "foci_checkpoint.csv", "thresholds.csv",
+                      "global_thresholds.csv", "background_benchmark.csv"}
+
 
 def key_from_csv(p: Path) -> str:
     """
@@ -20,12 +33,191 @@ def key_from_csv(p: Path) -> str:
     name = re.sub(r"_roi$", "", name, flags=re.IGNORECASE)
     return name
 
+def nucleus_from_csv(p: Path, key: str) -> str:
+    """
+    C2...nd2_(series_01)_0233-0247.csv  ->  0233-0247 (ROI name = nucleus id)
+    """
+    stem = p.stem
+    return stem[len(key) + 1:] if stem.startswith(key + "_") else stem
+
+def safe_name(s) -> str:
+    """
+    Same sanitization as foci_segmentation.safe_name, used to match ROI names with foci file names.
+    """
+    s = re.sub(r'[\\/:*?"<>|]+', "_", str(s))
+    return s.replace(" ", "_")
+
+def roi_names(zip_path: Path) -> list:
+    """
+    ROI names in ROI Manager order from an ImageJ RoiSet .zip (one entry <name>.roi per ROI).
+    """
+    with zipfile.ZipFile(zip_path) as z:
+        return [safe_name(Path(n).stem) for n in z.namelist() if n.lower().endswith(".roi")]
+
 def key_from_img(p: Path) -> str:
     """
     C2...nd2_(series_01).jpg -> C2...nd2_(series_01)
     """
     return p.stem  # no .extention
 
+def to_gray(image):
+    """
+    PIL image or 2D array -> grayscale float image, the same conversion for 2D images and stack frames.
+    """
+    from PIL import Image
+    from skimage.color import rgb2gray
+
+    with stage("to_gray"):
+        if not isinstance(image, Image.Image):
+            image = Image.fromarray(np.ascontiguousarray(image))
+        return rgb2gray(image.convert("RGB"))
+
+def open_stack(image_path):
+    """
+    Frames of a TIFF stack as an array-like (n_frames, H, W).
+    Uncompressed stacks (as saved by ImageJ) are memory-mapped, so only the frames that
+    are indexed are read from disk; otherwise frames are decoded on access.
+    """
+    import tifffile
+
+    try:
+        stack = tifffile.memmap(image_path, mode="r")
+    except (ValueError, OSError):
+        tif = tifffile.TiffFile(image_path)
+        return _PagedStack(tif)
+    if stack.ndim == 2:
+        stack = stack[np.newaxis]
+    return stack.reshape(-1, stack.shape[-2], stack.shape[-1])
+
+class _PagedStack:
+    """Lazy frame access for compressed / non-contiguous TIFF stacks."""
+    def __init__(self, tif):
+        self.tif = tif
+
+    def __len__(self):
+        return len(self.tif.pages)
+
+    def __getitem__(self, i):
+        return self.tif.pages[i].asarray()
+
+def load_gray(image_path):
+    """
+    Grayscale image for MFI_foci, or None for stacks (those are read frame by frame).
+    """
+    if image_path is None or n_frames(image_path) > 1:
+        return None
+    from PIL import Image
+    return to_gray(Image.open(image_path))
+
+def n_frames(image_path):
+    from PIL import Image
+    with Image.open(image_path) as im:
+        return getattr(im, "n_frames", 1)
+
+def foci_means(gray, x_arr, y_arr, sigma_arr, regions=None):
+    """
+    Mean intensity of a disk of radius sigma_px around every focus (NaN if the disk is outside the image).
+    Same pixels as skimage.draw.disk, summed from a summed-area table (regions.py) in one
+    vectorized pass per radius instead of one full-frame mask per focus.
+    regions : RegionMeans of gray, if it is already built (e.g. shared with other measurements).
+    """
+    if regions is None:
+        regions = RegionMeans(gray)
+    return regions.disk_means(y_arr, x_arr, sigma_arr)
+
+def foci_background(gray, x_arr, y_arr, sigma_arr, gap=1, width=3, method="mean", regions=None):
+    """
+    Local background of every focus: mean (or median) and standard deviation of the ring
+    sigma_px + gap <= r < sigma_px + gap + width pixels around it, computed for all foci
+    at once from the same RegionMeans as foci_means. NaN if the ring is outside the image.
+    """
+    if regions is None:
+        regions = RegionMeans(gray)
+    r_inner = np.asarray(sigma_arr) + gap
+    r_outer = r_inner + width
+    if method == "mean":
+        return regions.ring_stats(y_arr, x_arr, r_inner, r_outer)
+    if method == "median":
+        return regions.ring_medians(y_arr, x_arr, r_inner, r_outer)
+    raise ValueError(f"Unknown background method {method}. Choose 'mean' or 'median'.")
+
+def foci_intensities(gray, x_arr, y_arr, sigma_arr, bg_gap=1, bg_width=3, bg_method="mean", regions=None):
+    """
+    Focus mean, ring background and its standard deviation in one pass over a shared summed-area table.
+    """
+    if regions is None:
+        regions = RegionMeans(gray)
+    mean_arr = foci_means(gray, x_arr, y_arr, sigma_arr, regions=regions)
+    bg_arr, bg_std = foci_background(gray, x_arr, y_arr, sigma_arr, bg_gap, bg_width, bg_method, regions)
+    return mean_arr, bg_arr, bg_std
+
+def foci_pixels(
+    df,
+    px_size_ts_x = 11.6,
+    px_size_ts_y = 11.6,
+    px_size_x = 57.5,
+    px_size_y = 58.7,
+    x_col="x [nm]",
+    y_col="y [nm]",
+    sigma_col="sigma [nm]"
+    ):
+    """
+    Focus centres and radii of a ThunderSTORM table in pixels of the image: (x_px, y_px, sigma_px) arrays.
+    """
+    # Scaling factors
+    sx = px_size_ts_x/px_size_x
+    sy = px_size_ts_y/px_size_y
+    ssigma = np.mean([px_size_ts_x, px_size_ts_y]) / np.mean([px_size_x, px_size_y])
+
+    # original pixels → current image pixels (vectorized over all foci)
+    x_arr = np.rint(sx * df[x_col].to_numpy(dtype=np.float64) / px_size_ts_x).astype(np.int64)
+    y_arr = np.rint(sy * df[y_col].to_numpy(dtype=np.float64) / px_size_ts_y).astype(np.int64)
+    sigma_arr = np.maximum(1, np.rint(ssigma * df[sigma_col].to_numpy(dtype=np.float64)
+                                      / np.mean([px_size_ts_x, px_size_ts_y])).astype(np.int64)) # minimal possible value is 1 pixel!
+    return x_arr, y_arr, sigma_arr
+
+def stack_intensities(image_path, frames, x_arr, y_arr, sigma_arr, bg_gap=1, bg_width=3, bg_method="mean"):
+    """
+    foci_intensities for the foci of a stack / time-lapse, every focus on its own frame
+    (1-based, as exported by ThunderSTORM; NaN for frames outside the stack).
+    Each frame is converted and summed once for all the foci passed in, with one frame
+    in memory at a time, looked up in the memory-mapped stack.
+    """
+    stack = open_stack(image_path)
+    mean_arr = np.full(len(frames), np.nan)
+    bg_arr = np.full(len(frames), np.nan)
+    bg_std = np.full(len(frames), np.nan)
+    for frame in np.unique(frames):
+        if not 1 <= frame <= len(stack):
+            continue
+        rows = np.flatnonzero(frames == frame)
+        gray = to_gray(stack[frame - 1])
+        with stage("foci_means"):
+            mean_arr[rows], bg_arr[rows], bg_std[rows] = foci_intensities(
+                gray, x_arr[rows], y_arr[rows], sigma_arr[rows], bg_gap, bg_width, bg_method)
+    return mean_arr, bg_arr, bg_std
+
+def with_intensities(df, x_arr, y_arr, sigma_arr, mean_arr, bg_arr, bg_std):
+    """
+    Copy of a foci table with the pixel coordinates and the intensity columns of MFI_foci.
+    """
+    corrected = mean_arr - bg_arr
+    snr = np.full(len(df), np.nan)
+    np.divide(corrected, bg_std, out=snr, where=bg_std > 0)
+
+    # Return modified copy
+    with stage("copy"):
+        df_out = df.copy()
+    df_out["x_px"] = x_arr.astype(PIXEL)
+    df_out["y_px"] = y_arr.astype(PIXEL)
+    df_out["sigma_px"] = sigma_arr.astype(PIXEL)
+    df_out["mean_intensity"] = mean_arr.astype(FLOAT)
+    df_out["bg_intensity"] = bg_arr.astype(FLOAT)
+    df_out["corrected_intensity"] = corrected.astype(FLOAT)
+    df_out["snr"] = snr.astype(FLOAT)
+
+    return df_out
+
 def MFI_foci(
         image_path,
         df,
@@ -35,62 +227,40 @@ def MFI_foci(
         px_size_y = 58.7,
         x_col="x [nm]",
         y_col="y [nm]",
-        sigma_col="sigma [nm]"
+        sigma_col="sigma [nm]",
+        frame_col="frame",
+        gray=None,
+        regions=None,
+        bg_gap=1,
+        bg_width=3,
+        bg_method="mean"
     ):
-
-        # Open image
-        image = Image.open(image_path).convert("RGB")
-
-        # Convert image to grayscale
-        gray = rgb2gray(image)
-        H, W = gray.shape # number of pixels
-
-        # Scaling factors
-        sx = px_size_ts_x/px_size_x
-        sy = px_size_ts_y/px_size_y
-        ssigma = np.mean([px_size_ts_x, px_size_ts_y]) / np.mean([px_size_x, px_size_y])
-
-        # Storage lists
-        x_list = []
-        y_list = []
-        sigma_list = []
-        mean_list = []
-
-        for _, row in df.iterrows():
-            x_nm = row[x_col]
-            y_nm = row[y_col]
-            sigma_nm = row[sigma_col]
-
-            # original pixels → current image pixels
-            x_px = int(round(sx * x_nm / px_size_ts_x))
-            y_px = int(round(sy * y_nm / px_size_ts_y))
-            sigma_px = max(1, int(round(ssigma * sigma_nm / np.mean([px_size_ts_x, px_size_ts_y])))) # minimal possible value is 1 pixel!
-
-            # Build circular mask (clipped automatically)
-            rr, cc = disk((y_px, x_px), sigma_px, shape=(H, W))
-            mask = np.zeros((H, W), dtype=bool)
-            mask[rr, cc] = True
-            disk((y_px, x_px), sigma_px, shape=(H, W))
-
-            # Compute mean intensity
-            if mask.sum() > 0:
-                mean_intensity = gray[mask].mean()
-            else:
-                mean_intensity = np.nan
-
-            x_list.append(x_px)
-            y_list.append(y_px)
-            sigma_list.append(sigma_px)
-            mean_list.append(mean_intensity)
-
-        # Return modified copy
-        df_out = df.copy()
-        df_out["x_px"] = x_list
-        df_out["y_px"] = y_list
-        df_out["sigma_px"] = sigma_list
-        df_out["mean_intensity"] = mean_list
-
-        return df_out
+        """
+        Adds x_px, y_px, sigma_px and mean_intensity to a foci table, and the local background:
+        bg_intensity (ring mean or median, see foci_background), corrected_intensity
+        (mean_intensity - bg_intensity) and snr (corrected_intensity / ring standard deviation).
+        For stacks / time-lapses (table with a frame column, image with several frames)
+        every focus is measured on its own frame (1-based, as exported by ThunderSTORM).
+        gray : already decoded 2D grayscale image (see load_gray), skips opening image_path.
+        regions : RegionMeans of gray, shared by all foci tables of the same image.
+        """
+        x_arr, y_arr, sigma_arr = foci_pixels(df, px_size_ts_x, px_size_ts_y, px_size_x, px_size_y,
+                                              x_col, y_col, sigma_col)
+
+        if gray is None and frame_col in df.columns and n_frames(image_path) > 1:
+            frames = df[frame_col].to_numpy(dtype=np.int64)
+            mean_arr, bg_arr, bg_std = stack_intensities(
+                image_path, frames, x_arr, y_arr, sigma_arr, bg_gap, bg_width, bg_method)
+        else:
+            # Open image and convert image to grayscale
+            if gray is None and regions is None:
+                from PIL import Image
+                gray = to_gray(Image.open(image_path))
+            with stage("foci_means"):
+                mean_arr, bg_arr, bg_std = foci_intensities(
+                    gray, x_arr, y_arr, sigma_arr, bg_gap, bg_width, bg_method, regions)
+
+        return with_intensities(df, x_arr, y_arr, sigma_arr, mean_arr, bg_arr, bg_std)
 
 def aggregate_nuclei_data(dir_nuclei_stat):
     # Paths to files
@@ -101,30 +271,40 @@ def aggregate_nuclei_data(dir_nuclei_stat):
         raise FileNotFoundError(f"dir1 not found: {nuclei_path}")
     
     # Check that there are .csv files
-    nuclei_files = sorted(nuclei_path.glob("*.csv"))
+    nuclei_files = sorted(f for f in nuclei_path.glob("*.csv") if f.name not in SEGMENTATION_FILES)
     if not nuclei_files:
         raise FileNotFoundError(f"No CSV files found in: {nuclei_path}")
     
+    # ROI zips (C1_<image>_rois.zip) by image key without the channel prefix
+    strip_channel = lambda k: re.sub(r"^C\d+_", "", k)
+    zips = {strip_channel(re.sub(r"_rois$", "", z.stem)): z for z in nuclei_path.glob("*_rois.zip")}
+
     dfs = []
 
     for f in nuclei_files:
         key = key_from_csv(f)
-        df = pd.read_csv(f)
-        df.columns = df.columns.str.strip()  # remove hidden spaces in headers
-
-        # ensure expected columns exist
-        if "Area" not in df.columns or "Mean" not in df.columns:
-            raise KeyError(
-                f"In nuclei file {f.name} expected columns 'Area' and 'Mean'. "
-                f"Found: {list(df.columns)}"
-            )
-        
+        df = read_nuclei(f)  # compact dtypes, expected columns 'Area' and 'Mean'
+
+        # Nucleus id = ROI name: from the Label column ("image:roi"), else from the ROI zip
+        # (same order as the measured rows), else the row number
+        names = None
+        if "Label" in df.columns and df["Label"].astype(str).str.contains(":").all():
+            names = df["Label"].astype(str).str.split(":").str[1].map(safe_name).tolist()
+        elif strip_channel(key) in zips:
+            names = roi_names(zips[strip_channel(key)])
+            if len(names) != len(df):
+                names = None
+        if names is None:
+            names = [str(i) for i in range(1, len(df) + 1)]
+
         df["File_name"] = key
+        df["Nucleus_id"] = names
         df = df.rename(columns={"Area": "Nucleus_area", "Mean": "Nucleus_MFI"})
-        df = df[["File_name", "Nucleus_area", "Nucleus_MFI"]]
+        df = df[["File_name", "Nucleus_id", "Nucleus_area", "Nucleus_MFI"]]
         dfs.append(df)
 
-    final = pd.concat(dfs, ignore_index=True)
+    with stage("concat"):
+        final = compact(pd.concat(dfs, ignore_index=True), NUCLEI_COLUMNS)
 
     return final
 
@@ -135,8 +315,14 @@ def plot_histogram(df, column, bins=50,
                    dpi=300,
                    save_path=None,
                    threshold = 0):
+    # a standalone Figure with its own Agg canvas, no pyplot global state:
+    # the histograms are drawn from the writer thread of MFI_foci_all
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
 
-    fig, ax = plt.subplots(figsize=figsize, dpi=dpi)
+    fig = Figure(figsize=figsize, dpi=dpi)
+    FigureCanvasAgg(fig)
+    ax = fig.subplots()
 
     ax.hist(
         df[column].dropna(),
@@ -156,17 +342,20 @@ def plot_histogram(df, column, bins=50,
     ax.spines["top"].set_visible(False)
     ax.spines["right"].set_visible(False)
 
-    plt.tight_layout()
+    fig.tight_layout()
 
     # --- Save if path provided ---
     save_path = Path(save_path)
     save_path.parent.mkdir(parents=True, exist_ok=True)
-    plt.savefig(save_path, dpi=dpi, bbox_inches="tight")
-
-    plt.close(fig)
+    fig.savefig(save_path, dpi=dpi, bbox_inches="tight")
 
 
-def MFI_foci_all(dir_images, dir_foci):
+def foci_groups(dir_images, dir_foci):
+    """
+    Pair every ThunderSTORM table of dir_foci with its image in dir_images and group the
+    tables (one per nucleus ROI) by image key.
+    Returns ({key: [(foci_csv, image_path), ...]}, calibration DataFrame indexed by foci file name).
+    """
     # Paths to files
     images_path = Path(str(dir_images).strip())
     foci_data_path = Path(str(dir_foci).strip())
@@ -184,6 +373,7 @@ def MFI_foci_all(dir_images, dir_foci):
     foci = sorted(
         f for f in foci_data_path.glob("*.csv")
         if not f.stem.endswith(("_roi", "_extent"))
+        and f.name not in OUTPUT_FILES | SEGMENTATION_FILES
     )
     if not foci:
          raise FileNotFoundError(f"No .CSV files found in: {foci_data_path}")
@@ -196,56 +386,167 @@ def MFI_foci_all(dir_images, dir_foci):
         img_path = img_by_key.get(k)
         pairs.append((f, img_path))
     print(f"Found {len(pairs)} (image.tif foci.csv) pairs.")
-        
-    # Calculate MFI of each foci
+
+    # Pixel size of every image in the nm space of its foci table (cached in calibration.csv)
+    with stage("calibration"):
+        calibration = calibrate_pairs(pairs, foci_data_path)
+
+    # One foci table per nucleus (ROI) -> group them by image
+    groups = {}
     for file, image in pairs:
-        df = pd.read_csv(file)
-        df.columns = df.columns.str.strip()
-        df_added = MFI_foci(image_path = image,
-                            df = df,
-                            px_size_ts_x = 11.6,
-                            px_size_ts_y = 11.6,
-                            px_size_x = 57.5,
-                            px_size_y = 58.7,
-                            x_col="x [nm]",
-                            y_col="y [nm]",
-                            sigma_col="sigma [nm]"
-                            )
-        
-        # Filtration based on sigma_nm value
-        filtered = df_added[df_added["sigma [nm]"] > 75]
-        
-        # Calculate outliers based on mean intensity of foci
+        groups.setdefault(key_from_csv(file), []).append((file, image))
+
+    return groups, calibration
+
+def load_field(group):
+    """I/O stage: read the foci tables of one image and decode the image."""
+    with stage("load"):
+        tables = [read_foci(file) for file, image in group]
+        return tables, load_gray(group[0][1])
+
+def measure_tables(key, group, tables, gray, calibration):
+    """MFI_foci of every foci table (nucleus) of a 2D image, with Nucleus_id."""
+    # one summed-area table per image, shared by the foci tables of all its nuclei
+    regions = RegionMeans(gray) if gray is not None else None
+    parts = []
+    for (file, image), df in zip(group, tables):
+        with stage("MFI_foci"):
+            df = MFI_foci(image_path = image,
+                          df = df,
+                          px_size_ts_x = 11.6,
+                          px_size_ts_y = 11.6,
+                          px_size_x = calibration.at[file.name, "px_size_x"],
+                          px_size_y = calibration.at[file.name, "px_size_y"],
+                          x_col="x [nm]",
+                          y_col="y [nm]",
+                          sigma_col="sigma [nm]",
+                          gray = gray,
+                          regions = regions
+                          )
+        df.insert(0, "Nucleus_id", nucleus_from_csv(file, key))
+        parts.append(df)
+    return parts
+
+def measure_stack(key, group, tables, image, calibration):
+    """
+    MFI_foci of every foci table (nucleus) of a stack: the foci of all tables are
+    measured together, so each frame is converted to gray and summed only once per image.
+    """
+    pixels = []
+    for (file, image_path), df in zip(group, tables):
+        pixels.append(foci_pixels(df,
+                                  px_size_ts_x = 11.6,
+                                  px_size_ts_y = 11.6,
+                                  px_size_x = calibration.at[file.name, "px_size_x"],
+                                  px_size_y = calibration.at[file.name, "px_size_y"]))
+    x_arr, y_arr, sigma_arr = (np.concatenate(arrays) for arrays in zip(*pixels))
+    frames = np.concatenate([df["frame"].to_numpy(dtype=np.int64) for df in tables])
+    with stage("MFI_foci"):
+        mean_arr, bg_arr, bg_std = stack_intensities(image, frames, x_arr, y_arr, sigma_arr)
+
+    parts = []
+    start = 0
+    for (file, image_path), df, (x, y, sigma) in zip(group, tables, pixels):
+        rows = slice(start, start + len(df))
+        start += len(df)
+        df = with_intensities(df, x, y, sigma, mean_arr[rows], bg_arr[rows], bg_std[rows])
+        df.insert(0, "Nucleus_id", nucleus_from_csv(file, key))
+        parts.append(df)
+    return parts
+
+def measure_field(key, group, tables, gray, calibration):
+    """
+    Compute stage of one image: MFI of every focus, sigma filter and outlier call.
+    Returns (filtered foci table, upper bound of the outlier call).
+    """
+    image = group[0][1]
+    if (gray is None and image is not None and all("frame" in df.columns for df in tables)
+            and n_frames(image) > 1):
+        # stack: every frame is converted and summed once for the foci of all nuclei
+        parts = measure_stack(key, group, tables, image, calibration)
+    else:
+        parts = measure_tables(key, group, tables, gray, calibration)
+    with stage("concat"):
+        df_added = pd.concat(parts, ignore_index=True)
+        df_added["Nucleus_id"] = df_added["Nucleus_id"].astype(KEY)
+
+    # Filtration based on sigma_nm value
+    filtered = df_added[df_added["sigma [nm]"] > 75].copy()
+
+    # Calculate outliers based on mean intensity of foci
+    if "frame" in filtered.columns and filtered["frame"].nunique() > 1:
+        # time-lapse: bound per frame, so bleaching does not shift the outlier call
+        grouped = filtered.groupby("frame")["mean_intensity"]
+        Q1 = grouped.transform(lambda d: np.percentile(d, 25))
+        Q3 = grouped.transform(lambda d: np.percentile(d, 75))
+        upper = Q3 + 1.5 * (Q3 - Q1)
+        upper_bound = float(np.median(upper))
+    else:
         data = filtered["mean_intensity"]
         Q1 = np.percentile(data, 25)
         Q3 = np.percentile(data, 75)
         IQR = Q3 - Q1
         upper_bound = Q3 + 1.5 * IQR
+        upper = upper_bound
+
+    # Create new bool column 'Outlier'
+    filtered["Outlier"] = (filtered["mean_intensity"] > upper).to_numpy(dtype=bool)
+    n_outliers = int(filtered["Outlier"].sum())
+
+    print(f"File {key}: keep {filtered.shape[0]} out of {df_added.shape[0]} foci. Number of outliers: {n_outliers}")
 
-        # Create new bool column 'Outlier'
-        filtered["Outlier"] = filtered["mean_intensity"] > upper_bound
-        n_outliers = sum(filtered["Outlier"])
+    return filtered, upper_bound
 
-        print(f"File {key_from_csv(file)}: keep {filtered.shape[0]} out of {df_added.shape[0]} foci. Number of outliers: {n_outliers}")
-        
+def write_field(filtered, key, file, upper_bound):
+    """Output stage: extended table + histogram next to the foci tables."""
+    with stage("write"):
         # Export
-        new_name = key_from_csv(file) + "_extent.csv"
+        new_name = key + "_extent.csv"
         new_path = file.with_name(new_name)
         filtered.to_csv(new_path, index=False) # export new extended dataframe
 
         # Plot histogram of foci mean and intensity and save it
-        plot_path = file.with_name(key_from_csv(file) + "_hist.jpg")
+        plot_path = file.with_name(key + "_hist.jpg")
         plot_histogram(df = filtered, column = "mean_intensity", bins=50,
                    xlabel="Foci mean intensity",
-                   title=key_from_csv(file),
+                   title=key,
                    figsize=(4, 3),
                    dpi=300,
                    save_path=plot_path,
                    threshold = upper_bound)
 
-        #print(f"File {new_name} is saved.")
-    
-def aggregation_foci(dir):
+def MFI_field(key, group, calibration):
+    """
+    One image end to end (load, measure, write): the work unit of distributed runs.
+    Returns the number of kept foci.
+    """
+    tables, gray = load_field(group)
+    filtered, upper_bound = measure_field(key, group, tables, gray, calibration)
+    write_field(filtered, key, group[0][0], upper_bound)
+    return len(filtered)
+
+def MFI_foci_all(dir_images, dir_foci, prefetch_depth=2, qc=None):
+    """
+    qc : optional qc.QCWorker, every measured image is handed to it for rendering.
+    """
+    groups, calibration = foci_groups(dir_images, dir_foci)
+
+    # Calculate MFI of each foci: the next images/tables are prefetched and outputs are
+    # written asynchronously while the current image is computed (bounded queues)
+    load = lambda item: load_field(item[1])
+    with AsyncWriter(max_pending=prefetch_depth) as writer:
+        for (key, group), (tables, gray) in prefetch(groups.items(), load, depth=prefetch_depth):
+            filtered, upper_bound = measure_field(key, group, tables, gray, calibration)
+            writer.submit(write_field, filtered, key, group[0][0], upper_bound)
+            if qc is not None:
+                qc.submit(key, filtered)
+
+def aggregation_foci(dir, model=None):
+    """
+    Per-file summary of foci tables (*_extent.csv).
+    If a cluster model (see clustering.py) is given, the cluster composition
+    of each file is added as Cluster_<i>_number / Cluster_<i>_fraction columns.
+    """
     path_files = Path(str(dir).strip())
     files = sorted(path_files.glob("*_extent.csv"))
     foci_rows = []
@@ -260,8 +561,7 @@ def aggregation_foci(dir):
     for f in files:
         k = key_from_csv(f)
         k = k[:-7]
-        df = pd.read_csv(f)
-        df.columns = df.columns.str.strip()
+        df = read_foci(f)
 
             # Count rows
         foci_rows.append({
@@ -270,15 +570,109 @@ def aggregation_foci(dir):
             "All_foci_IFI_photons": check_column_mean(df, "intensity [photon]"),
             "All_foci_MFI_px": check_column_mean(df, "mean_intensity"),
             "All_foci_sigma_nm": check_column_mean(df, "sigma [nm]"),
-            "Outliers_number": sum(df["Outlier"]),
+            "Outliers_number": int(df["Outlier"].sum()),
             "Outliers_MFI_px": check_column_mean(df[df["Outlier"] == True], "mean_intensity"),
             "Outliers_sigma_nm": check_column_mean(df[df["Outlier"] == True], "sigma [nm]")
         })
 
+        if model is not None:
+            labels = predict_clusters(df, model)
+            foci_rows[-1].update(cluster_composition(labels, model["kmeans"].n_clusters))
+
     foci_summary = pd.DataFrame(foci_rows)
 
     return foci_summary
 
+def aggregation_nuclei(dir, df_nuclei):
+    """
+    Per-nucleus summary: all *_extent.csv tables are stacked once and grouped by
+    (File_name, Nucleus_id) in a single vectorized group-by, then joined to the nuclei table.
+    Nuclei without foci keep Foci_number = 0.
+    """
+    path_files = Path(str(dir).strip())
+    cols = ["Nucleus_id", "intensity [photon]", "mean_intensity", "sigma [nm]", "Outlier"]
+    dfs = []
+
+    for f in sorted(path_files.glob("*_extent.csv")):
+        df = read_foci(f, required=["mean_intensity", "sigma [nm]", "Outlier"],
+                       usecols=lambda c: c.strip() in cols)
+        if "Nucleus_id" not in df.columns:
+            df["Nucleus_id"] = "1"
+        df["File_name"] = key_from_csv(f)[:-7]
+        dfs.append(df)
+
+    nuclei = df_nuclei.copy()
+    if not dfs:
+        nuclei["Foci_number"] = 0
+        return nuclei
+
+    foci = pd.concat(dfs, ignore_index=True)
+    if "intensity [photon]" not in foci.columns:
+        foci["intensity [photon]"] = np.nan
+    foci["File_name"] = foci["File_name"].astype(KEY)
+    foci["Nucleus_id"] = foci["Nucleus_id"].astype(KEY)
+
+    # helper columns: outlier-only values (NaN elsewhere) -> plain means in the same group-by
+    foci["_out_mfi"] = foci["mean_intensity"].where(foci["Outlier"])
+    foci["_out_sigma"] = foci["sigma [nm]"].where(foci["Outlier"])
+
+    summary = foci.groupby(["File_name", "Nucleus_id"], observed=True, sort=False).agg(
+        Foci_number=("mean_intensity", "size"),
+        All_foci_IFI_photons=("intensity [photon]", "mean"),
+        All_foci_MFI_px=("mean_intensity", "mean"),
+        All_foci_sigma_nm=("sigma [nm]", "mean"),
+        Outliers_number=("Outlier", "sum"),
+        Outliers_MFI_px=("_out_mfi", "mean"),
+        Outliers_sigma_nm=("_out_sigma", "mean"),
+    ).reset_index()
+
+    # same categories on both sides: the merge joins the category codes, no object keys
+    align_categories(nuclei, summary, ["File_name", "Nucleus_id"])
+    merged = nuclei.merge(summary, on=["File_name", "Nucleus_id"], how="left")
+    merged[["Foci_number", "Outliers_number"]] = merged[["Foci_number", "Outliers_number"]].fillna(0).astype(int)
+    return merged
+
+def aggregation_foci_frames(dir):
+    """
+    Per-nucleus, per-frame summary of time-lapse foci tables (*_extent.csv with a frame column),
+    grouped by (File_name, Nucleus_id, frame).
+    Returns an empty DataFrame if no table has more than one frame.
+    """
+    path_files = Path(str(dir).strip())
+    dfs = []
+
+    for f in sorted(path_files.glob("*_extent.csv")):
+        df = read_foci(f)
+        if "frame" not in df.columns or df["frame"].nunique() < 2:
+            continue
+        if "Nucleus_id" not in df.columns:
+            df["Nucleus_id"] = "1"
+        if "intensity [photon]" not in df.columns:
+            df["intensity [photon]"] = np.nan
+        df["File_name"] = key_from_csv(f)[:-7]
+        dfs.append(df)
+
+    if not dfs:
+        return pd.DataFrame()
+
+    foci = pd.concat(dfs, ignore_index=True)
+    foci["File_name"] = foci["File_name"].astype(KEY)
+    foci["Nucleus_id"] = foci["Nucleus_id"].astype(KEY)
+    foci["_out_mfi"] = foci["mean_intensity"].where(foci["Outlier"])
+    foci["_out_sigma"] = foci["sigma [nm]"].where(foci["Outlier"])
+
+    out = foci.groupby(["File_name", "Nucleus_id", "frame"], observed=True).agg(
+        Foci_number=("mean_intensity", "size"),
+        All_foci_IFI_photons=("intensity [photon]", "mean"),
+        All_foci_MFI_px=("mean_intensity", "mean"),
+        All_foci_sigma_nm=("sigma [nm]", "mean"),
+        Outliers_number=("Outlier", "sum"),
+        Outliers_MFI_px=("_out_mfi", "mean"),
+        Outliers_sigma_nm=("_out_sigma", "mean"),
+    ).reset_index()
+    out["Outliers_number"] = out["Outliers_number"].astype(int)
+    return out
+
 def _sprearman_correlation(df):
     cols = df.select_dtypes(include="number").columns
     pairs = []
@@ -296,20 +690,189 @@ def _sprearman_correlation(df):
     return pairs_df
 
 
-def main(p1, p2, output_dir):
-    df_nuclei = aggregate_nuclei_data(dir_nuclei_stat = p1)
-    MFI_foci_all(dir_images = p1, dir_foci = p2)
-    results = aggregation_foci(dir = p2)
+def main(p1, p2, output_dir, model_path=None, qc=False):
+    """
+    With LLPS_PROFILE=1 (or --profile) a per-stage memory report is written
+    into output_dir as well (see profiling.py).
+    With qc, overlays, thumbnails and p2/qc/index.html are rendered (see qc.py)
+    in a background thread while the results are aggregated.
+    """
+    with stage("main"):
+        merged = _main(p1, p2, output_dir, model_path, qc)
+    profiling.write_report(output_dir)
+    return merged
+
+def _main(p1, p2, output_dir, model_path=None, qc=False):
+    model = load_model(model_path) if model_path else None
+
+    with stage("aggregate_nuclei_data"):
+        df_nuclei = aggregate_nuclei_data(dir_nuclei_stat = p1)
+
+    if not qc:
+        with stage("MFI_foci_all"):
+            MFI_foci_all(dir_images = p1, dir_foci = p2)
+        return aggregate_results(df_nuclei, p2, output_dir, model)
+
+    # QC overlays are rendered image by image while the next images are measured
+    from qc import QCWorker
+    with QCWorker(p1, p2) as worker:
+        with stage("MFI_foci_all"):
+            MFI_foci_all(dir_images = p1, dir_foci = p2, qc = worker)
+        merged = aggregate_results(df_nuclei, p2, output_dir, model)
+    return merged
+
+def aggregate_results(df_nuclei, p2, output_dir, model=None):
+    """
+    Summaries of the *_extent.csv tables of p2 joined with the nuclei table:
+    results.csv (per file), results_nuclei.csv (per nucleus) and, for time-lapses,
+    results_frames.csv (per nucleus and frame, joined on File_name and Nucleus_id) in output_dir.
+    """
+    with stage("aggregation_foci"):
+        results = aggregation_foci(dir = p2, model = model)
 
-    merged = df_nuclei.merge(results, on="File_name", how="left")
+    merged = df_nuclei.drop(columns="Nucleus_id").merge(results, on="File_name", how="left")
 
     # Results export
     merged.to_csv(f"{output_dir}/results.csv", index=False)
     print(f"Aggregated results.csv file is saved in the directory: {output_dir}.")
+
+    # Object-level table: one row per nucleus
+    with stage("aggregation_nuclei"):
+        per_nucleus = aggregation_nuclei(dir = p2, df_nuclei = df_nuclei)
+    per_nucleus.to_csv(f"{output_dir}/results_nuclei.csv", index=False)
+    print(f"Per-nucleus results_nuclei.csv file is saved in the directory: {output_dir}.")
+
+    # Time-lapse data: one row per file and frame
+    with stage("aggregation_foci_frames"):
+        frames = aggregation_foci_frames(dir = p2)
+    if not frames.empty:
+        # one row per nucleus and frame, joined on both categorical keys with aligned categories;
+        # 1:m fails loudly if a nucleus is listed twice
+        nuclei = df_nuclei.copy()
+        align_categories(nuclei, frames, ["File_name", "Nucleus_id"])
+        frames = nuclei.merge(frames, on=["File_name", "Nucleus_id"], how="right", validate="1:m")
+        unmatched = frames["Nucleus_area"].isna().sum()
+        if unmatched:
+            print(f"WARNING: {unmatched} per-frame rows have no nucleus in the nuclei table.")
+        frames.to_csv(f"{output_dir}/results_frames.csv", index=False)
+        print(f"Per-frame results_frames.csv file is saved in the directory: {output_dir}.")
+
+    return merged
  
+def cluster(dirs, model_path, n_clusters=3, features=FEATURES, batch_size=4096, n_epochs=3):
+    """
+    Fit a foci cluster model on all *_extent.csv files of the given run directories
+    and save it, together with the cluster centers table, next to model_path.
+    """
+    model = fit_clusters(dirs, n_clusters=n_clusters, features=features,
+                         batch_size=batch_size, n_epochs=n_epochs)
+    save_model(model, model_path)
+
+    centers_path = Path(model_path).with_suffix(".centers.csv")
+    cluster_centers(model).to_csv(centers_path)
+    print(f"Cluster model is saved: {model_path}. Centers: {centers_path}.")
+    return model
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="LLPS nuclei and foci statistics.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run = sub.add_parser("run", help="Aggregate nuclei and foci data of one experiment into results.csv.")
+    run.add_argument("p1", help="Directory with nucleus Area and Mean (*_roi.csv) and images (*.tif)")
+    run.add_argument("p2", help="Directory with ThunderSTORM data")
+    run.add_argument("output_dir", help="Directory to save results.csv")
+    run.add_argument("--model", default=None, help="Saved cluster model to add cluster composition")
+    run.add_argument("--profile", action="store_true", help="Write a per-stage memory report (profile_*.csv)")
+    run.add_argument("--profile-allocations", type=int, default=0, metavar="N",
+                     help="With --profile: top N allocation sites per stage (slow tracemalloc snapshots)")
+    run.add_argument("--qc", action="store_true", help="Render QC overlays, thumbnails and qc/index.html")
+
+    qc = sub.add_parser("qc", help="Render QC overlays, thumbnails and an HTML contact sheet of a finished run.")
+    qc.add_argument("p1", help="Directory with images (*.tif) and nuclei masks (*_mask.jpg)")
+    qc.add_argument("p2", help="Directory with *_extent.csv tables")
+    qc.add_argument("--out", default=None, help="QC directory (default: <p2>/qc)")
+    qc.add_argument("--thumb-size", type=int, default=256, help="Longest side of the thumbnails (pixels)")
+
+    clu = sub.add_parser("cluster", help="Fit a mini-batch k-means model on foci of one or several runs.")
+    clu.add_argument("dirs", nargs="+", help="Run directories with *_extent.csv files")
+    clu.add_argument("--model", required=True, help="Output path of the cluster model (.pkl)")
+    clu.add_argument("--n-clusters", type=int, default=3)
+    clu.add_argument("--features", nargs="+", default=FEATURES)
+    clu.add_argument("--batch-size", type=int, default=4096)
+    clu.add_argument("--epochs", type=int, default=3)
+
+    bat = sub.add_parser("batch", help="Run many experiments listed in a manifest (.csv/.yaml) on a worker pool.")
+    bat.add_argument("manifest", help="Manifest with columns experiment, nuclei_dir, foci_dir, [output_dir], conditions...")
+    bat.add_argument("output_dir", help="Directory for results_all.csv, timing.csv and the progress journal")
+    bat.add_argument("--workers", type=int, default=None, help="Number of worker processes (default: CPU count)")
+    bat.add_argument("--no-resume", action="store_true", help="Re-run experiments already marked as done")
+    bat.add_argument("--model", default=None, help="Saved cluster model to add cluster composition")
+    bat.add_argument("--db", default=None, help="SQLite results database to ingest finished experiments into")
+    bat.add_argument("--profile", action="store_true", help="Write a memory report into every experiment output_dir")
+    bat.add_argument("--profile-allocations", type=int, default=0, metavar="N",
+                     help="With --profile: top N allocation sites per stage (slow tracemalloc snapshots)")
+
+    dis = sub.add_parser("distributed", help="Run a manifest as per-image work units on a local pool or a dask cluster.")
+    dis.add_argument("manifest", help="Manifest with columns experiment, nuclei_dir, foci_dir, [output_dir], conditions...")
+    dis.add_argument("output_dir", help="Directory for results_all.csv, units.csv and the progress journal")
+    dis.add_argument("--scheduler", default="local", help="'local' or a dask scheduler address (tcp://host:8786)")
+    dis.add_argument("--workers", type=int, default=None, help="Worker processes of the local scheduler")
+    dis.add_argument("--retries", type=int, default=2, help="Re-submissions of a failed unit")
+    dis.add_argument("--no-resume", action="store_true", help="Re-run units already marked as done")
+    dis.add_argument("--model", default=None, help="Saved cluster model to add cluster composition")
+
+    cmp = sub.add_parser("compare", help="Compare every feature between conditions of a results table.")
+    cmp.add_argument("table", help="Results table with a condition column (e.g. results_all.csv)")
+    cmp.add_argument("--condition", default="condition", help="Column with the condition of every row")
+    cmp.add_argument("--reference", default=None, help="Condition compared to all others (default: first in the table)")
+    cmp.add_argument("--all-pairs", action="store_true", help="Compare every pair of conditions")
+    cmp.add_argument("--features", nargs="+", default=None, help="Columns to compare (default: all numeric)")
+    cmp.add_argument("--n-boot", type=int, default=2000, help="Bootstrap resamples for the CIs (0 = none)")
+    cmp.add_argument("--ci", type=float, default=0.95)
+    cmp.add_argument("--alpha", type=float, default=0.05, help="FDR level of the 'significant' column")
+    cmp.add_argument("--seed", type=int, default=0)
+    cmp.add_argument("--workers", type=int, default=None, help="Bootstrap worker processes (default: CPU count)")
+    cmp.add_argument("--out", default=None, help="Output CSV (default: comparisons.csv next to the table)")
+
+    ing = sub.add_parser("ingest", help="Load a finished run directory into the SQLite results database.")
+    ing.add_argument("db", help="Database file (created if missing)")
+    ing.add_argument("run_dir", help="Directory with results.csv and results_nuclei.csv")
+    ing.add_argument("--foci-dir", default=None, help="Directory with the *_extent.csv tables (default: run_dir)")
+    ing.add_argument("--experiment", required=True, help="Unique experiment name (re-ingesting replaces it)")
+    ing.add_argument("--condition", nargs="*", default=[], metavar="NAME=VALUE",
+                     help="Condition columns, e.g. condition=WT cell_line=U2OS")
+
+    return parser
+
+
 if __name__ == "__main__":
-    p1 = "/mnt/c/users/Elena/Desktop/Data_processing/020226/WT_new" # path to directory with nucleus Area and Mean
-    p2 = "/mnt/c/users/Elena/Desktop/Data_processing/020226/WT_new_run" # path to ThunderSTORM data
-    output_dir = "/mnt/c/users/Elena/Desktop/Data_processing/020226/WT_new_run"
-    
-    main(p1, p2, output_dir)
\ No newline at end of file
+    args = build_parser().parse_args()
+    if getattr(args, "profile", False):
+        profiling.enable(top=args.profile_allocations)
+
+    if args.command == "run":
+        main(args.p1, args.p2, args.output_dir, model_path=args.model, qc=args.qc)
+    elif args.command == "qc":
+        from qc import render_run
+        render_run(args.p1, args.p2, qc_dir=args.out, thumb_size=args.thumb_size)
+    elif args.command == "cluster":
+        cluster(args.dirs, args.model, n_clusters=args.n_clusters, features=args.features,
+                batch_size=args.batch_size, n_epochs=args.epochs)
+    elif args.command == "batch":
+        from batch import run_manifest
+        run_manifest(args.manifest, args.output_dir, workers=args.workers,
+                     resume=not args.no_resume, model_path=args.model, db_path=args.db)
+    elif args.command == "distributed":
+        from scheduler import run_distributed
+        run_distributed(args.manifest, args.output_dir, scheduler=args.scheduler, workers=args.workers,
+                        retries=args.retries, resume=not args.no_resume, model_path=args.model)
+    elif args.command == "compare":
+        from compare import compare_table
+        compare_table(args.table, condition=args.condition, output=args.out, features=args.features,
+                      reference=args.reference, all_pairs=args.all_pairs, n_boot=args.n_boot, ci=args.ci,
+                      seed=args.seed, workers=args.workers, alpha=args.alpha)
+    elif args.command == "ingest":
+        from store import ingest_run
+        conditions = dict(c.split("=", 1) for c in args.condition)
+        ingest_run(args.db, args.run_dir, args.experiment, conditions, foci_dir=args.foci_dir)
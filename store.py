@@ -0,0 +1,196 @@
+from pathlib import Path
+from datetime import datetime
+import sqlite3
+import pandas as pd
+
+# table -> files it is ingested from (foci: from the ThunderSTORM directory, the rest from the run directory)
+TABLES = {
+    "files": "results.csv",
+    "nuclei": "results_nuclei.csv",
+    "foci": "*_extent.csv",
+}
+INDEXES = {
+    "files": ["run_id", "File_name"],
+    "nuclei": ["run_id", "File_name", "Nucleus_id"],
+    "foci": ["run_id", "File_name", "Nucleus_id"],
+}
+
+
+def connect(db_path):
+    """
+    Open (and create if needed) the results database: a single SQLite file.
+    """
+    db_path = Path(str(db_path).strip())
+    db_path.parent.mkdir(parents=True, exist_ok=True)
+    con = sqlite3.connect(db_path)
+    con.execute(
+        "CREATE TABLE IF NOT EXISTS runs ("
+        "run_id INTEGER PRIMARY KEY AUTOINCREMENT, "
+        "experiment TEXT UNIQUE NOT NULL, "
+        "path TEXT, "
+        "ingested TEXT)"
+    )
+    return con
+
+
+def _columns(con, table):
+    return [row[1] for row in con.execute(f'PRAGMA table_info("{table}")')]
+
+
+def _append(con, table, df, chunksize=50_000):
+    """
+    Append df to table, adding columns that the table does not have yet
+    (e.g. Cluster_<i>_* columns of runs with a cluster model).
+    Plain executemany on con, so the rows are part of the caller's transaction
+    (DataFrame.to_sql commits on its own).
+    """
+    existing = _columns(con, table)
+    if not existing:
+        con.execute(pd.io.sql.get_schema(df, table, con=con))
+    else:
+        for col in df.columns:
+            if col not in existing:
+                con.execute(f'ALTER TABLE "{table}" ADD COLUMN "{col}"')
+
+    quoted = ", ".join(f'"{c}"' for c in df.columns)
+    sql = f'INSERT INTO "{table}" ({quoted}) VALUES ({", ".join("?" * len(df.columns))})'
+    for start in range(0, len(df), chunksize):
+        chunk = df.iloc[start:start + chunksize]
+        con.executemany(sql, chunk.astype(object).where(chunk.notna(), None).to_numpy().tolist())
+
+
+def _ensure_indexes(con):
+    tables = {row[0] for row in con.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+    for table, cols in INDEXES.items():
+        if table not in tables:
+            continue
+        existing = _columns(con, table)
+        cols = [c for c in cols if c in existing]
+        name = f"idx_{table}_{'_'.join(c.lower() for c in cols)}"
+        quoted = ", ".join(f'"{c}"' for c in cols)
+        con.execute(f'CREATE INDEX IF NOT EXISTS "{name}" ON "{table}" ({quoted})')
+
+
+def ingest_run(db_path, run_dir, experiment, conditions=None, foci_dir=None):
+    """
+    Load one run (results.csv and results_nuclei.csv of run_dir, *_extent.csv of foci_dir,
+    default run_dir) into the database. Re-ingesting an experiment replaces its rows in a
+    single transaction: a failed ingest leaves the previous rows in place.
+    Condition values (dict) are stored as columns of the runs table and can be used as
+    filters in query().
+    """
+    run_dir = Path(str(run_dir).strip())
+    foci_dir = Path(str(foci_dir).strip()) if foci_dir is not None else run_dir
+    for d in (run_dir, foci_dir):
+        if not d.exists():
+            raise FileNotFoundError(f"Directory {d} is not found!")
+    conditions = dict(conditions or {})
+
+    con = connect(db_path)
+    con.isolation_level = None  # explicit BEGIN / COMMIT below
+    try:
+        con.execute("BEGIN")
+        try:
+            old = con.execute("SELECT run_id FROM runs WHERE experiment = ?", (experiment,)).fetchone()
+            if old is not None:
+                for table in TABLES:
+                    if _columns(con, table):
+                        con.execute(f'DELETE FROM "{table}" WHERE run_id = ?', (old[0],))
+                con.execute("DELETE FROM runs WHERE run_id = ?", (old[0],))
+
+            existing = _columns(con, "runs")
+            for name in conditions:
+                if name not in existing:
+                    con.execute(f'ALTER TABLE runs ADD COLUMN "{name}" TEXT')
+
+            cols = ["experiment", "path", "ingested"] + list(conditions)
+            values = [experiment, str(run_dir.resolve()), datetime.now().isoformat(timespec="seconds")]
+            values += [None if pd.isna(v) else str(v) for v in conditions.values()]
+            quoted = ", ".join(f'"{c}"' for c in cols)
+            cur = con.execute(f"INSERT INTO runs ({quoted}) VALUES ({', '.join('?' * len(cols))})", values)
+            run_id = cur.lastrowid
+
+            counts = {}
+            for table, pattern in TABLES.items():
+                n = 0
+                for f in sorted((foci_dir if table == "foci" else run_dir).glob(pattern)):
+                    df = pd.read_csv(f, dtype={"Nucleus_id": str})
+                    df.columns = df.columns.str.strip()
+                    if table == "foci":
+                        df.insert(0, "File_name", f.stem[:-len("_extent")])
+                    df.insert(0, "run_id", run_id)
+                    _append(con, table, df)
+                    n += len(df)
+                counts[table] = n
+
+            _ensure_indexes(con)
+        except BaseException:
+            con.execute("ROLLBACK")
+            raise
+        con.execute("COMMIT")
+    finally:
+        con.close()
+
+    if counts["foci"] == 0:
+        print(f"WARNING: no *_extent.csv tables in {foci_dir}, the foci table of {experiment} is empty.")
+    print(f"Experiment {experiment} is ingested into {db_path}: "
+          + ", ".join(f"{n} {t}" for t, n in counts.items()) + ".")
+    return run_id
+
+
+def query(db_path, table="nuclei", columns=None, where=None, **conditions):
+    """
+    Condition-filtered DataFrame from one table, joined with the run columns.
+
+    query("llps.sqlite", "nuclei", condition=["WT", "MGS1"])
+    query("llps.sqlite", "foci", columns=["mean_intensity", "sigma [nm]"], experiment="WT_020226")
+
+    conditions : run column = value or list of values
+    where      : optional extra SQL condition on the table (e.g. '"Outlier" = 1')
+    """
+    if table not in TABLES:
+        raise ValueError(f"Unknown table {table}. Choose from: {list(TABLES)}")
+
+    con = connect(db_path)
+    try:
+        run_cols = _columns(con, "runs")
+        table_cols = _columns(con, table)
+        if not table_cols:
+            return pd.DataFrame()
+
+        unknown = [c for c in conditions if c not in run_cols]
+        if unknown:
+            raise KeyError(f"Unknown run column(s) {unknown}. Found: {run_cols}")
+
+        select_runs = [c for c in run_cols if c not in ("run_id", "path", "ingested")]
+        if columns is None:
+            select_table = [c for c in table_cols if c != "run_id"]
+        else:
+            select_table = list(columns)
+        select = ", ".join([f'r."{c}"' for c in select_runs] + [f't."{c}"' for c in select_table])
+
+        sql = f'SELECT {select} FROM "{table}" t JOIN runs r ON t.run_id = r.run_id'
+        clauses, params = [], []
+        for name, value in conditions.items():
+            values = list(value) if isinstance(value, (list, tuple, set)) else [value]
+            clauses.append(f'r."{name}" IN ({", ".join("?" * len(values))})')
+            params.extend(str(v) for v in values)
+        if where:
+            clauses.append(f"({where})")
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+
+        return pd.read_sql_query(sql, con, params=params)
+    finally:
+        con.close()
+
+
+def runs(db_path):
+    """
+    All ingested runs with their condition columns.
+    """
+    con = connect(db_path)
+    try:
+        return pd.read_sql_query("SELECT * FROM runs ORDER BY run_id", con)
+    finally:
+        con.close()